@@ -0,0 +1 @@
+"""Benchmarks for process stats collection."""
@@ -0,0 +1,115 @@
+"""Run scrape benchmarks on synthetic ``/proc`` trees.
+
+Results are written as JSON.  If a baseline results file is passed, timings
+are compared to it, and the script fails if any is slower than the
+threshold.
+
+Run with::
+
+  python -m benchmarks --pids 100 1000 --threads 1 10 --regexps 1 20 \\
+      --output results.json [--baseline baseline.json]
+
+"""
+
+from argparse import ArgumentParser
+from itertools import product
+import json
+from pathlib import Path
+import sys
+from tempfile import TemporaryDirectory
+from typing import Any
+
+from .scrape import run_scrape_benchmark
+
+
+def compare(
+    results: list[dict[str, Any]],
+    baseline: list[dict[str, Any]],
+    threshold: float,
+) -> list[str]:
+    """Return descriptions of timings that regressed from the baseline."""
+    baseline_timings = {
+        tuple(sorted(result["params"].items())): result["timings"]
+        for result in baseline
+    }
+    regressions = []
+    for result in results:
+        params = tuple(sorted(result["params"].items()))
+        previous = baseline_timings.get(params)
+        if previous is None:
+            continue
+        for stage, timing in result["timings"].items():
+            if stage not in previous:
+                continue
+            ratio = timing / previous[stage]
+            if ratio > threshold:
+                regressions.append(
+                    f"{dict(params)} {stage}: {previous[stage]:.6f}s -> "
+                    f"{timing:.6f}s ({ratio:.2f}x)"
+                )
+    return regressions
+
+
+def main():
+    parser = ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "--pids", type=int, nargs="+", default=[1000], help="process counts"
+    )
+    parser.add_argument(
+        "--threads",
+        type=int,
+        nargs="+",
+        default=[1],
+        help="threads per process",
+    )
+    parser.add_argument(
+        "--regexps", type=int, nargs="+", default=[1], help="regexp counts"
+    )
+    parser.add_argument(
+        "--repeat", type=int, default=5, help="number of repetitions"
+    )
+    parser.add_argument(
+        "--output", type=Path, help="file to write JSON results to"
+    )
+    parser.add_argument(
+        "--baseline", type=Path, help="JSON results file to compare with"
+    )
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=1.2,
+        help="slowdown ratio from the baseline that counts as regression",
+    )
+    args = parser.parse_args()
+
+    results = []
+    with TemporaryDirectory() as tempdir:
+        for pids, threads, regexps in product(
+            args.pids, args.threads, args.regexps
+        ):
+            result = run_scrape_benchmark(
+                Path(tempdir), pids, threads, regexps, repeat=args.repeat
+            )
+            results.append(result)
+            timings = " ".join(
+                f"{stage}={timing * 1000:.2f}ms"
+                for stage, timing in result["timings"].items()
+            )
+            print(f"pids={pids} threads={threads} regexps={regexps} {timings}")
+
+    output = json.dumps(results, indent=2)
+    if args.output:
+        args.output.write_text(output)
+    else:
+        print(output)
+
+    if args.baseline:
+        baseline = json.loads(args.baseline.read_text())
+        regressions = compare(results, baseline, args.threshold)
+        for regression in regressions:
+            print(f"regression: {regression}", file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+
+
+main()
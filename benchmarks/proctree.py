@@ -0,0 +1,78 @@
+"""Generate synthetic ``/proc`` trees."""
+
+from pathlib import Path
+import random
+
+# Memory values, in kB
+_VMHWM_KB = (1024, 4096, 65536, 262144)
+
+
+def make_proc_tree(
+    path: Path,
+    pids: int,
+    threads: int = 1,
+    commands: int = 50,
+    seed: int = 0,
+) -> list[str]:
+    """Create a synthetic ``/proc`` tree under the given path.
+
+    :param path: the directory to create the tree in.
+    :param pids: the number of processes.
+    :param threads: the number of tasks for each process.
+    :param commands: the number of distinct commands run by processes.
+    :param seed: the seed for generated values.
+    :return: a list with names of the commands.
+
+    """
+    rand = random.Random(seed)
+    names = [f"worker{idx}" for idx in range(commands)]
+    path.mkdir(parents=True, exist_ok=True)
+    for idx in range(pids):
+        pid = idx + 1
+        name = names[idx % commands]
+        pid_dir = path / str(pid)
+        pid_dir.mkdir()
+        (pid_dir / "cmdline").write_bytes(
+            f"/usr/bin/{name}\x00--id\x00{pid}\x00".encode()
+        )
+        (pid_dir / "comm").write_text(f"{name}\n")
+        (pid_dir / "stat").write_text(_stat(pid, name, rand))
+        (pid_dir / "status").write_text(_status(name, threads, rand))
+        (pid_dir / "sched").write_text(_sched(pid, name, threads, rand))
+        task_dir = pid_dir / "task"
+        task_dir.mkdir()
+        for tid_idx in range(threads):
+            tid = pid if tid_idx == 0 else pids + pid * threads + tid_idx
+            tid_dir = task_dir / str(tid)
+            tid_dir.mkdir()
+            (tid_dir / "stat").write_text(_stat(tid, name, rand))
+    return names
+
+
+def _stat(pid: int, name: str, rand: random.Random) -> str:
+    state = rand.choice("RSSSSSDI")
+    values = [rand.randrange(10000) for _ in range(41)]
+    fields = " ".join(str(value) for value in values)
+    return f"{pid} ({name}) {state} {fields}\n"
+
+
+def _status(name: str, threads: int, rand: random.Random) -> str:
+    return (
+        f"Name:\t{name}\n"
+        f"VmHWM:\t{rand.choice(_VMHWM_KB)} kB\n"
+        f"VmRSS:\t{rand.choice(_VMHWM_KB)} kB\n"
+        f"Threads:\t{threads}\n"
+        f"voluntary_ctxt_switches:\t{rand.randrange(10000)}\n"
+        f"nonvoluntary_ctxt_switches:\t{rand.randrange(10000)}\n"
+    )
+
+
+def _sched(pid: int, name: str, threads: int, rand: random.Random) -> str:
+    return (
+        f"{name} ({pid}, #threads: {threads})\n"
+        f"{'-' * 63}\n"
+        f"se.sum_exec_runtime{' ' * 26}:{rand.random() * 1000:>21.6f}\n"
+        f"nr_switches{' ' * 34}:{rand.randrange(10000):>21}\n"
+        f"nr_voluntary_switches{' ' * 24}:{rand.randrange(10000):>21}\n"
+        f"nr_involuntary_switches{' ' * 22}:{rand.randrange(10000):>21}\n"
+    )
@@ -0,0 +1,101 @@
+"""Benchmark the scrape hot path on a synthetic ``/proc`` tree."""
+
+from collections.abc import Callable
+from functools import partial
+import logging
+from pathlib import Path
+import re
+import timeit
+from typing import Any
+
+from prometheus_aioexporter import MetricsRegistry
+
+from process_stats_exporter.metrics import ProcessMetricsHandler
+from process_stats_exporter.process import (
+    get_process_iterator,
+    ProcessCache,
+)
+from process_stats_exporter.procfs import iter_pids
+from process_stats_exporter.sample import SampleStore
+
+from .proctree import make_proc_tree
+
+
+def make_regexps(names: list[str], count: int) -> list[re.Pattern]:
+    """Return regexps matching commands, half of them with label groups."""
+    regexps = []
+    for idx in range(count):
+        name = names[idx % len(names)]
+        if idx % 2:
+            regexps.append(re.compile(rf"/(?P<exe>{name})\b.*--id (?P<id>\d)"))
+        else:
+            regexps.append(re.compile(rf"{name}\b"))
+    return regexps
+
+
+def run_scrape_benchmark(
+    path: Path,
+    pids: int,
+    threads: int,
+    regexps: int,
+    repeat: int = 5,
+) -> dict[str, Any]:
+    """Run the scrape benchmark on a synthetic tree and return results.
+
+    Timings (in seconds, the minimum across repetitions) are reported for
+    each stage of a scrape, and for the full metrics update.
+
+    """
+    proc = path / f"proc-{pids}-{threads}-{regexps}"
+    names = make_proc_tree(proc, pids, threads=threads)
+    cmdline_regexps = make_regexps(names, regexps)
+    process_iterator = partial(get_process_iterator, str(proc))
+    handler = ProcessMetricsHandler(
+        logging.getLogger("benchmark"),
+        cmdline_regexps=cmdline_regexps,
+        get_process_iterator=process_iterator,
+    )
+    metrics = MetricsRegistry().create_metrics(handler.get_metric_configs())
+
+    cache = ProcessCache()
+    matched = list(
+        process_iterator(cmdline_regexps=cmdline_regexps, cache=cache)
+    )
+    samples = handler.collect().samples
+
+    def collect():
+        store = SampleStore(handler._value_names)
+        for _, process in matched:
+            store.add_process(process.pid)
+            for collector in handler._collectors:
+                collector.collect(process, store)
+
+    def time(func: Callable[[], Any]) -> float:
+        return min(timeit.repeat(func, number=1, repeat=repeat))
+
+    timings = {
+        "scan": time(lambda: list(iter_pids(proc))),
+        "filter": time(
+            lambda: list(
+                process_iterator(
+                    cmdline_regexps=cmdline_regexps, cache=ProcessCache()
+                )
+            )
+        ),
+        "filter_cached": time(
+            lambda: list(
+                process_iterator(cmdline_regexps=cmdline_regexps, cache=cache)
+            )
+        ),
+        "collect": time(collect),
+        "label": time(
+            lambda: [labeler(process) for labeler, process in matched]
+        ),
+        "update": time(lambda: handler.apply_samples(metrics, samples)),
+        "total": time(lambda: handler.update_metrics(metrics)),
+    }
+    return {
+        "params": {"pids": pids, "threads": threads, "regexps": regexps},
+        "matched": len(matched),
+        "timings": timings,
+    }
@@ -0,0 +1,105 @@
+"""Compare reading process stats with lxstats and the fast reader.
+
+Run with::
+
+  python -m benchmarks.stats_read [--proc /proc] [--repeat 5]
+
+"""
+
+from argparse import ArgumentParser
+import os
+import timeit
+
+from lxstats.process import Process
+
+from process_stats_exporter.procfs import ProcfsProcess
+from process_stats_exporter.sample import SampleStore
+from process_stats_exporter.stats import (
+    ProcessStatsCollector,
+    ProcessTasksStatsCollector,
+)
+
+
+def lxstats_read(processes: list[Process]):
+    """Read stats for processes parsing all files with lxstats."""
+    stats = [stat.stat for stat in ProcessStatsCollector._STATS]
+    for process in processes:
+        process.collect_stats()
+        for stat in stats:
+            process.get(stat)
+
+
+def fast_read(
+    processes: list[ProcfsProcess], collector: ProcessStatsCollector
+):
+    """Read stats for processes with the fast reader."""
+    store = SampleStore(config.name for config in collector.metrics())
+    for process in processes:
+        store.add_process(process.pid)
+        collector.collect(process, store)
+
+
+def lxstats_read_tasks(processes: list[Process]):
+    """Read task states for processes parsing all task files with lxstats."""
+    for process in processes:
+        for task in process.tasks():
+            task.collect_stats()
+            task.get("stat.state")
+
+
+def fast_read_tasks(
+    processes: list[ProcfsProcess], collector: ProcessTasksStatsCollector
+):
+    """Read task states for processes with the fast reader."""
+    store = SampleStore(config.name for config in collector.metrics())
+    for process in processes:
+        store.add_process(process.pid)
+        collector.collect(process, store)
+
+
+def compare(name: str, baseline, fast, count: int, repeat: int):
+    """Print timings for the baseline and fast functions."""
+    timings = {
+        "lxstats": min(timeit.repeat(baseline, number=1, repeat=repeat)),
+        "fast": min(timeit.repeat(fast, number=1, repeat=repeat)),
+    }
+    print(f"{name} ({count} processes)")
+    for label, timing in timings.items():
+        per_process = timing / max(count, 1) * 1e6
+        print(f"{label:>9}: {timing:.4f}s ({per_process:.1f}us per process)")
+    print(f"  speedup: {timings['lxstats'] / timings['fast']:.1f}x")
+
+
+def main():
+    parser = ArgumentParser(description=__doc__)
+    parser.add_argument("--proc", default="/proc", help="/proc directory")
+    parser.add_argument(
+        "--repeat", type=int, default=5, help="number of repetitions"
+    )
+    args = parser.parse_args()
+
+    processes = [
+        ProcfsProcess(int(name), os.path.join(args.proc, name))
+        for name in os.listdir(args.proc)
+        if name.isdigit()
+    ]
+    collector = ProcessStatsCollector()
+    compare(
+        "process stats",
+        lambda: lxstats_read(processes),
+        lambda: fast_read(processes, collector),
+        len(processes),
+        args.repeat,
+    )
+    tasks_collector = ProcessTasksStatsCollector()
+    compare(
+        "task states",
+        lambda: lxstats_read_tasks(processes),
+        lambda: fast_read_tasks(processes, tasks_collector),
+        len(processes),
+        args.repeat,
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+"""Aggregate metric values for processes with the same labels."""
+
+from collections.abc import (
+    Callable,
+    Iterable,
+)
+import math
+import operator
+from typing import Any
+
+from prometheus_aioexporter import MetricConfig
+
+from .sample import SampleStore
+
+# Functions to combine gauge values for processes in a group
+AGGREGATIONS: dict[str, Callable[[Any, Any], Any]] = {
+    "sum": operator.add,
+    "max": max,
+}
+
+PROCESS_COUNT_METRIC = "proc_count"
+
+
+class Aggregator:
+    """Aggregate samples for processes with the same labels.
+
+    Counter values are summed, gauge values are combined with the specified
+    aggregation function.  The number of processes in each group is reported
+    in an additional metric.
+
+    """
+
+    def __init__(
+        self, metric_configs: Iterable[MetricConfig], function: str = "sum"
+    ):
+        configs = list(metric_configs)
+        gauge_function = AGGREGATIONS[function]
+        self._metric_names = [config.name for config in configs]
+        self._functions = [
+            operator.add if config.type == "counter" else gauge_function
+            for config in configs
+        ]
+        self._labels = configs[0].config["labels"] if configs else []
+
+    def metric_configs(self) -> list[MetricConfig]:
+        """Return MetricConfigs for metrics added by aggregation."""
+        return [
+            MetricConfig(
+                PROCESS_COUNT_METRIC,
+                "Number of processes",
+                "gauge",
+                {"labels": self._labels},
+            )
+        ]
+
+    def aggregate(self, store: SampleStore) -> SampleStore:
+        """Return a store with a row for each set of labels in samples.
+
+        Aggregated rows have the PID and start time of the first process in
+        the group.  Empty values are skipped, so a value is empty only if
+        it's empty for all processes in the group.
+
+        """
+        groups: dict[tuple[str, ...], list[int]] = {}
+        for index, labels in enumerate(store.labels):
+            groups.setdefault(labels, []).append(index)
+
+        result = SampleStore(self._metric_names + [PROCESS_COUNT_METRIC])
+        columns = [store.columns[name] for name in self._metric_names]
+        for labels, indexes in groups.items():
+            values = {}
+            for name, function, column in zip(
+                self._metric_names, self._functions, columns
+            ):
+                value = None
+                for index in indexes:
+                    item = column[index]
+                    if math.isnan(item):
+                        continue
+                    value = item if value is None else function(value, item)
+                values[name] = value
+            values[PROCESS_COUNT_METRIC] = len(indexes)
+            first = indexes[0]
+            result.append(store.pids[first], values, store.starttime(first))
+            result.labels.append(labels)
+        return result
@@ -6,11 +6,54 @@ from argparse import (
     Namespace,
 )
 import re
+from re import Pattern
 from typing import Any
 
 LABEL_RE = re.compile(r"[a-z][a-z0-9_]+$")
 
 
+def parse_label(value: str) -> tuple[str, str]:
+    """Return name and value for a label in the "name=value" form.
+
+    :raise ValueError: if the label is not valid.
+
+    """
+    try:
+        name, value = value.split("=")
+    except ValueError:
+        raise ValueError(f'labels must be in the form "name=value": {value}')
+    validate_label(name)
+    return name, value
+
+
+def validate_label(name: str):
+    """Check that a label name is valid.
+
+    :raise ValueError: if the name is not valid.
+
+    """
+    if not LABEL_RE.match(name):
+        raise ValueError(f"invalid label: {name}")
+
+
+def compile_cmdline_regexp(value: str) -> Pattern:
+    """Compile a regexp for process command lines.
+
+    :raise ValueError: if the regexp is invalid, or has groups not valid as
+        labels.
+
+    """
+    try:
+        regexp = re.compile(value)
+    except Exception as e:
+        raise ValueError(f"compiling regexp {repr(value)}: {str(e)}")
+
+    for groupname in regexp.groupindex:
+        if not LABEL_RE.match(groupname):
+            raise ValueError(f"regexp group not valid as label: {groupname}")
+    return regexp
+
+
 class LabelAction(Action):
     """Action to parse and save labels from the command line."""
 
@@ -24,14 +67,9 @@ class LabelAction(Action):
         labels = {}
         for value in values:
             try:
-                label, value = value.split("=")
-            except ValueError:
-                parser.error(
-                    f'labels must be in the form "name=value": {value}'
-                )
-                return
-            if not LABEL_RE.match(label):
-                parser.error(f"invalid label: {label}")
+                label, value = parse_label(value)
+            except ValueError as e:
+                parser.error(str(e))
                 return
             labels[label] = value
 
@@ -51,18 +89,10 @@ class CmdlineRegexpAction(Action):
         regexps = []
         for value in values:
             try:
-                regexp = re.compile(value)
-            except Exception as e:
-                parser.error(f"compiling regexp {repr(value)}: {str(e)}")
+                regexp = compile_cmdline_regexp(value)
+            except ValueError as e:
+                parser.error(str(e))
                 return
-
-            for groupname in regexp.groupindex:
-                if not LABEL_RE.match(groupname):
-                    parser.error(
-                        f"regexp group not valid as label: {groupname}"
-                    )
-                    return
-
             regexps.append(regexp)
 
         setattr(namespace, self.dest, regexps)
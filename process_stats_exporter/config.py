@@ -0,0 +1,275 @@
+"""Load processes to collect stats for from a configuration file.
+
+Configuration files can be in TOML or YAML format (the latter requires
+PyYAML), and use the same names as command line options:
+
+.. code:: toml
+
+    pids = [1]
+    cmdline-regexps = ["nginx: (?P<role>master|worker)"]
+    include-descendants = true
+    stats = ["stat", "status", "fd"]
+
+    [labels]
+    env = "prod"
+
+"""
+
+from collections.abc import (
+    Callable,
+    Mapping,
+)
+import importlib
+import os
+from pathlib import Path
+from re import Pattern
+import sys
+from typing import (
+    Any,
+    BinaryIO,
+    NamedTuple,
+)
+
+from .cmdline import (
+    compile_cmdline_regexp,
+    validate_label,
+)
+from .stats import (
+    DEFAULT_STAT_GROUPS,
+    STAT_GROUPS,
+)
+
+# the TOML parser is only in the standard library since Python 3.11
+tomllib: Any = importlib.import_module(
+    "tomllib" if sys.version_info >= (3, 11) else "tomli"
+)
+
+
+class ConfigError(Exception):
+    """The configuration is not valid."""
+
+
+class Config(NamedTuple):
+    """Processes to collect stats for, and stats to collect."""
+
+    pids: tuple[int, ...] = ()
+    cmdline_regexps: tuple[Pattern, ...] = ()
+    cgroups: tuple[str, ...] = ()
+    pidfiles: tuple[str, ...] = ()
+    units: tuple[str, ...] = ()
+    descendants: bool = False
+    labels: Mapping[str, str] = {}
+    stat_groups: tuple[str, ...] = DEFAULT_STAT_GROUPS
+
+    @property
+    def has_selectors(self) -> bool:
+        """Whether any process is selected."""
+        return bool(
+            self.pids
+            or self.cmdline_regexps
+            or self.cgroups
+            or self.pidfiles
+            or self.units
+        )
+
+    def describe_selectors(self) -> list[str]:
+        """Return descriptions of selected processes, for logging.
+
+        As when selecting processes, PIDs, pidfiles and systemd units take
+        precedence over cgroups, which take precedence over command line
+        regexps, so only selectors that are used are described.
+
+        """
+        if self.pids or self.pidfiles or self.units:
+            descriptions = []
+            if self.pids:
+                pid_list = ", ".join(str(pid) for pid in self.pids)
+                descriptions.append(f"PIDs [{pid_list}]")
+            if self.pidfiles:
+                descriptions.append(f"pidfiles [{', '.join(self.pidfiles)}]")
+            if self.units:
+                descriptions.append(f"systemd units [{', '.join(self.units)}]")
+            return descriptions
+        if self.cgroups:
+            return [f"processes in cgroups [{', '.join(self.cgroups)}]"]
+        if self.cmdline_regexps:
+            re_list = ", ".join(rexp.pattern for rexp in self.cmdline_regexps)
+            return [f"processes matching regexps [{re_list}]"]
+        return []
+
+    def handler_options(self) -> dict[str, Any]:
+        """Return options for the :class:`ProcessMetricsHandler`."""
+        return {
+            "pids": list(self.pids),
+            "cmdline_regexps": list(self.cmdline_regexps),
+            "cgroups": list(self.cgroups),
+            "pidfiles": list(self.pidfiles),
+            "units": list(self.units),
+            "descendants": self.descendants,
+            "labels": dict(self.labels),
+            "stat_groups": self.stat_groups,
+        }
+
+
+class ConfigFile:
+    """A configuration file, tracking changes to it.
+
+    The file is considered changed if its inode, modification time or size
+    differ from when it was last loaded.
+
+    """
+
+    def __init__(self, path: str | Path):
+        self.path = Path(path)
+        self._key: tuple[int, int, int] | None = None
+
+    def load(self) -> Config:
+        """Load the configuration from the file.
+
+        Changes are tracked from this point even if loading fails, so that
+        an invalid file is not reported as changed until it's modified again.
+
+        :raise ConfigError: if the file can't be loaded, or the
+            configuration is not valid.
+
+        """
+        self._key = self._file_key()
+        return load_config(self.path)
+
+    def changed(self) -> bool:
+        """Whether the file changed since it was last loaded."""
+        return self._file_key() != self._key
+
+    def _file_key(self) -> tuple[int, int, int] | None:
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            return None
+        return stat.st_ino, stat.st_mtime_ns, stat.st_size
+
+
+def load_config(path: str | Path) -> Config:
+    """Load and validate the configuration from a file.
+
+    The format is detected from the file extension.
+
+    :raise ConfigError: if the file can't be loaded, or the configuration is
+        not valid.
+
+    """
+    path = Path(path)
+    loader = _LOADERS.get(path.suffix)
+    if loader is None:
+        raise ConfigError(f"unsupported config file format: {path.name}")
+    try:
+        with path.open("rb") as fd:
+            data = loader(fd)
+    except OSError as e:
+        raise ConfigError(f"can't read config file: {e}")
+    return parse_config(data)
+
+
+def parse_config(data: Any) -> Config:
+    """Return a :class:`Config` from parsed configuration data.
+
+    :raise ConfigError: if the configuration is not valid.
+
+    """
+    if not isinstance(data, dict):
+        raise ConfigError("config must be a mapping")
+    unknown = data.keys() - _OPTIONS.keys()
+    if unknown:
+        raise ConfigError(
+            f"unknown config options: {', '.join(sorted(unknown))}"
+        )
+    values: dict[str, Any] = {}
+    for name, value in data.items():
+        field, parse = _OPTIONS[name]
+        try:
+            values[field] = parse(value)
+        except (TypeError, ValueError) as e:
+            raise ConfigError(f'invalid value for "{name}": {e}')
+    config = Config(**values)
+    if not config.has_selectors:
+        raise ConfigError("no PID, cgroup or process names specified")
+    return config
+
+
+def _load_toml(fd: BinaryIO) -> Any:
+    try:
+        return tomllib.load(fd)
+    except ValueError as e:
+        raise ConfigError(f"invalid TOML config: {e}")
+
+
+def _load_yaml(fd: BinaryIO) -> Any:
+    try:
+        import yaml
+    except ImportError:
+        raise ConfigError("PyYAML is required for YAML config files")
+    try:
+        return yaml.safe_load(fd)
+    except yaml.YAMLError as e:
+        raise ConfigError(f"invalid YAML config: {e}")
+
+
+_LOADERS = {
+    ".toml": _load_toml,
+    ".yaml": _load_yaml,
+    ".yml": _load_yaml,
+}
+
+
+def _list_of(item_type: type) -> Callable[[Any], tuple]:
+    def parse(value: Any) -> tuple:
+        if not isinstance(value, list) or not all(
+            isinstance(item, item_type) and not isinstance(item, bool)
+            for item in value
+        ):
+            raise TypeError(f"must be a list of {item_type.__name__}")
+        return tuple(value)
+
+    return parse
+
+
+def _parse_regexps(value: Any) -> tuple[Pattern, ...]:
+    return tuple(compile_cmdline_regexp(item) for item in _list_of(str)(value))
+
+
+def _parse_bool(value: Any) -> bool:
+    if not isinstance(value, bool):
+        raise TypeError("must be a boolean")
+    return value
+
+
+def _parse_labels(value: Any) -> dict[str, str]:
+    if not isinstance(value, dict) or not all(
+        isinstance(item, str) for item in value.values()
+    ):
+        raise TypeError("must be a mapping of names to strings")
+    for name in value:
+        validate_label(str(name))
+    return dict(value)
+
+
+def _parse_stat_groups(value: Any) -> tuple[str, ...]:
+    groups = _list_of(str)(value)
+    if not groups:
+        raise ValueError("no stat group specified")
+    invalid = sorted(set(groups) - set(STAT_GROUPS))
+    if invalid:
+        raise ValueError(f"unknown stat groups: {', '.join(invalid)}")
+    return groups
+
+
+# Config field and parser for each option
+_OPTIONS = {
+    "pids": ("pids", _list_of(int)),
+    "cmdline-regexps": ("cmdline_regexps", _parse_regexps),
+    "cgroups": ("cgroups", _list_of(str)),
+    "pidfiles": ("pidfiles", _list_of(str)),
+    "systemd-units": ("units", _list_of(str)),
+    "include-descendants": ("descendants", _parse_bool),
+    "labels": ("labels", _parse_labels),
+    "stats": ("stat_groups", _parse_stat_groups),
+}
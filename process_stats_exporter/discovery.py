@@ -0,0 +1,192 @@
+"""Track started and exited processes across scans.
+
+Discovery avoids reading files for all processes in ``/proc`` at each scan:
+only processes that were started (or executed a new program) since the
+previous one need to be checked.
+
+"""
+
+import abc
+from collections.abc import Iterator
+import errno
+import os
+from pathlib import Path
+import socket
+import struct
+from typing import NamedTuple
+
+from .procfs import iter_pids
+
+DISCOVERY_TYPES = ("scan", "events")
+
+# Netlink proc connector constants, from linux/connector.h and
+# linux/cn_proc.h
+NETLINK_CONNECTOR = 11
+CN_IDX_PROC = 1
+CN_VAL_PROC = 1
+PROC_CN_MCAST_LISTEN = 1
+PROC_EVENT_FORK = 0x00000001
+PROC_EVENT_EXEC = 0x00000002
+PROC_EVENT_EXIT = 0x80000000
+
+_NLMSG_DONE = 3
+_NLMSG_HEADER = struct.Struct("=IHHII")
+_CN_MSG_HEADER = struct.Struct("=IIIIHH")
+_PROC_EVENT_HEADER = struct.Struct("=IIQ")
+# (pid, tgid) for the process an event is about, at the start of event data
+_PROC_EVENT_PROCESS = struct.Struct("=II")
+_FORK_CHILD_OFFSET = 8
+
+_RECV_SIZE = 65536
+
+
+class ProcessChanges(NamedTuple):
+    """Changes to processes since the previous poll."""
+
+    # PIDs of processes that started or executed a new program
+    started: set[int]
+    # PIDs of processes that exited
+    exited: set[int]
+
+
+class ProcessDiscovery(abc.ABC):
+    """Discovery base class.
+
+    The first poll reports all existing processes as started.
+
+    """
+
+    def __init__(self, proc: str | Path = "/proc"):
+        self._proc = proc
+        self._pids: set[int] | None = None
+
+    @property
+    def pids(self) -> set[int]:
+        """PIDs of known processes, as of the last poll."""
+        return set(self._pids or ())
+
+    def poll(self) -> ProcessChanges:
+        """Return changes to processes since the previous poll."""
+        if self._pids is None:
+            return self._rescan()
+        changes = self._poll()
+        if changes is None:
+            return self._rescan()
+        self._pids |= changes.started
+        self._pids -= changes.exited
+        return changes
+
+    def close(self):
+        """Release resources used for discovery."""
+
+    @abc.abstractmethod
+    def _poll(self) -> ProcessChanges | None:
+        """Return changes since the previous poll.
+
+        If changes can't be tracked, None is returned, and ``/proc`` is
+        scanned again.
+
+        Subclasses must implement this method.
+
+        """
+
+    def _rescan(self) -> ProcessChanges:
+        pids = set(iter_pids(self._proc))
+        changes = ProcessChanges(
+            started=pids, exited=(self._pids or set()) - pids
+        )
+        self._pids = pids
+        return changes
+
+
+class ProcConnectorDiscovery(ProcessDiscovery):
+    """Discover processes from Linux proc connector events.
+
+    Events are read from a netlink socket, which requires the
+    ``CAP_NET_ADMIN`` capability.  If events are lost, ``/proc`` is scanned
+    again.
+
+    """
+
+    def __init__(
+        self,
+        proc: str | Path = "/proc",
+        sock: socket.socket | None = None,
+    ):
+        super().__init__(proc=proc)
+        if sock is None:
+            sock = socket.socket(
+                socket.AF_NETLINK, socket.SOCK_DGRAM, NETLINK_CONNECTOR
+            )
+            try:
+                sock.bind((os.getpid(), CN_IDX_PROC))
+                sock.send(subscribe_message())
+            except OSError:
+                sock.close()
+                raise
+        sock.setblocking(False)
+        self._sock = sock
+
+    def close(self):
+        self._sock.close()
+
+    def _poll(self) -> ProcessChanges | None:
+        started: set[int] = set()
+        exited: set[int] = set()
+        while True:
+            try:
+                data = self._sock.recv(_RECV_SIZE)
+            except BlockingIOError:
+                break
+            except OSError as error:
+                if error.errno == errno.ENOBUFS:
+                    # the socket buffer overflowed, events were lost
+                    return None
+                raise
+            for event, pid in parse_events(data):
+                if event == PROC_EVENT_EXIT:
+                    started.discard(pid)
+                    exited.add(pid)
+                else:
+                    started.add(pid)
+                    exited.discard(pid)
+        return ProcessChanges(started=started, exited=exited)
+
+
+def subscribe_message() -> bytes:
+    """Return the netlink message to subscribe to proc connector events."""
+    op = struct.pack("=I", PROC_CN_MCAST_LISTEN)
+    cn_msg = _CN_MSG_HEADER.pack(CN_IDX_PROC, CN_VAL_PROC, 0, 0, len(op), 0)
+    length = _NLMSG_HEADER.size + len(cn_msg) + len(op)
+    header = _NLMSG_HEADER.pack(length, _NLMSG_DONE, 0, 0, os.getpid())
+    return header + cn_msg + op
+
+
+def parse_events(data: bytes) -> Iterator[tuple[int, int]]:
+    """Return an iterator yielding (event, PID) from proc connector messages.
+
+    Only fork, exec and exit events for processes (not threads) are
+    returned.  For forks, the PID of the child is returned.
+
+    """
+    offset = 0
+    while offset + _NLMSG_HEADER.size <= len(data):
+        length = _NLMSG_HEADER.unpack_from(data, offset)[0]
+        if length < _NLMSG_HEADER.size:
+            return
+        end = min(offset + length, len(data))
+        event_offset = offset + _NLMSG_HEADER.size + _CN_MSG_HEADER.size
+        offset += (length + 3) & ~3
+        data_offset = event_offset + _PROC_EVENT_HEADER.size
+        if data_offset > end:
+            continue
+        event = _PROC_EVENT_HEADER.unpack_from(data, event_offset)[0]
+        if event == PROC_EVENT_FORK:
+            data_offset += _FORK_CHILD_OFFSET
+        elif event not in (PROC_EVENT_EXEC, PROC_EVENT_EXIT):
+            continue
+        if data_offset + _PROC_EVENT_PROCESS.size > end:
+            continue
+        pid, tgid = _PROC_EVENT_PROCESS.unpack_from(data, data_offset)
+        if pid == tgid:
+            yield event, pid
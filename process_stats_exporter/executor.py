@@ -0,0 +1,229 @@
+"""Run metrics collection outside of the event loop."""
+
+import asyncio
+from collections.abc import Callable
+from concurrent.futures import (
+    Executor,
+    ProcessPoolExecutor,
+    ThreadPoolExecutor,
+)
+from contextlib import suppress
+from typing import (
+    Any,
+    TypeVar,
+)
+
+from prometheus_client import Metric
+
+from .metrics import (
+    CollectResult,
+    ProcessMetricsHandler,
+)
+from .snapshot import SnapshotCollector
+
+T = TypeVar("T")
+
+EXECUTOR_TYPES = ("thread", "process")
+
+# The metrics handler for a worker process, and the number of times it was
+# reconfigured
+_worker_handler: ProcessMetricsHandler | None = None
+_worker_generation = 0
+
+
+def create_executor(
+    executor_type: str,
+    handler: ProcessMetricsHandler,
+    workers: int = 1,
+) -> Executor:
+    """Return an executor to run collection for a metrics handler.
+
+    :param executor_type: the type of executor, one of ``EXECUTOR_TYPES``.
+    :param handler: the :class:`ProcessMetricsHandler` to collect samples
+        with.  For process executors, a handler with the same options is set
+        up in each worker process, so that caches are kept across calls.
+    :param workers: the number of workers for the executor.
+
+    """
+    if executor_type == "thread":
+        return ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix="collect"
+        )
+    elif executor_type == "process":
+        return ProcessPoolExecutor(
+            max_workers=workers,
+            initializer=_init_worker,
+            initargs=(handler.worker_options(),),
+        )
+    raise ValueError(f"Unknown executor type: {executor_type}")
+
+
+class MetricsUpdater:
+    """Update metrics with samples collected in an executor.
+
+    Only one collection runs at a time: updates requested while a collection
+    is running wait for its result instead of starting another one.
+
+    If a minimum interval is set, samples from the last collection are reused
+    until the interval has passed.
+
+    If metrics about the exporter are passed, they're updated once for each
+    collection.
+
+    """
+
+    def __init__(
+        self,
+        handler: ProcessMetricsHandler,
+        executor: Executor | None = None,
+        min_interval: float = 0.0,
+        exporter_metrics: dict[str, Metric] | None = None,
+    ):
+        self._handler = handler
+        self._executor = executor
+        self._min_interval = min_interval
+        self._exporter_metrics = exporter_metrics
+        self._running: asyncio.Future | None = None
+        self._last_result: CollectResult | None = None
+        self._last_time = 0.0
+        self._applied_result: CollectResult | None = None
+        # result of the last collection before reconfiguring the handler
+        self._stale_result: CollectResult | None = None
+        # options passed to process workers to reconfigure their handler,
+        # and the number of times it was reconfigured
+        self._worker_options: dict[str, Any] | None = None
+        self._worker_generation = 0
+
+    async def collect(self) -> CollectResult:
+        """Collect samples in the executor."""
+        loop = asyncio.get_running_loop()
+        if (
+            self._last_result is not None
+            and loop.time() - self._last_time < self._min_interval
+        ):
+            return self._last_result
+
+        if self._running is None:
+            self._running = asyncio.ensure_future(self._collect())
+            self._running.add_done_callback(self._collect_done)
+        # shield the collection, so that it's not cancelled for all callers
+        # if one of them goes away
+        return await asyncio.shield(self._running)
+
+    async def update_metrics(self, metrics: dict[str, Metric]):
+        """Collect samples and update metrics with them.
+
+        Metrics are only updated once for each set of samples, even if
+        multiple updates share the same collection.
+
+        """
+        result = await self.collect()
+        if result is self._applied_result or result is self._stale_result:
+            return
+        with result.stats.phase("update"):
+            self._handler.apply_samples(metrics, result.samples)
+        self._applied(result)
+
+    async def update_snapshot(self, collector: SnapshotCollector):
+        """Collect samples and replace the snapshot in the collector."""
+        result = await self.collect()
+        if result is self._applied_result or result is self._stale_result:
+            return
+        with result.stats.phase("update"):
+            collector.update(self._handler.aggregate(result.samples))
+        self._applied(result)
+
+    async def update_snapshot_periodically(
+        self, collector: SnapshotCollector, interval: float
+    ):
+        """Update the snapshot in the collector at a fixed interval.
+
+        Errors during collection are logged, and the previous snapshot is
+        kept.
+
+        """
+        loop = asyncio.get_running_loop()
+        while True:
+            start = loop.time()
+            try:
+                await self.update_snapshot(collector)
+            except Exception:
+                self._handler.logger.exception("failed collecting stats")
+            await asyncio.sleep(max(0.0, interval - (loop.time() - start)))
+
+    async def reconfigure(self, reconfigure: Callable[[], T]) -> T:
+        """Call a function reconfiguring the handler, between collections.
+
+        This waits for a running collection to complete, and samples from
+        previous collections are not applied or reused afterwards.
+
+        With a process executor, handlers in workers are reconfigured with
+        the same options at their next collection, keeping their caches.
+
+        """
+        while self._running is not None:
+            with suppress(Exception):
+                await asyncio.shield(self._running)
+        result = reconfigure()
+        self._stale_result = self._last_result
+        self._last_result = None
+        if isinstance(self._executor, ProcessPoolExecutor):
+            self._worker_options = self._handler.reconfigure_options()
+            self._worker_generation += 1
+        return result
+
+    def shutdown(self):
+        """Shutdown the executor, if set."""
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def _applied(self, result: CollectResult):
+        self._applied_result = result
+        if self._exporter_metrics is not None:
+            self._handler.update_exporter_metrics(
+                self._exporter_metrics, result.stats
+            )
+
+    async def _collect(self) -> CollectResult:
+        loop = asyncio.get_running_loop()
+        if isinstance(self._executor, ProcessPoolExecutor):
+            return await loop.run_in_executor(
+                self._executor,
+                _worker_collect,
+                self._worker_generation,
+                self._worker_options,
+            )
+        return await loop.run_in_executor(
+            self._executor, self._handler.collect
+        )
+
+    def _collect_done(self, future: asyncio.Future):
+        self._running = None
+        if future.cancelled() or future.exception() is not None:
+            return
+        self._last_result = future.result()
+        self._last_time = asyncio.get_running_loop().time()
+
+
+def _init_worker(options: dict[str, Any]):
+    """Set up the metrics handler in a worker process."""
+    global _worker_handler, _worker_generation
+    _worker_handler = ProcessMetricsHandler(**options)
+    _worker_generation = 0
+
+
+def _worker_collect(
+    generation: int = 0, options: dict[str, Any] | None = None
+) -> CollectResult:
+    """Collect samples in a worker process.
+
+    If the handler was reconfigured since the worker last collected, the
+    worker handler is reconfigured with the passed options first.
+
+    """
+    global _worker_generation
+    assert _worker_handler is not None, "worker not initialized"
+    if generation != _worker_generation and options is not None:
+        _worker_handler.reconfigure(**options)
+        _worker_generation = generation
+    return _worker_handler.collect()
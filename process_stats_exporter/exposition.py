@@ -0,0 +1,283 @@
+"""Render metrics in the Prometheus text exposition format.
+
+Series for process metrics are rendered directly from metric children (or
+from the snapshot), with the label string for each set of label values
+cached across renders, instead of building a sample object and formatting
+labels for each value.  Other collectors are rendered by
+``prometheus_client``, and the output is the same as its
+:func:`generate_latest`.
+
+This relies on private attributes of ``prometheus_client`` registries and
+metrics, which are checked before use: if they're missing, the generic
+renderer is used instead.
+
+"""
+
+from collections.abc import (
+    Awaitable,
+    Callable,
+    Iterable,
+    Sequence,
+)
+import gzip
+from typing import (
+    Any,
+    NamedTuple,
+)
+
+from aiohttp.web import (
+    Request,
+    Response,
+)
+from prometheus_aioexporter.web import PrometheusExporter
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    Counter,
+    Gauge,
+    generate_latest,
+    metrics as client_metrics,
+)
+from prometheus_client.exposition import (
+    choose_encoder,
+    gzip_accepted,
+)
+from prometheus_client.registry import (
+    Collector,
+    CollectorRegistry,
+)
+from prometheus_client.utils import floatToGoString
+
+OPENMETRICS_CONTENT_TYPE = "application/openmetrics-text"
+
+# Values for a series: label values, value and creation time, if any
+SeriesValue = tuple[tuple[str, ...], float, float | None]
+
+# Handler called with a dict of metrics by name before rendering (the base
+# exporter declares it as taking an iterable of metrics)
+MetricsUpdateHandler = Callable[[Any], Awaitable[None]]
+
+# Private attributes used to render directly from registries, metrics and
+# their children
+_REGISTRY_ATTRS = ("_lock", "_collector_to_names", "_target_info")
+_METRIC_ATTRS = (
+    "_lock",
+    "_metrics",
+    "_name",
+    "_documentation",
+    "_type",
+    "_labelnames",
+)
+_CHILD_ATTRS = ("_value",)
+_COUNTER_CHILD_ATTRS = ("_value", "_created")
+
+
+class Series(NamedTuple):
+    """A counter or gauge metric with values to render."""
+
+    # name of the metric, without the "_total" suffix for counters
+    name: str
+    documentation: str
+    type: str
+    label_names: Sequence[str]
+    values: Iterable[SeriesValue]
+
+
+class TextRenderer:
+    """Render metrics from a registry in the text format.
+
+    Collectors can provide a ``series()`` method returning a list of
+    :class:`Series` to be rendered directly.
+
+    """
+
+    def __init__(self):
+        # label strings by label names and values, only kept for those used
+        # in the last render
+        self._label_strings: dict[
+            tuple[tuple[str, ...], tuple[str, ...]], str
+        ] = {}
+
+    def render(self, registry: CollectorRegistry) -> bytes:
+        """Return metrics for a registry."""
+        if not _has_attrs(registry, _REGISTRY_ATTRS) or registry._target_info:
+            return generate_latest(registry)
+        with registry._lock:
+            collectors = list(registry._collector_to_names)
+        last_label_strings = self._label_strings
+        self._label_strings = {}
+        output = []
+        for collector in collectors:
+            series_list = collector_series(collector)
+            if series_list is None:
+                output.append(generate_latest(collector))
+                continue
+            for series in series_list:
+                output.append(self._render_series(series, last_label_strings))
+        return b"".join(output)
+
+    def _render_series(
+        self,
+        series: Series,
+        last_label_strings: dict[tuple[tuple[str, ...], tuple[str, ...]], str],
+    ) -> bytes:
+        label_strings = self._label_strings
+        label_names = tuple(series.label_names)
+        name = series.name
+        if series.type == "counter":
+            name += "_total"
+        documentation = _escape_documentation(series.documentation)
+        lines = [
+            f"# HELP {name} {documentation}\n",
+            f"# TYPE {name} {series.type}\n",
+        ]
+        created_lines = []
+        for label_values, value, created in series.values:
+            key = (label_names, label_values)
+            labels = label_strings.get(key)
+            if labels is None:
+                labels = last_label_strings.get(key)
+                if labels is None:
+                    labels = label_string(label_names, label_values)
+                label_strings[key] = labels
+            lines.append(f"{name}{labels} {floatToGoString(value)}\n")
+            if created is not None:
+                created_lines.append(
+                    f"{series.name}_created{labels} "
+                    f"{floatToGoString(created)}\n"
+                )
+        if created_lines:
+            created_name = f"{series.name}_created"
+            lines.append(f"# HELP {created_name} {documentation}\n")
+            lines.append(f"# TYPE {created_name} gauge\n")
+            lines.extend(created_lines)
+        return "".join(lines).encode("utf-8")
+
+
+class MetricsExporter(PrometheusExporter):
+    """Exporter rendering metrics with a :class:`TextRenderer`.
+
+    Optionally, responses are compressed for clients accepting gzip, and
+    metrics are returned in the OpenMetrics format to clients requesting it.
+
+    """
+
+    def __init__(
+        self,
+        *args: Any,
+        compress: bool = False,
+        openmetrics: bool = False,
+        **kwargs: Any,
+    ):
+        super().__init__(*args, **kwargs)
+        self.compress = compress
+        self.openmetrics = openmetrics
+        self._renderer = TextRenderer()
+        self._metrics_update_handler: MetricsUpdateHandler | None = None
+
+    def set_metric_update_handler(self, handler: MetricsUpdateHandler):
+        """Set a handler to update metrics, called at every request."""
+        self._metrics_update_handler = handler
+
+    async def _handle_metrics(self, request: Request) -> Response:
+        """Handler for metrics."""
+        if self._metrics_update_handler:
+            await self._metrics_update_handler(self.registry.get_metrics())
+        body, content_type = self._render(request.headers.get("Accept", ""))
+        headers = {}
+        if self.compress and gzip_accepted(
+            request.headers.get("Accept-Encoding", "")
+        ):
+            body = gzip.compress(body)
+            headers["Content-Encoding"] = "gzip"
+        response = Response(body=body, headers=headers)
+        response.content_type = content_type
+        return response
+
+    def _render(self, accept: str) -> tuple[bytes, str]:
+        """Return rendered metrics and their content type."""
+        registry = self.registry.registry
+        if self.openmetrics:
+            encoder, content_type = choose_encoder(accept)
+            if content_type.startswith(OPENMETRICS_CONTENT_TYPE):
+                return encoder(registry), content_type
+        return self._renderer.render(registry), CONTENT_TYPE_LATEST
+
+
+def collector_series(collector: Collector) -> list[Series] | None:
+    """Return series to render directly for a collector, if supported."""
+    get_series = getattr(collector, "series", None)
+    if get_series is not None:
+        series: list[Series] = get_series()
+        return series
+    if isinstance(collector, (Counter, Gauge)) and getattr(
+        collector, "_labelnames", None
+    ):
+        single_series = metric_series(collector)
+        if single_series is not None:
+            return [single_series]
+    return None
+
+
+def metric_series(metric: Counter | Gauge) -> Series | None:
+    """Return a series with values from metric children.
+
+    If the metric or its children don't have the expected attributes, None
+    is returned.
+
+    """
+    if not _has_attrs(metric, _METRIC_ATTRS) or not hasattr(
+        client_metrics, "_use_created"
+    ):
+        return None
+    with metric._lock:
+        children: dict[Any, Any] = metric._metrics.copy()
+    created = metric._type == "counter" and client_metrics._use_created
+    # children all have the same attributes, so only one is checked
+    child = next(iter(children.values()), None)
+    if child is not None and not _has_attrs(
+        child, _COUNTER_CHILD_ATTRS if created else _CHILD_ATTRS
+    ):
+        return None
+    values: Iterable[SeriesValue]
+    if created:
+        values = (
+            (label_values, child._value.get(), child._created)
+            for label_values, child in children.items()
+        )
+    else:
+        values = (
+            (label_values, child._value.get(), None)
+            for label_values, child in children.items()
+        )
+    return Series(
+        metric._name,
+        metric._documentation,
+        metric._type,
+        metric._labelnames,
+        values,
+    )
+
+
+def label_string(
+    label_names: Sequence[str], label_values: Sequence[str]
+) -> str:
+    """Return the label string for a series, with labels sorted by name."""
+    if not label_names:
+        return ""
+    labels = ",".join(
+        f'{name}="{_escape_label_value(value)}"'
+        for name, value in sorted(zip(label_names, label_values))
+    )
+    return f"{{{labels}}}"
+
+
+def _has_attrs(obj: Any, attrs: Iterable[str]) -> bool:
+    return all(hasattr(obj, attr) for attr in attrs)
+
+
+def _escape_documentation(text: str) -> str:
+    return text.replace("\\", r"\\").replace("\n", r"\n")
+
+
+def _escape_label_value(text: str) -> str:
+    return text.replace("\\", r"\\").replace("\n", r"\n").replace('"', r"\"")
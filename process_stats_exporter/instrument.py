@@ -0,0 +1,92 @@
+"""Metrics about the cost of collecting process stats."""
+
+from collections.abc import (
+    Iterator,
+    Mapping,
+)
+from contextlib import contextmanager
+import time
+
+from prometheus_aioexporter import MetricConfig
+from prometheus_client import Metric
+
+# Prefix for metrics about the exporter itself
+EXPORTER_METRIC_PREFIX = "process_stats_exporter_"
+
+# Phases of a scrape
+SCRAPE_PHASES = ("scan", "collect", "label", "update")
+
+SCRAPE_DURATION_METRIC = f"{EXPORTER_METRIC_PREFIX}scrape_duration_seconds"
+
+# Map names of counter metrics to ScrapeStats attributes
+_COUNTERS = {
+    f"{EXPORTER_METRIC_PREFIX}pids_scanned": (
+        "pids_scanned",
+        "Number of processes found scanning /proc",
+    ),
+    f"{EXPORTER_METRIC_PREFIX}pids_matched": (
+        "pids_matched",
+        "Number of processes stats were collected for",
+    ),
+    f"{EXPORTER_METRIC_PREFIX}pids_vanished": (
+        "pids_vanished",
+        "Number of processes that exited while being read",
+    ),
+    f"{EXPORTER_METRIC_PREFIX}tasks_read": (
+        "tasks_read",
+        "Number of process tasks read",
+    ),
+    f"{EXPORTER_METRIC_PREFIX}proc_files_opened": (
+        "files_opened",
+        "Number of files opened under /proc",
+    ),
+}
+
+
+class ScrapeStats:
+    """Counters and phase durations for a scrape."""
+
+    def __init__(self) -> None:
+        self.pids_scanned = 0
+        self.pids_matched = 0
+        self.pids_vanished = 0
+        self.tasks_read = 0
+        self.files_opened = 0
+        self.durations: dict[str, float] = {}
+
+    @contextmanager
+    def phase(self, name: str) -> Iterator[None]:
+        """Context manager tracking time spent in a phase of the scrape."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.durations[name] = (
+                self.durations.get(name, 0.0) + time.perf_counter() - start
+            )
+
+
+def exporter_metric_configs() -> list[MetricConfig]:
+    """Return MetricConfigs for metrics about the exporter."""
+    configs = [
+        MetricConfig(
+            SCRAPE_DURATION_METRIC,
+            "Time spent in each phase of a scrape",
+            "histogram",
+            {"labels": ["phase"]},
+        )
+    ]
+    configs.extend(
+        MetricConfig(name, description, "counter", {})
+        for name, (_, description) in _COUNTERS.items()
+    )
+    return configs
+
+
+def update_exporter_metrics(metrics: Mapping[str, Metric], stats: ScrapeStats):
+    """Update metrics about the exporter with stats from a scrape."""
+    histogram = metrics[SCRAPE_DURATION_METRIC]
+    for phase, duration in stats.durations.items():
+        histogram.labels(phase=phase).observe(duration)
+    for name, (attr, _) in _COUNTERS.items():
+        metrics[name].inc(getattr(stats, attr))
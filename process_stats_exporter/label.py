@@ -53,8 +53,26 @@ class CmdlineLabeler(Labeler):
         self._regexp = regexp
 
     def __call__(self, process: Process) -> Mapping[str, str]:
-        """Return label values for the process."""
-        match = self._regexp.search(process.cmd)
+        """Return label values for the process.
+
+        Process stats are collected if not available yet.
+
+        """
+        if process.timestamp is None:
+            process.collect_stats()
+        return self.match(process.cmd, process.get("comm")) or {}
+
+    def match(self, cmd: str, comm: str) -> Mapping[str, str] | None:
+        """Return label values for a command line.
+
+        :param cmd: the process command line.
+        :param comm: the process name.
+        :return: label values, or None if the command line doesn't match.
+
+        """
+        match = self._regexp.search(cmd)
+        if match is None:
+            return None
 
         groupdict = match.groupdict()
         if groupdict:
@@ -67,7 +85,7 @@ class CmdlineLabeler(Labeler):
                 for idx, group in enumerate(groups, 1)
             }
 
-        return {"cmd": process.get("comm")}
+        return {"cmd": comm}
 
     def labels(self) -> set[str]:
         """Return label names."""
@@ -79,3 +97,38 @@ class CmdlineLabeler(Labeler):
                 for idx in range(1, self._regexp.groups + 1)
             }
         return {"cmd"}
+
+
+class CgroupLabeler(Labeler):
+    """Return labels with the cgroup processes are selected from."""
+
+    def __init__(self, cgroup: str):
+        self._cgroup = cgroup
+
+    def __call__(self, process: Process) -> Mapping[str, str]:
+        """Return label values for the process."""
+        return {"cgroup": self._cgroup}
+
+    def labels(self) -> set[str]:
+        """Return label names."""
+        return {"cgroup"}
+
+
+class StaticLabeler(Labeler):
+    """Return labels computed in advance.
+
+    This is used when labels for a process are cached, to avoid computing
+    them again.
+
+    """
+
+    def __init__(self, labels: Mapping[str, str]):
+        self._labels = labels
+
+    def __call__(self, process: Process) -> Mapping[str, str]:
+        """Return label values for the process."""
+        return self._labels
+
+    def labels(self) -> set[str]:
+        """Return label names."""
+        return set(self._labels)
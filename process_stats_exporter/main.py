@@ -4,15 +4,41 @@ from argparse import (
     ArgumentParser,
     Namespace,
 )
+import asyncio
+import signal
 
 from aiohttp.web import Application
 from prometheus_aioexporter.script import PrometheusExporterScript
+from prometheus_aioexporter.web import PrometheusExporter
+from prometheus_client import Metric
 
+from .aggregate import AGGREGATIONS
 from .cmdline import (
     CmdlineRegexpAction,
     LabelAction,
 )
+from .config import (
+    Config,
+    ConfigError,
+    ConfigFile,
+)
+from .discovery import DISCOVERY_TYPES
+from .executor import (
+    create_executor,
+    EXECUTOR_TYPES,
+    MetricsUpdater,
+)
+from .exposition import MetricsExporter
 from .metrics import ProcessMetricsHandler
+from .reload import (
+    ConfigReloader,
+    log_config,
+)
+from .snapshot import SnapshotCollector
+from .stats import (
+    DEFAULT_STAT_GROUPS,
+    STAT_GROUPS,
+)
 
 
 class ProcessStatsExporter(PrometheusExporterScript):
@@ -21,6 +47,25 @@ class ProcessStatsExporter(PrometheusExporterScript):
     name = "process-stats-exporter"
 
     def configure_argument_parser(self, parser: ArgumentParser):
+        parser.add_argument(
+            "-c",
+            "--config",
+            metavar="path",
+            help=(
+                "TOML or YAML file with processes to collect stats for, "
+                "labels and stats, reloaded on SIGHUP or when it changes"
+            ),
+        )
+        parser.add_argument(
+            "--config-check-interval",
+            type=float,
+            default=5.0,
+            metavar="seconds",
+            help=(
+                "interval for checking changes to the config file, "
+                "0 to only reload on SIGHUP"
+            ),
+        )
         parser.add_argument(
             "-P",
             "--pids",
@@ -37,6 +82,37 @@ class ProcessStatsExporter(PrometheusExporterScript):
             metavar="regexp",
             help="regexp to match process command line",
         )
+        parser.add_argument(
+            "--pidfiles",
+            nargs="+",
+            metavar="path",
+            help="path of pidfile for the process",
+        )
+        parser.add_argument(
+            "--systemd-units",
+            nargs="+",
+            metavar="unit",
+            help="systemd unit to select processes for",
+        )
+        parser.add_argument(
+            "-C",
+            "--cgroups",
+            nargs="+",
+            metavar="cgroup",
+            help=(
+                "cgroup path or glob pattern to select processes from, "
+                "relative to /sys/fs/cgroup"
+            ),
+        )
+        parser.add_argument(
+            "--include-descendants",
+            action="store_true",
+            help=(
+                "also collect stats for descendants of selected processes, "
+                "with the same labels (values are aggregated, summing them "
+                "unless --aggregate is passed)"
+            ),
+        )
         parser.add_argument(
             "-l",
             "--labels",
@@ -46,32 +122,258 @@ class ProcessStatsExporter(PrometheusExporterScript):
             default={},
             help='add static label to all metrics (as "name=value")',
         )
+        parser.add_argument(
+            "--stats",
+            nargs="+",
+            choices=STAT_GROUPS,
+            default=DEFAULT_STAT_GROUPS,
+            metavar="group",
+            help=(
+                "groups of stats to collect, files for other groups are not "
+                f"read (choices: {', '.join(STAT_GROUPS)})"
+            ),
+        )
+        parser.add_argument(
+            "--aggregate",
+            choices=AGGREGATIONS,
+            help=(
+                "report metrics for each set of labels instead of each "
+                "process, combining gauge values with the specified function"
+            ),
+        )
+        parser.add_argument(
+            "--discovery",
+            choices=DISCOVERY_TYPES,
+            default="scan",
+            help=(
+                "how to find processes matching regexps: scan all processes "
+                "at every collection, or track process events"
+            ),
+        )
+        parser.add_argument(
+            "--executor",
+            choices=EXECUTOR_TYPES,
+            default="thread",
+            help="type of executor to collect stats in",
+        )
+        parser.add_argument(
+            "--executor-workers",
+            type=int,
+            default=1,
+            metavar="count",
+            help="number of workers for the executor",
+        )
+        parser.add_argument(
+            "--collect-workers",
+            type=int,
+            default=0,
+            metavar="count",
+            help=(
+                "number of worker processes to read process stats in "
+                "parallel (by default, stats are read in the executor)"
+            ),
+        )
+        parser.add_argument(
+            "--min-collect-interval",
+            type=float,
+            default=0.0,
+            metavar="seconds",
+            help=(
+                "minimum interval between collections, stats from the "
+                "previous one are reused for requests within the interval"
+            ),
+        )
+        parser.add_argument(
+            "--evict-grace",
+            type=int,
+            default=0,
+            metavar="count",
+            help=(
+                "number of updates metrics for processes that are not found "
+                "anymore are kept for"
+            ),
+        )
+        parser.add_argument(
+            "--gzip",
+            action="store_true",
+            help="compress responses for clients accepting gzip",
+        )
+        parser.add_argument(
+            "--openmetrics",
+            action="store_true",
+            help="return metrics in OpenMetrics format if requested",
+        )
+        collect_mode = parser.add_mutually_exclusive_group()
+        collect_mode.add_argument(
+            "--stateless",
+            action="store_true",
+            help=(
+                "generate metrics only for current processes at every "
+                "request, instead of updating persistent metrics"
+            ),
+        )
+        collect_mode.add_argument(
+            "--collect-interval",
+            type=float,
+            metavar="seconds",
+            help=(
+                "collect stats in background at the specified interval, "
+                "instead of at every request"
+            ),
+        )
 
     def configure(self, args: Namespace):
-        if args.pids:
-            pidlist = ", ".join(str(pid) for pid in args.pids)
-            self.logger.info(f"tracking stats for PIDs [{pidlist}]")
-        elif args.cmdline_regexps:
-            re_list = ", ".join(rexp.pattern for rexp in args.cmdline_regexps)
-            self.logger.info(
-                f"tracking stats for processes matching regexps [{re_list}]"
-            )
+        config_file: ConfigFile | None = None
+        if args.config:
+            if (
+                args.pids
+                or args.cmdline_regexps
+                or args.cgroups
+                or args.pidfiles
+                or args.systemd_units
+            ):
+                self.exit(
+                    "Error: processes can't be specified both on the "
+                    "command line and in the config file"
+                )
+            # the default for stats is only used as is if it's not passed
+            if (
+                args.labels
+                or args.include_descendants
+                or args.stats is not DEFAULT_STAT_GROUPS
+            ):
+                self.exit(
+                    "Error: labels, stats and descendants can't be "
+                    "specified both on the command line and in the config "
+                    "file"
+                )
+            config_file = ConfigFile(args.config)
+            try:
+                config = config_file.load()
+            except ConfigError as error:
+                self.exit(f"Error: {error}")
         else:
-            self.exit("Error: no PID or process names specified")
+            config = Config(
+                pids=tuple(args.pids or ()),
+                cmdline_regexps=tuple(args.cmdline_regexps or ()),
+                cgroups=tuple(args.cgroups or ()),
+                pidfiles=tuple(args.pidfiles or ()),
+                units=tuple(args.systemd_units or ()),
+                descendants=args.include_descendants,
+                labels=args.labels,
+                stat_groups=tuple(args.stats),
+            )
+            if not config.has_selectors:
+                self.exit("Error: no PID, cgroup or process names specified")
+        log_config(self.logger, config)
 
+        if args.executor_workers < 1:
+            self.exit("Error: executor workers must be at least 1")
+        if args.collect_workers < 0:
+            self.exit("Error: collect workers can't be negative")
+        if args.collect_workers and args.executor == "process":
+            self.exit(
+                "Error: collect workers can't be used with the process "
+                "executor"
+            )
         self._metric_handler = ProcessMetricsHandler(
             logger=self.logger,
-            pids=args.pids,
-            cmdline_regexps=args.cmdline_regexps,
-            labels=args.labels,
+            evict_grace=args.evict_grace,
+            aggregate=args.aggregate,
+            discovery=args.discovery,
+            collect_workers=args.collect_workers,
+            **config.handler_options(),
         )
-        self.create_metrics(self._metric_handler.get_metric_configs())
+        self._collect_interval = args.collect_interval
+        self._snapshot_collector: SnapshotCollector | None = None
+        self._snapshot_task: asyncio.Task | None = None
+        metrics = None
+        if self._collect_interval or args.stateless:
+            self._snapshot_collector = SnapshotCollector(
+                self._metric_handler.get_metric_configs()
+            )
+            self.registry.register_additional_collector(
+                self._snapshot_collector
+            )
+        else:
+            metrics = self.create_metrics(
+                self._metric_handler.get_metric_configs()
+            )
+        executor = create_executor(
+            args.executor,
+            self._metric_handler,
+            workers=args.executor_workers,
+        )
+        exporter_metrics = self.create_metrics(
+            self._metric_handler.get_exporter_metric_configs()
+        )
+        self._metrics_updater = MetricsUpdater(
+            self._metric_handler,
+            executor=executor,
+            min_interval=args.min_collect_interval,
+            exporter_metrics=exporter_metrics,
+        )
+        self._config_reloader: ConfigReloader | None = None
+        if config_file is not None:
+            self._config_reloader = ConfigReloader(
+                config_file,
+                self._metric_handler,
+                self._metrics_updater,
+                self.registry,
+                self.logger,
+                metrics=metrics,
+                snapshot_collector=self._snapshot_collector,
+                check_interval=args.config_check_interval,
+            )
+
+    def _get_exporter(self, args: Namespace) -> PrometheusExporter:
+        exporter = MetricsExporter(
+            self.name,
+            self.description,
+            args.host,
+            args.port,
+            self.registry,
+            metrics_path=args.metrics_path,
+            compress=args.gzip,
+            openmetrics=args.openmetrics,
+        )
+        exporter.app.on_startup.append(self.on_application_startup)
+        exporter.app.on_shutdown.append(self.on_application_shutdown)
+        return exporter
 
     async def on_application_startup(self, application: Application):
-        async def handler(metrics):
-            self._metric_handler.update_metrics(metrics)
+        if self._config_reloader is not None:
+            asyncio.get_running_loop().add_signal_handler(
+                signal.SIGHUP, self._config_reloader.schedule_reload
+            )
+            self._config_reloader.start()
+        if self._snapshot_collector is None:
+            application["exporter"].set_metric_update_handler(
+                self._metrics_updater.update_metrics
+            )
+        elif self._collect_interval:
+            self._snapshot_task = asyncio.create_task(
+                self._metrics_updater.update_snapshot_periodically(
+                    self._snapshot_collector, self._collect_interval
+                )
+            )
+        else:
+            application["exporter"].set_metric_update_handler(
+                self._update_snapshot
+            )
+
+    async def on_application_shutdown(self, application: Application):
+        if self._config_reloader is not None:
+            asyncio.get_running_loop().remove_signal_handler(signal.SIGHUP)
+            self._config_reloader.stop()
+        if self._snapshot_task:
+            self._snapshot_task.cancel()
+        self._metrics_updater.shutdown()
+        self._metric_handler.shutdown()
 
-        application["exporter"].set_metric_update_handler(handler)
+    async def _update_snapshot(self, metrics: dict[str, Metric]):
+        assert self._snapshot_collector is not None
+        await self._metrics_updater.update_snapshot(self._snapshot_collector)
 
 
 script = ProcessStatsExporter()
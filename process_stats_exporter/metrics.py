@@ -1,31 +1,65 @@
 """Create and update metrics."""
 
-from collections.abc import Callable
+from array import array
+from collections.abc import (
+    Callable,
+    Collection,
+)
 from itertools import chain
 from logging import Logger
-from typing import Any
+import math
+from re import Pattern
+from typing import (
+    Any,
+    NamedTuple,
+)
 
-from lxstats.process import Process
 from prometheus_aioexporter import MetricConfig
 from prometheus_client import Metric
 
+from .aggregate import Aggregator
+from .discovery import (
+    ProcConnectorDiscovery,
+    ProcessDiscovery,
+)
+from .instrument import (
+    exporter_metric_configs,
+    ScrapeStats,
+    update_exporter_metrics,
+)
 from .label import (
     CmdlineLabeler,
-    Labeler,
     PidLabeler,
 )
 from .process import (
     get_process_iterator,
+    ProcessCache,
     ProcessIteratorResult,
+    SelectorCache,
 )
+from .procfs import (
+    ProcfsProcess,
+    ProcReader,
+)
+from .sample import SampleStore
+from .shard import ShardedStatsReader
 from .stats import (
-    ProcessStatsCollector,
-    ProcessTasksStatsCollector,
+    create_collectors,
+    DEFAULT_STAT_GROUPS,
     StatsCollector,
 )
 
 ProcessIterator = Callable[..., ProcessIteratorResult]
 
+ChildUpdater = Callable[[Any], None]
+
+
+class CollectResult(NamedTuple):
+    """Samples and stats for a collection."""
+
+    samples: SampleStore
+    stats: ScrapeStats
+
 
 class ProcessMetricsHandler:
     """Handle metrics for processes."""
@@ -34,64 +68,432 @@ class ProcessMetricsHandler:
         self,
         logger: Logger,
         pids: list[str] | None = None,
-        cmdline_regexps: list[str] | None = None,
+        cmdline_regexps: list[Pattern] | None = None,
         labels: dict[str, str] | None = None,
         get_process_iterator: ProcessIterator = get_process_iterator,
+        evict_grace: int = 0,
+        aggregate: str | None = None,
+        discovery: str = "scan",
+        cgroups: list[str] | None = None,
+        pidfiles: list[str] | None = None,
+        units: list[str] | None = None,
+        descendants: bool = False,
+        stat_groups: Collection[str] = DEFAULT_STAT_GROUPS,
+        collect_workers: int = 0,
     ):
         self.logger = logger
+        self._get_process_iterator = get_process_iterator
+        self._evict_grace = evict_grace
+        self._aggregate = aggregate
+        self._discovery_type = discovery
+        self._discovery: ProcessDiscovery | None = None
+        self._collect_workers = collect_workers
+        self._process_cache = ProcessCache()
+        self._selector_cache = SelectorCache()
+        self._reader = ProcReader()
+        self._sharded_reader: ShardedStatsReader | None = None
+        if collect_workers:
+            self._sharded_reader = ShardedStatsReader(collect_workers)
+
+        self._label_names: list[str] = []
+        self._stat_groups: tuple[str, ...] = ()
+        self._base_labels: dict[str, str] = {}
+        self._collectors: list[StatsCollector] = []
+        self._aggregator: Aggregator | None = None
+        # the aggregation function in use, if any
+        self._aggregate_function: str | None = None
+        # names of metrics with values from collectors, and of all metrics
+        self._value_names: list[str] = []
+        self._metric_names: list[str] = []
+        self._counter_names: list[str] = []
+        # metrics children are cached for, and functions to update children
+        # values for each metric, by label values
+        self._children_metrics: list[Metric] = []
+        self._children: dict[tuple[str, ...], list[ChildUpdater]] = {}
+        # number of consecutive updates label values were not found in
+        self._missed_updates: dict[tuple[str, ...], int] = {}
+        # rows of processes by PID and start time, and counter values for
+        # each row, from the last update
+        self._last_rows: dict[tuple[int, int], int] = {}
+        self._last_counters: dict[str, array] = {}
+        # number of consecutive updates processes with kept counter values
+        # were not found in
+        self._counters_missed: dict[tuple[int, int], int] = {}
+        self.reconfigure(
+            pids=pids,
+            cmdline_regexps=cmdline_regexps,
+            labels=labels,
+            cgroups=cgroups,
+            pidfiles=pidfiles,
+            units=units,
+            descendants=descendants,
+            stat_groups=stat_groups,
+        )
+
+    def reconfigure(
+        self,
+        pids: list[str] | None = None,
+        cmdline_regexps: list[Pattern] | None = None,
+        labels: dict[str, str] | None = None,
+        cgroups: list[str] | None = None,
+        pidfiles: list[str] | None = None,
+        units: list[str] | None = None,
+        descendants: bool = False,
+        stat_groups: Collection[str] = DEFAULT_STAT_GROUPS,
+    ) -> bool:
+        """Set processes to collect stats for, their labels and stats.
+
+        Caches are kept, so that details for processes matching selectors
+        that didn't change are not read again.  Metric children for label
+        values not found anymore are evicted as usual.
+
+        If descendants are included, values for processes are aggregated
+        (summed, unless another function is set), since descendants have the
+        same labels as the selected process.
+
+        Collectors are only created again if label names, stat groups or
+        aggregation changed, in which case metrics must be created again from
+        :meth:`get_metric_configs`.
+
+        Return whether metric configs changed.
+
+        """
         self._pids = pids or ()
         self._cmdline_regexps = cmdline_regexps or ()
+        self._cgroups = cgroups or ()
+        self._pidfiles = pidfiles or ()
+        self._units = units or ()
+        self._descendants = descendants
         self._labels = labels or {}
-        self._get_process_iterator = get_process_iterator
 
         label_names = self._get_label_names()
-        self._collectors: list[StatsCollector] = [
-            ProcessStatsCollector(labels=label_names),
-            ProcessTasksStatsCollector(labels=label_names),
+        # labels not set by a labeler get an empty value
+        self._base_labels = dict.fromkeys(label_names, "")
+        self._base_labels.update(self._labels)
+        stat_groups = tuple(stat_groups)
+        aggregate = self._aggregate
+        if aggregate is None and descendants:
+            # descendants have the same labels as the selected process, so
+            # their values are summed rather than overwriting each other
+            aggregate = "sum"
+        if (
+            label_names == self._label_names
+            and stat_groups == self._stat_groups
+            and aggregate == self._aggregate_function
+        ):
+            return False
+
+        self._label_names = label_names
+        self._stat_groups = stat_groups
+        self._aggregate_function = aggregate
+        self._collectors = create_collectors(
+            stat_groups, labels=label_names, reader=self._reader
+        )
+        self._aggregator = None
+        if aggregate is not None:
+            self._aggregator = Aggregator(
+                chain(
+                    *(collector.metrics() for collector in self._collectors)
+                ),
+                function=aggregate,
+            )
+        self._value_names = [
+            config.name
+            for collector in self._collectors
+            for config in collector.metrics()
+        ]
+        metric_configs = self.get_metric_configs()
+        self._metric_names = [config.name for config in metric_configs]
+        self._counter_names = [
+            config.name
+            for config in metric_configs
+            if config.type == "counter"
         ]
+        return True
+
+    def reconfigure_options(self) -> dict[str, Any]:
+        """Return the current options for :meth:`reconfigure`."""
+        return {
+            "pids": list(self._pids),
+            "cmdline_regexps": list(self._cmdline_regexps),
+            "labels": dict(self._labels),
+            "cgroups": list(self._cgroups),
+            "pidfiles": list(self._pidfiles),
+            "units": list(self._units),
+            "descendants": self._descendants,
+            "stat_groups": self._stat_groups,
+        }
+
+    def worker_options(self) -> dict[str, Any]:
+        """Return options to create a handler in a worker process.
+
+        The handler created with these options collects the same samples.
+        Options can be pickled, unlike the handler once metrics have been
+        updated, since it holds metric children.
+
+        """
+        return {
+            "logger": self.logger,
+            "get_process_iterator": self._get_process_iterator,
+            "evict_grace": self._evict_grace,
+            "aggregate": self._aggregate,
+            "discovery": self._discovery_type,
+            "collect_workers": self._collect_workers,
+            **self.reconfigure_options(),
+        }
 
     def get_metric_configs(self) -> list[MetricConfig]:
         """Return a list of MetricConfigs."""
-        return list(
+        configs = list(
             chain(*(collector.metrics() for collector in self._collectors))
         )
+        if self._aggregator is not None:
+            configs.extend(self._aggregator.metric_configs())
+        return configs
+
+    def get_exporter_metric_configs(self) -> list[MetricConfig]:
+        """Return a list of MetricConfigs for metrics about the exporter."""
+        return exporter_metric_configs()
 
     def update_metrics(self, metrics: dict[str, Metric]):
         """Update the specified metrics for processes."""
-        process_iter = self._get_process_iterator(
-            pids=self._pids, cmdline_regexps=self._cmdline_regexps
-        )
-        for labeler, process in process_iter:
-            metric_values: dict[str, Any] = {}
-            for collector in self._collectors:
-                metric_values.update(collector.collect(process))
-            for name, metric in metrics.items():
-                self._update_metric(
-                    labeler, process, name, metric, metric_values[name]
+        self.apply_samples(metrics, self.collect().samples)
+
+    def collect(self) -> CollectResult:
+        """Collect metric values for processes.
+
+        This doesn't touch metrics, so it can be run in a separate thread or
+        process.  Samples are then applied with :meth:`apply_samples`.
+
+        """
+        stats = ScrapeStats()
+        files_opened, tasks_read = self._read_counts()
+        with stats.phase("scan"):
+            processes = list(
+                self._get_process_iterator(
+                    pids=self._pids,
+                    cmdline_regexps=self._cmdline_regexps,
+                    cgroups=self._cgroups,
+                    pidfiles=self._pidfiles,
+                    units=self._units,
+                    selector_cache=self._selector_cache,
+                    descendants=self._descendants,
+                    cache=self._process_cache,
+                    stats=stats,
+                    discovery=self._get_discovery(),
+                )
+            )
+        store = SampleStore(self._value_names)
+        with stats.phase("collect"):
+            self._collect_values(store, [process for _, process in processes])
+        base_labels = list(self._base_labels.items())
+        with stats.phase("label"):
+            for labeler, process in processes:
+                labels = labeler(process)
+                store.labels.append(
+                    tuple(
+                        _label_value(labels.get(name, value))
+                        for name, value in base_labels
+                    )
                 )
+        stats.pids_vanished += sum(
+            1 for index in range(len(store)) if store.is_empty(index)
+        )
+        stats.pids_matched = len(set(store.pids))
+        total_files_opened, total_tasks_read = self._read_counts()
+        stats.files_opened += total_files_opened - files_opened
+        stats.tasks_read = total_tasks_read - tasks_read
+        return CollectResult(store, stats)
 
-    def _update_metric(
+    def apply_samples(
         self,
-        labeler: Labeler,
-        process: Process,
-        metric_name: str,
-        metric: Metric,
-        value: Any,
+        metrics: dict[str, Metric],
+        samples: SampleStore,
     ):
-        """Update the value for a metrics."""
-        if value is None:
-            self.logger.warning(
-                f'empty value for metric "{metric_name}" on PID {process.pid}'
-            )
+        """Update the specified metrics with collected samples.
+
+        Values for counters are cumulative for each process, so counters are
+        incremented by the difference from the last value applied for the
+        same process, identified by PID and start time.
+
+        Metric children for each set of label values are cached across
+        calls.  Children for label values not found in samples for more than
+        the eviction grace number of updates are removed from metrics.
+
+        """
+        metrics_list = [metrics[name] for name in self._metric_names]
+        if metrics_list != self._children_metrics:
+            self._children_metrics = metrics_list
+            self._children = {}
+            self._missed_updates = {}
+            self._last_rows = {}
+            self._last_counters = {}
+            self._counters_missed = {}
+        store = self._counter_deltas(samples)
+        if self._aggregator is not None:
+            store = self._aggregator.aggregate(store)
+        cached_children = self._children
+        missed_updates = self._missed_updates
+        children: dict[tuple[str, ...], list[ChildUpdater]] = {}
+        # updaters for each row in the store
+        row_updaters = []
+        for labels in store.labels:
+            updaters = children.get(labels)
+            if updaters is None:
+                updaters = cached_children.get(labels)
+                if updaters is not None:
+                    missed_updates.pop(labels, None)
+                else:
+                    updaters = [
+                        _child_updater(metric, labels)
+                        for metric in metrics_list
+                    ]
+                children[labels] = updaters
+            row_updaters.append(updaters)
+        for metric_index, name in enumerate(self._metric_names):
+            for index, value in enumerate(store.columns[name]):
+                if math.isnan(value):
+                    self.logger.warning(
+                        f'empty value for metric "{name}" on PID '
+                        f"{store.pids[index]}"
+                    )
+                    continue
+                row_updaters[index][metric_index](value)
+
+        for label_values, updaters in cached_children.items():
+            if label_values in children:
+                continue
+            missed = missed_updates.get(label_values, 0) + 1
+            if missed > self._evict_grace:
+                for metric in metrics_list:
+                    metric.remove(*label_values)
+                missed_updates.pop(label_values, None)
+            else:
+                children[label_values] = updaters
+                missed_updates[label_values] = missed
+        self._children = children
+
+    def aggregate(self, samples: SampleStore) -> SampleStore:
+        """Return samples aggregated by labels, if aggregation is enabled.
+
+        Otherwise, samples are returned unchanged.
+
+        """
+        if self._aggregator is None:
+            return samples
+        return self._aggregator.aggregate(samples)
+
+    def update_exporter_metrics(
+        self, metrics: dict[str, Metric], stats: ScrapeStats
+    ):
+        """Update metrics about the exporter with stats from a collection."""
+        update_exporter_metrics(metrics, stats)
+
+    def shutdown(self):
+        """Release resources for collection."""
+        if self._sharded_reader is not None:
+            self._sharded_reader.shutdown()
+        if self._discovery is not None:
+            self._discovery.close()
+            self._discovery = None
+
+    def _get_discovery(self) -> ProcessDiscovery | None:
+        """Return the process discovery, creating it at first use.
+
+        It's created lazily so that it's set up in the process collecting
+        stats.
+
+        """
+        if self._discovery is None and self._discovery_type == "events":
+            try:
+                self._discovery = ProcConnectorDiscovery()
+            except OSError as error:
+                # scanning with the cache checks start times of all
+                # processes, so reused PIDs are matched again
+                self.logger.warning(
+                    f"process events not available ({error}), "
+                    "scanning /proc instead"
+                )
+                self._discovery_type = "scan"
+        return self._discovery
+
+    def _counter_deltas(self, store: SampleStore) -> SampleStore:
+        """Return a store with the change of counter values for processes.
+
+        Last values are replaced with the ones from the store, except for
+        empty ones.  Last values for processes not in the store are kept for
+        the eviction grace number of updates, like their series.
+
+        """
+        last_rows = self._last_rows
+        last_counters = self._last_counters
+        last_missed = self._counters_missed
+        keys = list(zip(store.pids, store.starttimes))
+        rows = {key: index for index, key in enumerate(keys)}
+        # rows in the last update for processes not in the store, whose last
+        # values are kept
+        kept: list[int] = []
+        self._counters_missed = {}
+        for key, last_index in last_rows.items():
+            if key in rows:
+                continue
+            missed = last_missed.get(key, 0) + 1
+            if missed > self._evict_grace:
+                continue
+            rows[key] = len(keys) + len(kept)
+            kept.append(last_index)
+            self._counters_missed[key] = missed
+        self._last_rows = rows
+        # rows in the store, and in the last update for the same process
+        matched = [
+            (index, last_rows[key])
+            for index, key in enumerate(keys)
+            if key in last_rows
+        ]
+        self._last_counters = {}
+        deltas = {}
+        for name in self._counter_names:
+            values = store.columns[name]
+            self._last_counters[name] = current = array("d", values)
+            last_values = last_counters.get(name)
+            if last_values is None:
+                continue
+            current.extend(last_values[index] for index in kept)
+            if not matched:
+                continue
+            deltas[name] = delta = array("d", values)
+            for index, last_index in matched:
+                value, last_value = values[index], last_values[last_index]
+                if math.isnan(last_value):
+                    continue
+                if math.isnan(value):
+                    # keep the last value for the next update
+                    current[index] = last_value
+                elif value >= last_value:
+                    delta[index] = value - last_value
+        return store.replace_columns(deltas)
+
+    def _collect_values(
+        self, store: SampleStore, processes: list[ProcfsProcess]
+    ):
+        """Add start time and metric values for processes to the store."""
+        if self._sharded_reader is not None:
+            self._sharded_reader.read(self._stat_groups, processes, store)
             return
+        collectors = self._collectors
+        for process in processes:
+            store.add_process(process.pid)
+            for collector in collectors:
+                collector.collect(process, store)
 
-        labels = self._labels.copy()
-        labels.update(labeler(process))
-        metric = metric.labels(**labels)
-        if metric._type == "counter":
-            metric.inc(value)
-        elif metric._type == "gauge":
-            metric.set(value)
+    def _read_counts(self) -> tuple[int, int]:
+        """Return running counts of opened files and read tasks."""
+        files_opened = self._reader.files_opened
+        tasks_read = self._reader.tasks_read
+        if self._sharded_reader is not None:
+            files_opened += self._sharded_reader.files_opened
+            tasks_read += self._sharded_reader.tasks_read
+        return files_opened, tasks_read
 
     def _get_label_names(self) -> list[str]:
         """Return a set of label names."""
@@ -100,4 +502,26 @@ class ProcessMetricsHandler:
             labels.update(CmdlineLabeler(regexp).labels())
         if self._pids:
             labels.update(PidLabeler().labels())
-        return list(labels)
+        if self._cgroups:
+            labels.add("cgroup")
+        if self._pidfiles:
+            labels.add("pidfile")
+        if self._units:
+            labels.add("unit")
+        return sorted(labels)
+
+
+def _child_updater(
+    metric: Metric, label_values: tuple[str, ...]
+) -> ChildUpdater:
+    """Return a function to update the metric child for label values."""
+    child = metric.labels(*label_values)
+    updater: ChildUpdater = (
+        child.inc if metric._type == "counter" else child.set
+    )
+    return updater
+
+
+def _label_value(value: str | None) -> str:
+    # regexp groups that don't take part in the match have no value
+    return "" if value is None else str(value)
@@ -0,0 +1,189 @@
+"""Prefilter regexps based on literal strings they require.
+
+Most command line regexps contain literal strings (e.g. a program name) that
+must be found in the command line for the regexp to match.  These are
+extracted from the parsed regexps, and a single scan of the command line for
+all literals selects regexps that can match, so that only those are run.
+
+"""
+
+from collections import defaultdict
+from collections.abc import (
+    Iterable,
+    Sequence,
+)
+from functools import lru_cache
+import importlib
+import re
+from re import Pattern
+import sys
+from typing import Any
+
+# the regexp parser module was made private in Python 3.11
+sre_parse: Any = importlib.import_module(
+    "re._parser" if sys.version_info >= (3, 11) else "sre_parse"
+)
+
+_REPEATS = frozenset(
+    getattr(sre_parse, name)
+    for name in ("MAX_REPEAT", "MIN_REPEAT", "POSSESSIVE_REPEAT")
+    if hasattr(sre_parse, name)
+)
+
+
+class RegexpPrefilter:
+    """Select regexps that can match a string.
+
+    A string is scanned once for literals required by all regexps, and only
+    regexps whose literals are found, or that don't require any literal, are
+    candidates for matching.
+
+    """
+
+    def __init__(self, regexps: Sequence[Pattern]):
+        # indexes of regexps that are always candidates
+        self._always: list[int] = []
+        by_literal: defaultdict[str, set[int]] = defaultdict(set)
+        for idx, regexp in enumerate(regexps):
+            literals = required_literals(regexp)
+            if literals is None:
+                self._always.append(idx)
+            else:
+                for literal in literals:
+                    by_literal[literal].add(idx)
+
+        # Only the longest literal found at each position is reported by the
+        # scan, so indexes for a literal include those for its prefixes.
+        self._indexes = {
+            literal: frozenset(
+                idx
+                for other, indexes in by_literal.items()
+                if literal.startswith(other)
+                for idx in indexes
+            )
+            for literal in by_literal
+        }
+        self._scanner: Pattern | None = None
+        if by_literal:
+            self._scanner = re.compile(
+                f"(?=({literals_regexp(by_literal)}))", re.DOTALL
+            )
+
+    def candidates(self, text: str) -> list[int]:
+        """Return sorted indexes of regexps that can match the text."""
+        if self._scanner is None:
+            return self._always
+        found = {match.group(1) for match in self._scanner.finditer(text)}
+        if not found:
+            return self._always
+        indexes = set(self._always)
+        for literal in found:
+            indexes.update(self._indexes[literal])
+        return sorted(indexes)
+
+
+@lru_cache(maxsize=16)
+def get_prefilter(regexps: tuple[Pattern, ...]) -> RegexpPrefilter:
+    """Return a prefilter for regexps, reused across scans."""
+    return RegexpPrefilter(regexps)
+
+
+def required_literals(regexp: Pattern) -> frozenset[str] | None:
+    """Return literal strings a regexp requires to match.
+
+    Any string the regexp matches contains at least one of the returned
+    literals.  If no literal is required, None is returned.
+
+    """
+    if not isinstance(regexp.pattern, str) or regexp.flags & re.IGNORECASE:
+        return None
+    return _sequence_literals(sre_parse.parse(regexp.pattern, regexp.flags))
+
+
+def literals_regexp(literals: Iterable[str]) -> str:
+    """Return a regexp matching the longest of literals at a position.
+
+    Literals are arranged in a trie, so that the regexp branches only where
+    literals differ.
+
+    """
+    trie: dict[str, dict] = {}
+    for literal in literals:
+        node = trie
+        for char in literal:
+            node = node.setdefault(char, {})
+        # the empty key marks the end of a literal
+        node[""] = {}
+    return _trie_regexp(trie)
+
+
+def _trie_regexp(node: dict[str, dict]) -> str:
+    alternatives = [
+        re.escape(char) + _trie_regexp(child)
+        for char, child in sorted(node.items())
+        if char
+    ]
+    if not alternatives:
+        return ""
+    if "" not in node and len(alternatives) == 1:
+        return alternatives[0]
+    regexp = f"(?:{'|'.join(alternatives)})"
+    # greedy, so that longer literals are preferred
+    return regexp + "?" if "" in node else regexp
+
+
+def _sequence_literals(items: Iterable[Any]) -> frozenset[str] | None:
+    """Return the best set of literals required by a sequence of items.
+
+    Sets with longer literals are preferred, since they select less
+    candidates.
+
+    """
+    requirements: list[frozenset[str]] = []
+    run: list[str] = []
+    for op, value in _flatten(items):
+        if op == sre_parse.LITERAL:
+            run.append(chr(value))
+            continue
+        if run:
+            requirements.append(frozenset(("".join(run),)))
+            run = []
+        literals = None
+        if op == sre_parse.BRANCH:
+            literals = _branch_literals(value[1])
+        elif op in _REPEATS and value[0] >= 1:
+            literals = _sequence_literals(value[2])
+        if literals is not None:
+            requirements.append(literals)
+    if run:
+        requirements.append(frozenset(("".join(run),)))
+    if not requirements:
+        return None
+    return max(
+        requirements,
+        key=lambda literals: (min(map(len, literals)), -len(literals)),
+    )
+
+
+def _branch_literals(branches: Iterable[Any]) -> frozenset[str] | None:
+    """Return literals required by alternatives, one for each of them."""
+    result: set[str] = set()
+    for branch in branches:
+        literals = _sequence_literals(branch)
+        if literals is None:
+            return None
+        result.update(literals)
+    return frozenset(result)
+
+
+def _flatten(items: Iterable[Any]) -> Iterable[tuple[Any, Any]]:
+    """Return items, with content of groups inlined.
+
+    Groups changing flags are not inlined.
+
+    """
+    for op, value in items:
+        if op == sre_parse.SUBPATTERN and not (value[1] or value[2]):
+            yield from _flatten(value[3])
+        else:
+            yield op, value
@@ -1,52 +1,686 @@
 """Helpers to collect processes."""
 
-from collections.abc import Iterable
-from itertools import chain
-
-from lxstats.process import (
-    Collection,
-    Collector,
-    CommandLineFilter,
-    Process,
+from collections import deque
+from collections.abc import (
+    Iterable,
+    Mapping,
 )
+import glob
+from itertools import chain
+import os
+from pathlib import Path
+from re import Pattern
+from typing import NamedTuple
 
+from .discovery import ProcessDiscovery
+from .instrument import ScrapeStats
 from .label import (
+    CgroupLabeler,
     CmdlineLabeler,
     Labeler,
     PidLabeler,
+    StaticLabeler,
+)
+from .prefilter import (
+    get_prefilter,
+    RegexpPrefilter,
 )
+from .procfs import (
+    iter_pids,
+    ProcfsProcess,
+)
+
+ProcessIteratorResult = Iterable[tuple[Labeler, ProcfsProcess]]
+
+# Paths of the cgroup for system units, for the unified (v2) and legacy (v1)
+# cgroup hierarchies, relative to the cgroup root
+UNIT_SLICE_PATHS = ("system.slice", "systemd/system.slice")
+
+
+class CachedProcess(NamedTuple):
+    """Cached details for a process."""
+
+    starttime: int
+    cmd: str
+    # for each regexp, a labeler with labels for the match, or None if the
+    # process doesn't match the regexp
+    labelers: tuple[Labeler | None, ...]
+    comm: str = ""
+
+
+class ProcessCache:
+    """Cache for process command lines and regexp matches across scans.
+
+    Entries are keyed on the process PID and start time, so a reused PID
+    never gets details from a different process.
+
+    """
+
+    def __init__(self) -> None:
+        self._patterns: tuple[tuple[str, int], ...] = ()
+        self._entries: dict[int, CachedProcess] = {}
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def bind(self, cmdline_regexps: list[Pattern]) -> bool:
+        """Set regexps entries are for.
+
+        If regexps changed, matches for regexps that are kept are reused,
+        and cached command lines are matched against new ones.  If none is
+        kept, the cache is cleared.
+
+        Return whether the cache was cleared.
+
+        """
+        patterns = tuple(
+            (regexp.pattern, regexp.flags) for regexp in cmdline_regexps
+        )
+        if patterns == self._patterns:
+            return False
+        previous = {pattern: idx for idx, pattern in enumerate(self._patterns)}
+        self._patterns = patterns
+        if not previous.keys() & set(patterns):
+            self._entries.clear()
+            return True
+
+        for pid, entry in self._entries.items():
+            labelers = []
+            for pattern, regexp in zip(patterns, cmdline_regexps):
+                idx = previous.get(pattern)
+                if idx is None:
+                    labels = CmdlineLabeler(regexp).match(
+                        entry.cmd, entry.comm
+                    )
+                    labelers.append(_static_labeler(labels))
+                else:
+                    labelers.append(entry.labelers[idx])
+            self._entries[pid] = entry._replace(labelers=tuple(labelers))
+        return False
+
+    def get(self, pid: int, starttime: int) -> CachedProcess | None:
+        """Return the entry for a process, if cached."""
+        entry = self._entries.get(pid)
+        if entry is None or entry.starttime != starttime:
+            return None
+        return entry
+
+    def add(self, pid: int, entry: CachedProcess):
+        """Cache an entry for a process."""
+        self._entries[pid] = entry
+
+    def matching_pids(self) -> set[int]:
+        """Return PIDs of processes matching any regexp."""
+        return {
+            pid
+            for pid, entry in self._entries.items()
+            if any(labeler is not None for labeler in entry.labelers)
+        }
+
+    def evict(self, pids: set[int]):
+        """Drop entries for processes whose PID is not in the set."""
+        for pid in self._entries.keys() - pids:
+            del self._entries[pid]
+
+
+class SelectorCache:
+    """Cache resolution of pidfiles and systemd units to processes.
+
+    PIDs from pidfiles are read again only if the file inode or modification
+    time changes.  Cgroups for units are looked up again only if their
+    ``cgroup.procs`` file can't be read anymore.
+
+    """
+
+    def __init__(self) -> None:
+        # pidfile (inode, mtime) and PID, by path
+        self._pidfiles: dict[str, tuple[tuple[int, int], int | None]] = {}
+        self._unit_cgroups: dict[str, Path] = {}
 
-ProcessIteratorResult = Iterable[tuple[Labeler, Process]]
+    def pidfile_pid(
+        self, path: str, stats: ScrapeStats | None = None
+    ) -> int | None:
+        """Return the PID from a pidfile, or None if it can't be read."""
+        try:
+            stat = os.stat(path)
+        except OSError:
+            self._pidfiles.pop(path, None)
+            return None
+        key = (stat.st_ino, stat.st_mtime_ns)
+        entry = self._pidfiles.get(path)
+        if entry is not None and entry[0] == key:
+            return entry[1]
+        pid = read_pidfile(path, stats=stats)
+        self._pidfiles[path] = (key, pid)
+        return pid
+
+    def unit_pids(
+        self, cgroup_root: Path, unit: str, stats: ScrapeStats | None = None
+    ) -> list[int] | None:
+        """Return PIDs of processes for a systemd unit.
+
+        If the unit cgroup is not found, None is returned.
+
+        """
+        path = self._unit_cgroups.get(unit)
+        if path is not None:
+            pids = read_cgroup_pids(path, stats=stats)
+            if pids is not None:
+                return pids
+            del self._unit_cgroups[unit]
+        for slice_path in UNIT_SLICE_PATHS:
+            path = cgroup_root / slice_path / unit
+            pids = read_cgroup_pids(path, stats=stats)
+            if pids is not None:
+                self._unit_cgroups[unit] = path
+                return pids
+        return None
 
 
 def get_process_iterator(
     proc: str = "/proc",
     pids: list[str] | None = None,
-    cmdline_regexps: list[str] | None = None,
+    cmdline_regexps: list[Pattern] | None = None,
+    cache: ProcessCache | None = None,
+    stats: ScrapeStats | None = None,
+    discovery: ProcessDiscovery | None = None,
+    cgroups: list[str] | None = None,
+    cgroup_root: str = "/sys/fs/cgroup",
+    pidfiles: list[str] | None = None,
+    units: list[str] | None = None,
+    selector_cache: SelectorCache | None = None,
+    descendants: bool = False,
 ) -> ProcessIteratorResult:
     """Return an iterator yielding tuples with (Labeler, Process).
 
     :param proc: the path to the ``/proc`` directory.
-    :param pids: a list of PIDs of process to return. If this is
-        specified, other filters are ignored.
-    :param cmdline_regexps: a list of strings with regexps to filter
-        process command line.
+    :param pids: a list of PIDs of process to return.  If this, pidfiles or
+        units are specified, other filters are ignored.
+    :param cmdline_regexps: a list of compiled regexps to filter process
+        command line.
+    :param cache: a :class:`ProcessCache` to reuse command lines and labels
+        from previous scans.  If specified, returned processes don't have
+        stats collected, and labelers return cached labels.
+    :param stats: :class:`ScrapeStats` to update with counts of scanned
+        processes and opened files.
+    :param discovery: a :class:`ProcessDiscovery` to find started processes
+        with, instead of scanning all processes.  This requires a cache.
+    :param cgroups: a list of cgroup paths or glob patterns, relative to the
+        cgroup root, to return processes from.  If this is specified, command
+        line regexps are ignored.
+    :param cgroup_root: the path to the cgroup filesystem.
+    :param pidfiles: a list of paths of pidfiles for processes to return.
+    :param units: a list of systemd unit names to return processes for.
+    :param selector_cache: a :class:`SelectorCache` to reuse resolution of
+        pidfiles and units from previous scans.
+    :param descendants: whether to also return descendants of selected
+        processes, with the same labels.
 
     """
-    labeler: Labeler
-    if pids:
-        labeler = PidLabeler()
-        collection = Collection(collector=Collector(proc=proc, pids=pids))
-        return ((labeler, process) for process in collection)
+    if stats is None:
+        stats = ScrapeStats()
+    proc_path = Path(proc).absolute()
+    result = _select_processes(
+        proc_path,
+        pids=pids,
+        cmdline_regexps=cmdline_regexps,
+        cache=cache,
+        stats=stats,
+        discovery=discovery,
+        cgroups=cgroups,
+        cgroup_root=cgroup_root,
+        pidfiles=pidfiles,
+        units=units,
+        selector_cache=selector_cache,
+    )
+    if descendants:
+        return _with_descendants(proc_path, result, stats)
+    return result
+
+
+def _select_processes(
+    proc_path: Path,
+    pids: list[str] | None,
+    cmdline_regexps: list[Pattern] | None,
+    cache: ProcessCache | None,
+    stats: ScrapeStats,
+    discovery: ProcessDiscovery | None,
+    cgroups: list[str] | None,
+    cgroup_root: str,
+    pidfiles: list[str] | None,
+    units: list[str] | None,
+    selector_cache: SelectorCache | None,
+) -> ProcessIteratorResult:
+    """Return processes from selectors."""
+    if pids or pidfiles or units:
+        if selector_cache is None:
+            selector_cache = SelectorCache()
+        return chain(
+            _get_pids(proc_path, pids or [], stats),
+            _get_pidfiles(proc_path, pidfiles or [], selector_cache, stats),
+            _get_units(
+                proc_path,
+                Path(cgroup_root),
+                units or [],
+                selector_cache,
+                stats,
+            ),
+        )
+    elif cgroups:
+        return _get_cgroups(proc_path, Path(cgroup_root), cgroups, stats)
+    elif cmdline_regexps and cache is not None and discovery is not None:
+        return _discover_cmdline_regexps(
+            proc_path, cmdline_regexps, cache, discovery, stats
+        )
+    elif cmdline_regexps and cache is not None:
+        return _scan_cmdline_regexps_cached(
+            proc_path, cmdline_regexps, cache, stats
+        )
     elif cmdline_regexps:
-        collectors = []
-        for cmdline_re in cmdline_regexps:
-            collection = Collection(collector=Collector(proc=proc))
-            collection.add_filter(
-                CommandLineFilter(cmdline_re, include_args=True)
-            )
-            labeler = CmdlineLabeler(cmdline_re)
-            collectors.append((labeler, process) for process in collection)
-        return chain(*collectors)
+        return _scan_cmdline_regexps(proc_path, cmdline_regexps, stats)
     else:
         return iter(())
+
+
+def _with_descendants(
+    proc: Path, processes: ProcessIteratorResult, stats: ScrapeStats
+) -> ProcessIteratorResult:
+    """Return processes along with their descendants.
+
+    Descendants are labeled with labels for the ancestor process.  Those that
+    are selected themselves are only returned with their own labels.
+
+    """
+    roots = list(processes)
+    root_pids = {process.pid for _, process in roots}
+    children = build_children_index(proc, stats=stats)
+    for labeler, root in roots:
+        yield labeler, root
+        pids = children.get(root.pid)
+        if not pids:
+            continue
+        root_labeler = StaticLabeler(dict(labeler(root)))
+        pending = deque(pids)
+        while pending:
+            pid = pending.popleft()
+            if pid in root_pids:
+                continue
+            yield root_labeler, ProcfsProcess(pid, proc / str(pid))
+            pending.extend(children.get(pid, ()))
+
+
+def build_children_index(
+    proc: str | Path, stats: ScrapeStats | None = None
+) -> dict[int, list[int]]:
+    """Return PIDs of child processes, by parent PID.
+
+    This reads the ``stat`` file of all processes in ``/proc`` once.
+
+    """
+    children: dict[int, list[int]] = {}
+    for pid in iter_pids(proc):
+        if stats is not None:
+            stats.pids_scanned += 1
+        ppid = read_ppid(os.path.join(proc, str(pid)), stats=stats)
+        if ppid is not None:
+            children.setdefault(ppid, []).append(pid)
+    return children
+
+
+def _get_pids(
+    proc: Path, pids: list[str], stats: ScrapeStats
+) -> ProcessIteratorResult:
+    """Return existing processes for PIDs."""
+    labeler = PidLabeler()
+    for pid in sorted(int(pid) for pid in pids):
+        stats.pids_scanned += 1
+        process_dir = proc / str(pid)
+        if not process_dir.is_dir():
+            stats.pids_vanished += 1
+            continue
+        yield labeler, ProcfsProcess(pid, process_dir)
+
+
+def _get_pidfiles(
+    proc: Path,
+    pidfiles: list[str],
+    selector_cache: SelectorCache,
+    stats: ScrapeStats,
+) -> ProcessIteratorResult:
+    """Return existing processes for PIDs in pidfiles."""
+    for path in pidfiles:
+        stats.pids_scanned += 1
+        pid = selector_cache.pidfile_pid(path, stats=stats)
+        if pid is None:
+            stats.pids_vanished += 1
+            continue
+        process_dir = proc / str(pid)
+        if not process_dir.is_dir():
+            stats.pids_vanished += 1
+            continue
+        yield StaticLabeler({"pidfile": path}), ProcfsProcess(pid, process_dir)
+
+
+def _get_units(
+    proc: Path,
+    cgroup_root: Path,
+    units: list[str],
+    selector_cache: SelectorCache,
+    stats: ScrapeStats,
+) -> ProcessIteratorResult:
+    """Return processes for systemd units."""
+    for unit in units:
+        if "." not in unit:
+            unit += ".service"
+        labeler = StaticLabeler({"unit": unit})
+        for pid in selector_cache.unit_pids(cgroup_root, unit, stats) or ():
+            stats.pids_scanned += 1
+            yield labeler, ProcfsProcess(pid, proc / str(pid))
+
+
+def _get_cgroups(
+    proc: Path, cgroup_root: Path, cgroups: list[str], stats: ScrapeStats
+) -> ProcessIteratorResult:
+    """Return processes in cgroups matching paths or patterns.
+
+    Processes are read from the ``cgroup.procs`` file of each cgroup.
+
+    """
+    seen_cgroups = set()
+    for pattern in cgroups:
+        paths = sorted(glob.glob(str(cgroup_root / pattern.strip("/"))))
+        for path in paths:
+            cgroup = os.path.relpath(path, cgroup_root)
+            if cgroup in seen_cgroups:
+                continue
+            seen_cgroups.add(cgroup)
+            pids = read_cgroup_pids(path, stats=stats)
+            if pids is None:
+                continue
+            labeler = CgroupLabeler(cgroup)
+            for pid in pids:
+                stats.pids_scanned += 1
+                yield labeler, ProcfsProcess(pid, proc / str(pid))
+
+
+def _scan_cmdline_regexps(
+    proc: Path, cmdline_regexps: list[Pattern], stats: ScrapeStats
+) -> ProcessIteratorResult:
+    """Scan ``/proc`` once, matching each process against all regexps.
+
+    Each process command line is read only once.  Results are grouped by
+    regexp, in the order regexps are passed.
+
+    """
+    prefilter = get_prefilter(tuple(cmdline_regexps))
+    labelers = [CmdlineLabeler(regexp) for regexp in cmdline_regexps]
+    matches: list[list[ProcfsProcess]] = [[] for _ in cmdline_regexps]
+    for pid in iter_pids(proc):
+        stats.pids_scanned += 1
+        process_dir = proc / str(pid)
+        cmd = read_cmd(process_dir, stats=stats)
+        if cmd is None:
+            stats.pids_vanished += 1
+            continue
+        process = None
+        for idx in prefilter.candidates(cmd):
+            if not cmdline_regexps[idx].search(cmd):
+                continue
+            if process is None:
+                process = ProcfsProcess(pid, process_dir)
+            matches[idx].append(process)
+
+    return chain.from_iterable(
+        ((labeler, process) for process in processes)
+        for labeler, processes in zip(labelers, matches)
+    )
+
+
+def _scan_cmdline_regexps_cached(
+    proc: Path,
+    cmdline_regexps: list[Pattern],
+    cache: ProcessCache,
+    stats: ScrapeStats,
+) -> ProcessIteratorResult:
+    """Scan ``/proc`` matching processes against regexps, using a cache.
+
+    The command line is read and matched only for processes that are not in
+    the cache.
+
+    """
+    cache.bind(cmdline_regexps)
+    prefilter = get_prefilter(tuple(cmdline_regexps))
+    labelers = [CmdlineLabeler(regexp) for regexp in cmdline_regexps]
+    matches: list[list[tuple[Labeler, ProcfsProcess]]] = [
+        [] for _ in cmdline_regexps
+    ]
+    seen_pids = set()
+    for pid in iter_pids(proc):
+        stats.pids_scanned += 1
+        process_dir = proc / str(pid)
+        stat = read_comm_starttime(process_dir, stats=stats)
+        if stat is None:
+            stats.pids_vanished += 1
+            continue
+        comm, starttime = stat
+        entry = cache.get(pid, starttime)
+        if entry is None:
+            entry = _match_process(
+                process_dir, comm, starttime, labelers, prefilter, stats
+            )
+            if entry is None:
+                stats.pids_vanished += 1
+                continue
+            cache.add(pid, entry)
+        seen_pids.add(pid)
+
+        process = None
+        for idx, labeler in enumerate(entry.labelers):
+            if labeler is None:
+                continue
+            if process is None:
+                process = ProcfsProcess(pid, process_dir)
+            matches[idx].append((labeler, process))
+
+    cache.evict(seen_pids)
+    return chain.from_iterable(matches)
+
+
+def _discover_cmdline_regexps(
+    proc: Path,
+    cmdline_regexps: list[Pattern],
+    cache: ProcessCache,
+    discovery: ProcessDiscovery,
+    stats: ScrapeStats,
+) -> ProcessIteratorResult:
+    """Match processes against regexps, using discovery and a cache.
+
+    Only processes that started since the previous scan are matched.  Files
+    are otherwise read only for cached matching processes, to check that
+    their PID has not been reused.
+
+    """
+    changes = discovery.poll()
+    pids = discovery.pids if cache.bind(cmdline_regexps) else changes.started
+    cache.evict(discovery.pids)
+    prefilter = get_prefilter(tuple(cmdline_regexps))
+    labelers = [CmdlineLabeler(regexp) for regexp in cmdline_regexps]
+    matches: list[list[tuple[Labeler, ProcfsProcess]]] = [
+        [] for _ in cmdline_regexps
+    ]
+    for pid in sorted(pids | cache.matching_pids()):
+        stats.pids_scanned += 1
+        process_dir = proc / str(pid)
+        stat = read_comm_starttime(process_dir, stats=stats)
+        if stat is None:
+            stats.pids_vanished += 1
+            continue
+        comm, starttime = stat
+        entry = None if pid in pids else cache.get(pid, starttime)
+        if entry is None:
+            entry = _match_process(
+                process_dir, comm, starttime, labelers, prefilter, stats
+            )
+            if entry is None:
+                stats.pids_vanished += 1
+                continue
+            cache.add(pid, entry)
+
+        process = None
+        for idx, labeler in enumerate(entry.labelers):
+            if labeler is None:
+                continue
+            if process is None:
+                process = ProcfsProcess(pid, process_dir)
+            matches[idx].append((labeler, process))
+
+    return chain.from_iterable(matches)
+
+
+def _match_process(
+    process_dir: Path,
+    comm: str,
+    starttime: int,
+    labelers: list[CmdlineLabeler],
+    prefilter: RegexpPrefilter,
+    stats: ScrapeStats,
+) -> CachedProcess | None:
+    """Return a cache entry matching a process against labelers.
+
+    Only labelers for regexps selected by the prefilter are matched.
+
+    If the process doesn't exist anymore, None is returned.
+
+    """
+    cmd = read_cmd(process_dir, stats=stats)
+    if cmd is None:
+        return None
+    matched: list[Labeler | None] = [None] * len(labelers)
+    for idx in prefilter.candidates(cmd):
+        matched[idx] = _static_labeler(labelers[idx].match(cmd, comm))
+    return CachedProcess(
+        starttime=starttime, cmd=cmd, labelers=tuple(matched), comm=comm
+    )
+
+
+def _static_labeler(labels: Mapping[str, str] | None) -> Labeler | None:
+    return None if labels is None else StaticLabeler(labels)
+
+
+def read_cmd(
+    process_dir: str | Path, stats: ScrapeStats | None = None
+) -> str | None:
+    """Return the command line for a process, as a string.
+
+    Arguments are joined by spaces.  For kernel tasks, which have an empty
+    command line, the command name is returned in brackets.
+
+    If the process doesn't exist anymore, None is returned.
+
+    """
+    try:
+        with open(os.path.join(process_dir, "cmdline"), "rb") as fd:
+            cmdline = fd.read()
+    except OSError:
+        return None
+    if stats is not None:
+        stats.files_opened += 1
+    # only the first line is considered, like lxstats does
+    cmdline = cmdline.split(b"\n", 1)[0].strip(b"\x00")
+    if cmdline:
+        return cmdline.replace(b"\x00", b" ").decode(errors="replace")
+    try:
+        with open(os.path.join(process_dir, "comm"), "rb") as fd:
+            comm = fd.read().decode(errors="replace").strip()
+    except OSError:
+        comm = ""
+    else:
+        if stats is not None:
+            stats.files_opened += 1
+    return f"[{comm}]" if comm else ""
+
+
+def read_pidfile(
+    path: str | Path, stats: ScrapeStats | None = None
+) -> int | None:
+    """Return the PID from a pidfile.
+
+    If the file can't be read or doesn't contain a PID, None is returned.
+
+    """
+    try:
+        with open(path, "rb") as fd:
+            content = fd.read(64)
+    except OSError:
+        return None
+    if stats is not None:
+        stats.files_opened += 1
+    try:
+        return int(content.split()[0])
+    except (IndexError, ValueError):
+        return None
+
+
+def read_cgroup_pids(
+    cgroup_dir: str | Path, stats: ScrapeStats | None = None
+) -> list[int] | None:
+    """Return PIDs of processes in a cgroup, from its ``cgroup.procs`` file.
+
+    If the file can't be read, None is returned.
+
+    """
+    try:
+        with open(os.path.join(cgroup_dir, "cgroup.procs"), "rb") as fd:
+            content = fd.read()
+    except OSError:
+        return None
+    if stats is not None:
+        stats.files_opened += 1
+    return [int(pid) for pid in content.split()]
+
+
+def read_ppid(
+    process_dir: str | Path, stats: ScrapeStats | None = None
+) -> int | None:
+    """Return the parent PID of a process from ``/proc/<pid>/stat``.
+
+    If the process doesn't exist anymore, None is returned.
+
+    """
+    try:
+        with open(os.path.join(process_dir, "stat"), "rb") as fd:
+            content = fd.read()
+    except OSError:
+        return None
+    if stats is not None:
+        stats.files_opened += 1
+    fields = content[content.rfind(b")") + 2 :].split(maxsplit=2)
+    try:
+        return int(fields[1])
+    except (IndexError, ValueError):
+        return None
+
+
+def read_comm_starttime(
+    process_dir: str | Path, stats: ScrapeStats | None = None
+) -> tuple[str, int] | None:
+    """Return process name and start time from ``/proc/<pid>/stat``.
+
+    If the process doesn't exist anymore, None is returned.
+
+    """
+    try:
+        with open(os.path.join(process_dir, "stat"), "rb") as fd:
+            content = fd.read()
+    except OSError:
+        return None
+    if stats is not None:
+        stats.files_opened += 1
+    start = content.find(b"(")
+    end = content.rfind(b")")
+    fields = content[end + 2 :].split()
+    try:
+        starttime = int(fields[19])
+    except (IndexError, ValueError):
+        return None
+    return content[start + 1 : end].decode(errors="replace"), starttime
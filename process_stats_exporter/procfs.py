@@ -0,0 +1,398 @@
+"""Fast readers for process files under ``/proc``.
+
+These only read the files and fields that are needed, avoiding the full
+parsing of all process files done by :class:`lxstats.process.Process`.
+
+"""
+
+from collections import defaultdict
+from collections.abc import (
+    Callable,
+    Iterable,
+    Iterator,
+    Sequence,
+)
+import os
+from pathlib import Path
+from typing import (
+    Any,
+    NamedTuple,
+)
+
+from lxstats.process import Process
+
+# Index of fields in /proc/<pid>/stat, counting from the one after the
+# process name
+STAT_FIELDS = {
+    name: index
+    for index, name in enumerate(
+        (
+            "state",
+            "ppid",
+            "pgrp",
+            "session",
+            "tty_nr",
+            "tpgid",
+            "flags",
+            "minflt",
+            "cminflt",
+            "majflt",
+            "cmajflt",
+            "utime",
+            "stime",
+            "cutime",
+            "cstime",
+            "priority",
+            "nice",
+            "num_threads",
+            "itrealvalue",
+            "starttime",
+            "vsize",
+            "rss",
+            "rsslim",
+            "startcode",
+            "endcode",
+            "startstack",
+            "kstkesp",
+            "kstkeip",
+            "signal",
+            "blocked",
+            "sigignore",
+            "sigcatch",
+            "wchan",
+            "nswap",
+            "cnswap",
+            "exit_signal",
+            "processor",
+            "rt_priority",
+            "policy",
+            "delayacct_blkio_ticks",
+            "guest_time",
+            "cguest_time",
+        )
+    )
+}
+
+
+# Task states, as reported in /proc/<pid>/task/<tid>/stat
+TASK_STATES = ("R", "S", "D", "Z", "T", "I")
+
+# Bytes to read from a task stat file to get the state. This fits the PID,
+# the task name (at most 15 bytes) and the state.
+_TASK_STAT_HEAD_SIZE = 64
+
+
+class TaskStates(NamedTuple):
+    """Counts of tasks for a process."""
+
+    # total number of tasks, including those whose state can't be read
+    total: int
+    # number of tasks by state
+    states: dict[str, int]
+
+
+class _FileFields(NamedTuple):
+    """Fields to read from a process file for stats."""
+
+    filename: str
+    fields: tuple[str, ...]
+    # index of each field in stats
+    indexes: tuple[int, ...]
+
+
+class ProcfsProcess(Process):
+    """A process, along with the path of its ``/proc`` directory.
+
+    Files for the process are read from the path with :class:`ProcReader`.
+
+    """
+
+    def __init__(self, pid: int, path: str | Path):
+        super().__init__(pid, path)
+        self.path = str(path)
+
+
+def iter_pids(proc: str | Path) -> Iterator[int]:
+    """Return an iterator yielding PIDs of processes in ``/proc``."""
+    try:
+        entries = os.scandir(proc)
+    except OSError:
+        return
+    with entries:
+        for entry in entries:
+            if entry.name.isdigit():
+                yield int(entry.name)
+
+
+class ProcReader:
+    """Read and parse process files under ``/proc``.
+
+    Files are read with a single buffer which is reused across reads.
+    Instances are not thread-safe.
+
+    The reader keeps running counts of opened files and read tasks.
+
+    """
+
+    def __init__(self, buffer_size: int = 4096):
+        self._buffer = bytearray(buffer_size)
+        self.files_opened = 0
+        self.tasks_read = 0
+        # fields to read from each file, and their index, by stats
+        self._stats_files: dict[tuple[str, ...], list[_FileFields]] = {}
+
+    def read(self, path: str | Path) -> bytes | None:
+        """Return the content of a file, or None if it can't be read."""
+        try:
+            fd = os.open(path, os.O_RDONLY)
+        except OSError:
+            return None
+        self.files_opened += 1
+        try:
+            size = 0
+            while True:
+                view = memoryview(self._buffer)[size:]
+                count = os.readv(fd, [view])
+                view.release()
+                if not count:
+                    break
+                size += count
+                if size == len(self._buffer):
+                    self._buffer.extend(bytes(len(self._buffer)))
+        except OSError:
+            return None
+        finally:
+            os.close(fd)
+        with memoryview(self._buffer) as view:
+            return bytes(view[:size])
+
+    def read_stat(
+        self, path: str | Path, fields: Iterable[str]
+    ) -> dict[str, Any] | None:
+        """Return values for fields in a ``stat`` file.
+
+        The ``state`` field is returned as string, others as integers.
+
+        """
+        return self._read_fields(path, fields, _stat_values)
+
+    def read_status(
+        self, path: str | Path, keys: Iterable[str]
+    ) -> dict[str, int | None] | None:
+        """Return values for keys in a ``status`` file.
+
+        Only values expressed in kB are returned, converted to bytes.
+
+        """
+        return self._read_fields(path, keys, _status_values)
+
+    def read_sched(
+        self, path: str | Path, keys: Iterable[str]
+    ) -> dict[str, int | float | None] | None:
+        """Return values for keys in a ``sched`` file."""
+        return self._read_fields(path, keys, _sched_values)
+
+    def read_io(
+        self, path: str | Path, keys: Iterable[str]
+    ) -> dict[str, int | None] | None:
+        """Return values for keys in an ``io`` file."""
+        return self._read_fields(path, keys, _io_values)
+
+    def read_stats(self, path: str | Path, stats: Iterable[str]) -> list[Any]:
+        """Return values for stats of a process, in the same order.
+
+        Stats are in the ``<file>.<field>`` form (e.g. ``stat.utime``), and
+        each file is read only once.  Values for stats that can't be read
+        are None.
+
+        """
+        stats = tuple(stats)
+        files = self._stats_files.get(stats)
+        if files is None:
+            files = self._stats_files[stats] = _group_stats(stats)
+        result: list[Any] = [None] * len(stats)
+        for filename, fields, indexes in files:
+            content = self.read(os.path.join(path, filename))
+            if content is None:
+                continue
+            for index, value in zip(
+                indexes, _FILE_PARSERS[filename](content, fields)
+            ):
+                result[index] = value
+        return result
+
+    def read_task_states(self, path: str | Path) -> TaskStates | None:
+        """Return counts of tasks for a process, by state.
+
+        Counts are returned for all states in ``TASK_STATES``, plus any other
+        state found.  Only the beginning of each task ``stat`` file is read,
+        to get the state.
+
+        If the task directory can't be read, None is returned.
+
+        """
+        states = dict.fromkeys(TASK_STATES, 0)
+        total = 0
+        try:
+            entries = os.scandir(os.path.join(path, "task"))
+        except OSError:
+            return None
+        with entries:
+            for entry in entries:
+                total += 1
+                self.tasks_read += 1
+                state = self._read_task_state(os.path.join(entry.path, "stat"))
+                if state is not None:
+                    states[state] = states.get(state, 0) + 1
+        return TaskStates(total=total, states=states)
+
+    def count_fds(self, path: str | Path) -> int | None:
+        """Return the number of open file descriptors for a process.
+
+        Entries in the ``fd`` directory are only counted, without reading
+        links or stat'ing them.
+
+        If the directory can't be read, None is returned.
+
+        """
+        try:
+            entries = os.scandir(os.path.join(path, "fd"))
+        except OSError:
+            return None
+        self.files_opened += 1
+        with entries:
+            return sum(1 for _ in entries)
+
+    def _read_task_state(self, path: str) -> str | None:
+        try:
+            fd = os.open(path, os.O_RDONLY)
+        except OSError:
+            return None
+        self.files_opened += 1
+        try:
+            content = os.read(fd, _TASK_STAT_HEAD_SIZE)
+        except OSError:
+            return None
+        finally:
+            os.close(fd)
+        end = content.rfind(b")")
+        if end == -1:
+            fields = content.split(maxsplit=3)
+            state = fields[2] if len(fields) > 2 else b""
+        else:
+            state = content[end + 2 : end + 3]
+        return state.decode() or None
+
+    def _read_fields(
+        self,
+        path: str | Path,
+        fields: Iterable[str],
+        parse: Callable[[bytes, Sequence[str]], list[Any]],
+    ) -> dict[str, Any] | None:
+        content = self.read(path)
+        if content is None:
+            return None
+        fields = tuple(fields)
+        return dict(zip(fields, parse(content, fields)))
+
+
+def _group_stats(stats: Sequence[str]) -> list[_FileFields]:
+    """Return fields to read from each file for stats."""
+    by_file: defaultdict[str, list[tuple[str, int]]] = defaultdict(list)
+    for index, stat in enumerate(stats):
+        filename, field = stat.split(".", 1)
+        by_file[filename].append((field, index))
+    return [
+        _FileFields(
+            filename,
+            tuple(field for field, _ in fields),
+            tuple(index for _, index in fields),
+        )
+        for filename, fields in by_file.items()
+    ]
+
+
+def _stat_values(content: bytes, fields: Sequence[str]) -> list[Any]:
+    end = content.rfind(b")")
+    if end == -1:
+        values = content.split()[2:]
+    else:
+        values = content[end + 1 :].split()
+    result: list[Any] = []
+    for field in fields:
+        index = STAT_FIELDS[field]
+        if index >= len(values):
+            result.append(None)
+        elif index == 0:
+            result.append(values[0].decode())
+        else:
+            result.append(int(values[index]))
+    return result
+
+
+def _status_values(content: bytes, keys: Sequence[str]) -> list[Any]:
+    result: list[Any] = []
+    for key in keys:
+        value = _find_value(content, key.encode() + b":")
+        if value is None or not value.endswith(b" kB"):
+            result.append(None)
+        else:
+            result.append(int(value[:-3]) * 1024)
+    return result
+
+
+def _sched_values(content: bytes, keys: Sequence[str]) -> list[Any]:
+    result: list[Any] = []
+    for key in keys:
+        value = _find_value(content, key.encode(), b":")
+        if value is None:
+            result.append(None)
+        elif b"." in value:
+            result.append(float(value))
+        else:
+            result.append(int(value))
+    return result
+
+
+def _io_values(content: bytes, keys: Sequence[str]) -> list[Any]:
+    result: list[Any] = []
+    for key in keys:
+        value = _find_value(content, key.encode() + b":")
+        result.append(None if value is None else int(value))
+    return result
+
+
+def _find_value(
+    content: bytes, key: bytes, separator: bytes = b""
+) -> bytes | None:
+    """Return the value for a key at the start of a line, if found.
+
+    The key can be followed by spaces and a separator before the value.
+
+    """
+    start = 0
+    while True:
+        start = content.find(key, start)
+        if start == -1:
+            return None
+        end = content.find(b"\n", start)
+        if end == -1:
+            end = len(content)
+        if start == 0 or content[start - 1] == ord("\n"):
+            rest = content[start + len(key) : end].lstrip()
+            if not separator:
+                return rest.strip()
+            if rest.startswith(separator):
+                return rest[len(separator) :].strip()
+        start = end
+
+
+# Functions to parse values from each process file
+_FILE_PARSERS: dict[str, Callable[[bytes, Sequence[str]], list[Any]]] = {
+    "stat": _stat_values,
+    "status": _status_values,
+    "sched": _sched_values,
+    "io": _io_values,
+    # values in smaps_rollup are in kB, like in status
+    "smaps_rollup": _status_values,
+}
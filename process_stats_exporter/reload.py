@@ -0,0 +1,127 @@
+"""Reload configuration from a file while the exporter is running."""
+
+import asyncio
+from logging import Logger
+from typing import cast
+
+from prometheus_aioexporter import MetricsRegistry
+from prometheus_client import Metric
+from prometheus_client.registry import Collector
+
+from .config import (
+    Config,
+    ConfigError,
+    ConfigFile,
+)
+from .executor import MetricsUpdater
+from .metrics import ProcessMetricsHandler
+from .snapshot import SnapshotCollector
+
+
+def log_config(logger: Logger, config: Config):
+    """Log processes stats are collected for."""
+    for description in config.describe_selectors():
+        logger.info(f"tracking stats for {description}")
+
+
+class ConfigReloader:
+    """Reload configuration from a file, reconfiguring collection.
+
+    The configuration is reloaded when requested with
+    :meth:`schedule_reload` (e.g. on SIGHUP), and, if a check interval is
+    set, when the file changes.
+
+    Reconfiguring happens between collections.  If metric labels or stats
+    change, metrics are unregistered and created again, or the snapshot
+    collector is updated when collecting in snapshots.
+
+    """
+
+    def __init__(
+        self,
+        config_file: ConfigFile,
+        handler: ProcessMetricsHandler,
+        updater: MetricsUpdater,
+        registry: MetricsRegistry,
+        logger: Logger,
+        metrics: dict[str, Metric] | None = None,
+        snapshot_collector: SnapshotCollector | None = None,
+        check_interval: float = 0.0,
+    ):
+        """Create a reloader.
+
+        :param metrics: the metrics created from the handler configs, if
+            not collecting in snapshots.
+        :param check_interval: the interval for checking changes to the
+            file, 0 to only reload when requested.
+
+        """
+        self.config_file = config_file
+        self.metrics = metrics or {}
+        self._handler = handler
+        self._updater = updater
+        self._registry = registry
+        self._logger = logger
+        self._snapshot_collector = snapshot_collector
+        self._check_interval = check_interval
+        self._watch_task: asyncio.Task | None = None
+        self._reload_task: asyncio.Task | None = None
+
+    def start(self):
+        """Start watching the file for changes, if an interval is set."""
+        if self._check_interval > 0:
+            self._watch_task = asyncio.create_task(self.watch())
+
+    def stop(self):
+        """Stop watching the file and cancel a running reload."""
+        for task in (self._watch_task, self._reload_task):
+            if task:
+                task.cancel()
+
+    def schedule_reload(self):
+        """Reload the configuration, unless a reload is already running."""
+        if self._reload_task is None or self._reload_task.done():
+            self._reload_task = asyncio.create_task(self.reload())
+
+    async def watch(self):
+        """Reload the configuration when the file changes.
+
+        Reloads are scheduled as with :meth:`schedule_reload`, so that they
+        don't run along with one requested otherwise.
+
+        """
+        while True:
+            await asyncio.sleep(self._check_interval)
+            if self.config_file.changed():
+                self.schedule_reload()
+                assert self._reload_task is not None
+                await self._reload_task
+
+    async def reload(self):
+        """Load the configuration and apply it between collections.
+
+        If the configuration is not valid, an error is logged and the
+        current one is kept.
+
+        """
+        try:
+            config = self.config_file.load()
+        except ConfigError as error:
+            self._logger.error(f"not reloading config: {error}")
+            return
+        self._logger.info(f"reloading config from {self.config_file.path}")
+        log_config(self._logger, config)
+        await self._updater.reconfigure(lambda: self.apply(config))
+
+    def apply(self, config: Config):
+        """Reconfigure the handler, recreating metrics if needed."""
+        if not self._handler.reconfigure(**config.handler_options()):
+            return
+        self._logger.info("metric labels or stats changed, recreating metrics")
+        metric_configs = self._handler.get_metric_configs()
+        if self._snapshot_collector is not None:
+            self._snapshot_collector.set_metric_configs(metric_configs)
+            return
+        for metric in self.metrics.values():
+            self._registry.registry.unregister(cast(Collector, metric))
+        self.metrics = self._registry.create_metrics(metric_configs)
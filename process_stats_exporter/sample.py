@@ -0,0 +1,103 @@
+"""Metric values collected for processes."""
+
+from array import array
+from collections.abc import (
+    Iterable,
+    Mapping,
+)
+import math
+from typing import Any
+
+# Start time stored for processes it's not known for
+NO_STARTTIME = -1
+
+
+class SampleStore:
+    """Metric values collected for processes, stored by column.
+
+    Values for each metric are stored in an array of floats, with NaN for
+    empty values.  PIDs, start times and label values for processes are
+    stored in parallel, so that no object is created for each process when
+    collecting and applying values.
+
+    Collectors append values for each process directly to columns, after
+    the process is added with :meth:`add_process`.  Label values are set
+    once values for all processes are added.
+
+    """
+
+    def __init__(self, metric_names: Iterable[str]):
+        self.metric_names = list(metric_names)
+        self.pids = array("q")
+        self.starttimes = array("q")
+        # label values for each process, in the same order as label names
+        # for metrics
+        self.labels: list[tuple[str, ...]] = []
+        self.columns = {name: array("d") for name in self.metric_names}
+
+    def __len__(self) -> int:
+        return len(self.pids)
+
+    def add_process(self, pid: int, starttime: int | None = None):
+        """Add a process, whose values are then appended to columns."""
+        self.pids.append(pid)
+        self.starttimes.append(
+            NO_STARTTIME if starttime is None else starttime
+        )
+
+    def set_starttime(self, starttime: int | None):
+        """Set the start time for the last added process."""
+        self.starttimes[-1] = NO_STARTTIME if starttime is None else starttime
+
+    def append(
+        self,
+        pid: int,
+        values: Mapping[str, Any],
+        starttime: int | None = None,
+    ):
+        """Add a process with values for metrics."""
+        self.add_process(pid, starttime)
+        for name, column in self.columns.items():
+            column.append(column_value(values[name]))
+
+    def extend(self, store: "SampleStore"):
+        """Add processes and values from another store.
+
+        Label values are not copied, since they're set once all values are
+        added.
+
+        """
+        self.pids.extend(store.pids)
+        self.starttimes.extend(store.starttimes)
+        for name, column in self.columns.items():
+            column.extend(store.columns[name])
+
+    def starttime(self, index: int) -> int | None:
+        """Return the start time of a process, if known."""
+        starttime = self.starttimes[index]
+        return None if starttime == NO_STARTTIME else starttime
+
+    def is_empty(self, index: int) -> bool:
+        """Whether all values for a process are empty."""
+        return all(
+            math.isnan(column[index]) for column in self.columns.values()
+        )
+
+    def replace_columns(self, columns: Mapping[str, array]) -> "SampleStore":
+        """Return a store with some columns replaced.
+
+        Other columns, PIDs, start times and labels are shared with this one.
+
+        """
+        store = SampleStore(())
+        store.metric_names = self.metric_names
+        store.pids = self.pids
+        store.starttimes = self.starttimes
+        store.labels = self.labels
+        store.columns = {**self.columns, **columns}
+        return store
+
+
+def column_value(value: Any) -> float:
+    """Return a value to store in a column, with NaN for empty values."""
+    return math.nan if value is None else value
@@ -0,0 +1,144 @@
+"""Read process stats in a pool of worker processes.
+
+Processes are split in shards, which are read and parsed by workers in
+parallel.  Workers return values in a :class:`SampleStore`, whose columns
+are arrays that are cheap to transfer back compared to dicts.
+
+"""
+
+from collections.abc import (
+    Collection,
+    Sequence,
+)
+from concurrent.futures import ProcessPoolExecutor
+import math
+from typing import NamedTuple
+
+from .procfs import (
+    ProcfsProcess,
+    ProcReader,
+)
+from .sample import SampleStore
+from .stats import (
+    create_collectors,
+    StatsCollector,
+)
+
+# Number of shards for each worker, so that work is balanced when processes
+# take different time to read
+SHARDS_PER_WORKER = 4
+
+
+class ShardResult(NamedTuple):
+    """Values read for a shard of processes."""
+
+    # start time and metric values for processes, without labels
+    samples: SampleStore
+    files_opened: int
+    tasks_read: int
+
+
+class ShardedStatsReader:
+    """Read stats for processes in a pool of worker processes.
+
+    The pool is created at the first read.  Like :class:`ProcReader`, the
+    reader keeps running counts of opened files and read tasks.
+
+    """
+
+    def __init__(self, workers: int):
+        self.workers = workers
+        self.files_opened = 0
+        self.tasks_read = 0
+        self._executor: ProcessPoolExecutor | None = None
+
+    def read(
+        self,
+        stat_groups: Collection[str],
+        processes: Sequence[ProcfsProcess],
+        store: SampleStore,
+    ):
+        """Add start time and metric values for processes to the store.
+
+        Processes are added in the same order, and metric columns in the
+        store must be the ones from collectors for stat groups.
+
+        """
+        if not processes:
+            return
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(max_workers=self.workers)
+        stat_groups = tuple(stat_groups)
+        targets = [(process.pid, process.path) for process in processes]
+        shard_size = math.ceil(
+            len(targets) / (self.workers * SHARDS_PER_WORKER)
+        )
+        shards = [
+            targets[idx : idx + shard_size]
+            for idx in range(0, len(targets), shard_size)
+        ]
+        results = self._executor.map(
+            read_shard,
+            [stat_groups] * len(shards),
+            shards,
+        )
+        for result in results:
+            self.files_opened += result.files_opened
+            self.tasks_read += result.tasks_read
+            store.extend(result.samples)
+
+    def shutdown(self):
+        """Shutdown the worker pool, if created."""
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+
+def read_shard(
+    stat_groups: tuple[str, ...],
+    targets: list[tuple[int, str]],
+) -> ShardResult:
+    """Read stats for a shard of processes, given their PID and directory.
+
+    This is run in worker processes.
+
+    """
+    reader, collectors = _get_worker_collectors(stat_groups)
+    files_opened = reader.files_opened
+    tasks_read = reader.tasks_read
+    store = SampleStore(_metric_names(collectors))
+    for pid, path in targets:
+        process = ProcfsProcess(pid, path)
+        store.add_process(pid)
+        for collector in collectors:
+            collector.collect(process, store)
+    return ShardResult(
+        samples=store,
+        files_opened=reader.files_opened - files_opened,
+        tasks_read=reader.tasks_read - tasks_read,
+    )
+
+
+def _metric_names(collectors: list[StatsCollector]) -> list[str]:
+    return [
+        config.name
+        for collector in collectors
+        for config in collector.metrics()
+    ]
+
+
+# Reader and collectors in worker processes, by stat groups
+_worker_collectors: dict[
+    tuple[str, ...], tuple[ProcReader, list[StatsCollector]]
+] = {}
+
+
+def _get_worker_collectors(
+    stat_groups: tuple[str, ...],
+) -> tuple[ProcReader, list[StatsCollector]]:
+    entry = _worker_collectors.get(stat_groups)
+    if entry is None:
+        reader = ProcReader()
+        entry = (reader, create_collectors(stat_groups, reader=reader))
+        _worker_collectors[stat_groups] = entry
+    return entry
@@ -0,0 +1,164 @@
+"""Serve metrics from a snapshot of collected samples."""
+
+from collections.abc import (
+    Callable,
+    Iterable,
+    Iterator,
+)
+import math
+import time
+from typing import NamedTuple
+
+from prometheus_aioexporter import MetricConfig
+from prometheus_client import Metric
+from prometheus_client.core import (
+    CounterMetricFamily,
+    GaugeMetricFamily,
+)
+from prometheus_client.registry import Collector
+
+from .exposition import Series
+from .sample import SampleStore
+
+# Metric families for each metric type
+FAMILY_TYPES: dict[
+    str, type[CounterMetricFamily] | type[GaugeMetricFamily]
+] = {
+    "counter": CounterMetricFamily,
+    "gauge": GaugeMetricFamily,
+}
+
+SNAPSHOT_AGE_METRIC = "process_stats_exporter_snapshot_age_seconds"
+
+
+class Snapshot(NamedTuple):
+    """Immutable metric series collected at a point in time."""
+
+    series: tuple[Series, ...]
+    timestamp: float
+
+    @property
+    def families(self) -> tuple[Metric, ...]:
+        """Metric families for series."""
+        return tuple(series_family(series) for series in self.series)
+
+
+def build_series(
+    metric_configs: Iterable[MetricConfig], samples: SampleStore
+) -> tuple[Series, ...]:
+    """Return metric series with values from samples.
+
+    Label values in samples must be in the same order as label names in
+    metric configs.  Empty values for a metric are skipped.
+
+    As when updating metrics, values for samples with the same labels are
+    summed for counters, and the last one is used for gauges.
+
+    """
+    result = []
+    for config in metric_configs:
+        is_counter = config.type == "counter"
+        values: dict[tuple[str, ...], float] = {}
+        for labels, value in zip(samples.labels, samples.columns[config.name]):
+            if math.isnan(value):
+                continue
+            if is_counter and labels in values:
+                value += values[labels]
+            values[labels] = value
+        result.append(
+            Series(
+                config.name,
+                config.description,
+                config.type,
+                config.config["labels"],
+                [(labels, value, None) for labels, value in values.items()],
+            )
+        )
+    return tuple(result)
+
+
+def build_families(
+    metric_configs: Iterable[MetricConfig], samples: SampleStore
+) -> tuple[Metric, ...]:
+    """Return metric families with values from samples.
+
+    Values are the same as for :func:`build_series`.
+
+    """
+    return tuple(
+        series_family(series)
+        for series in build_series(metric_configs, samples)
+    )
+
+
+def series_family(series: Series) -> Metric:
+    """Return a metric family with values from a series."""
+    family = FAMILY_TYPES[series.type](
+        series.name, series.documentation, labels=series.label_names
+    )
+    for label_values, value, _ in series.values:
+        family.add_metric(label_values, value)
+    return family
+
+
+class SnapshotCollector(Collector):
+    """A Prometheus collector serving metrics from the latest snapshot.
+
+    Along with process metrics, a gauge reports the age of the snapshot.
+
+    """
+
+    def __init__(
+        self,
+        metric_configs: Iterable[MetricConfig],
+        clock: Callable[[], float] = time.time,
+    ):
+        self._metric_configs = list(metric_configs)
+        self._clock = clock
+        self._snapshot: Snapshot | None = None
+
+    @property
+    def snapshot(self) -> Snapshot | None:
+        """The latest snapshot, if any."""
+        return self._snapshot
+
+    def set_metric_configs(self, metric_configs: Iterable[MetricConfig]):
+        """Set configs for metrics, used from the next update."""
+        self._metric_configs = list(metric_configs)
+
+    def update(self, samples: SampleStore):
+        """Replace the snapshot with one built from samples."""
+        self._snapshot = Snapshot(
+            series=build_series(self._metric_configs, samples),
+            timestamp=self._clock(),
+        )
+
+    def describe(self) -> Iterator[Metric]:
+        configs = self._metric_configs
+        yield from build_families(
+            configs, SampleStore(config.name for config in configs)
+        )
+        yield series_family(self._age_series())
+
+    def collect(self) -> Iterator[Metric]:
+        for series in self.series():
+            yield series_family(series)
+
+    def series(self) -> list[Series]:
+        """Return series for the latest snapshot, including its age."""
+        snapshot = self._snapshot
+        if snapshot is None:
+            return []
+        return [
+            *snapshot.series,
+            self._age_series(self._clock() - snapshot.timestamp),
+        ]
+
+    def _age_series(self, age: float | None = None) -> Series:
+        return Series(
+            SNAPSHOT_AGE_METRIC,
+            "Age of the collected process metrics, in seconds",
+            "gauge",
+            (),
+            [] if age is None else [((), age, None)],
+        )
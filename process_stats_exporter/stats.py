@@ -1,19 +1,24 @@
 """Collect metrics for processes and tasks"""
 
-from collections import defaultdict
 from collections.abc import (
-    Mapping,
+    Collection,
     Sequence,
 )
-from typing import (
-    Any,
-    DefaultDict,
-    NamedTuple,
-)
+from itertools import chain
+import math
+from typing import NamedTuple
 
-from lxstats.process import Process
 from prometheus_aioexporter import MetricConfig
 
+from .procfs import (
+    ProcfsProcess,
+    ProcReader,
+)
+from .sample import (
+    column_value,
+    SampleStore,
+)
+
 
 class ProcessStat(NamedTuple):
     """Definition for a process statistic."""
@@ -22,6 +27,13 @@ class ProcessStat(NamedTuple):
     type: str
     description: str
     stat: str
+    # stat group, if different from the file the stat is read from
+    group: str | None = None
+
+    @property
+    def stat_group(self) -> str:
+        """The group for the stat."""
+        return self.group or self.stat.split(".", 1)[0]
 
 
 class ProcessTasksStat(NamedTuple):
@@ -33,22 +45,52 @@ class ProcessTasksStat(NamedTuple):
 
 
 class StatsCollector:
-    """Describe and collect metrics."""
+    """Describe and collect metrics.
 
-    def __init__(self, labels: Sequence[str] = ()):
+    Metrics are split in groups, based on the files they're read from, and
+    only groups that are enabled are collected.
+
+    """
+
+    # names of stat groups provided by the collector
+    groups: tuple[str, ...] = ()
+
+    def __init__(
+        self,
+        labels: Sequence[str] = (),
+        reader: ProcReader | None = None,
+        groups: Collection[str] | None = None,
+    ):
         self.labels = list(labels)
+        self._reader = reader or ProcReader()
+        self.enabled_groups = (
+            set(self.groups)
+            if groups is None
+            else set(groups) & set(self.groups)
+        )
 
     def metrics(self) -> list[MetricConfig]:
         """Return a list of MetricConfigs."""
         raise NotImplementedError("Subclasses must implement metrics()")
 
-    def collect(self, process: Process) -> Mapping[str, Any]:
-        """Return a dict mapping metric names to values for the process."""
+    def collect(self, process: ProcfsProcess, store: SampleStore):
+        """Append values for the process to metric columns in the store."""
         raise NotImplementedError("Subclasses must implement collect()")
 
 
 class ProcessStatsCollector(StatsCollector):
-    """Collect metrics for a process."""
+    """Collect metrics for a process.
+
+    Stat groups are the names of files stats are read from, except for
+    additional stats from the ``stat`` file, which have their own group.
+
+    The start time of the process is read along with stats and set in the
+    store, to tell apart processes with the same PID when computing changes
+    of counters.
+
+    """
+
+    groups = ("stat", "status", "sched", "threads", "cpu", "io")
 
     _STATS = (
         ProcessStat(
@@ -99,8 +141,50 @@ class ProcessStatsCollector(StatsCollector):
             "Number of voluntary context switches",
             "sched.nr_voluntary_switches",
         ),
+        ProcessStat(
+            "proc_threads",
+            "gauge",
+            "Number of threads",
+            "stat.num_threads",
+            group="threads",
+        ),
+        ProcessStat(
+            "proc_cpu",
+            "gauge",
+            "CPU number the process last ran on",
+            "stat.processor",
+            group="cpu",
+        ),
+        ProcessStat(
+            "proc_io_read_bytes",
+            "counter",
+            "Number of bytes read from storage",
+            "io.read_bytes",
+        ),
+        ProcessStat(
+            "proc_io_write_bytes",
+            "counter",
+            "Number of bytes written to storage",
+            "io.write_bytes",
+        ),
     )
 
+    def __init__(
+        self,
+        labels: Sequence[str] = (),
+        reader: ProcReader | None = None,
+        groups: Collection[str] | None = None,
+    ):
+        super().__init__(labels=labels, reader=reader, groups=groups)
+        self._stats = [
+            stat
+            for stat in self._STATS
+            if stat.stat_group in self.enabled_groups
+        ]
+        self._stat_names = tuple(
+            chain((stat.stat for stat in self._stats), ("stat.starttime",))
+        )
+
     def metrics(self) -> list[MetricConfig]:
         return [
             MetricConfig(
@@ -109,17 +193,22 @@ class ProcessStatsCollector(StatsCollector):
                 stat.type,
                 {"labels": self.labels},
             )
-            for stat in self._STATS
+            for stat in self._stats
         ]
 
-    def collect(self, process: Process) -> Mapping[str, Any]:
-        process.collect_stats()
-        return {stat.metric: process.get(stat.stat) for stat in self._STATS}
+    def collect(self, process: ProcfsProcess, store: SampleStore):
+        values = self._reader.read_stats(process.path, self._stat_names)
+        columns = store.columns
+        for stat, value in zip(self._stats, values):
+            columns[stat.metric].append(column_value(value))
+        store.set_starttime(values[-1])
 
 
 class ProcessTasksStatsCollector(StatsCollector):
     """Collect metrics for a process' tasks."""
 
+    groups = ("tasks",)
+
     _STATS = (
         ProcessTasksStat(
             "proc_tasks_count", "gauge", "Number of process tasks"
@@ -152,16 +241,109 @@ class ProcessTasksStatsCollector(StatsCollector):
             for stat in self._STATS
         ]
 
-    def collect(self, process: Process) -> Mapping[str, int]:
-        tasks = process.tasks()
-        state_counts: DefaultDict[str, int] = defaultdict(int)
-        for task in tasks:
-            task.collect_stats()
-            state_id: str = task.get("stat.state")
-            state_counts[state_id] += 1
-        return {
-            "proc_tasks_count": len(tasks),
-            "proc_tasks_state_running": state_counts["R"],
-            "proc_tasks_state_sleeping": state_counts["S"],
-            "proc_tasks_state_uninterruptible_sleep": state_counts["D"],
-        }
+    def collect(self, process: ProcfsProcess, store: SampleStore):
+        tasks = self._reader.read_task_states(process.path)
+        columns = store.columns
+        if tasks is None:
+            for stat in self._STATS:
+                columns[stat.metric].append(math.nan)
+            return
+        columns["proc_tasks_count"].append(tasks.total)
+        columns["proc_tasks_state_running"].append(tasks.states["R"])
+        columns["proc_tasks_state_sleeping"].append(tasks.states["S"])
+        columns["proc_tasks_state_uninterruptible_sleep"].append(
+            tasks.states["D"]
+        )
+
+
+class ProcessFdStatsCollector(StatsCollector):
+    """Collect metrics for a process' file descriptors."""
+
+    groups = ("fd",)
+
+    def metrics(self) -> list[MetricConfig]:
+        return [
+            MetricConfig(
+                "proc_fd_count",
+                "Number of open file descriptors",
+                "gauge",
+                {"labels": self.labels},
+            )
+        ]
+
+    def collect(self, process: ProcfsProcess, store: SampleStore):
+        store.columns["proc_fd_count"].append(
+            column_value(self._reader.count_fds(process.path))
+        )
+
+
+class ProcessMemoryMapsStatsCollector(StatsCollector):
+    """Collect metrics for a process' memory mappings.
+
+    Values are read from ``smaps_rollup``, which sums values from all
+    mappings in the kernel.
+
+    """
+
+    groups = ("smaps",)
+
+    _STATS = (
+        "smaps_rollup.Pss",
+        "smaps_rollup.Private_Clean",
+        "smaps_rollup.Private_Dirty",
+    )
+
+    def metrics(self) -> list[MetricConfig]:
+        return [
+            MetricConfig(
+                "proc_mem_pss",
+                "Memory proportional set size (PSS)",
+                "gauge",
+                {"labels": self.labels},
+            ),
+            MetricConfig(
+                "proc_mem_uss",
+                "Memory unique set size (USS)",
+                "gauge",
+                {"labels": self.labels},
+            ),
+        ]
+
+    def collect(self, process: ProcfsProcess, store: SampleStore):
+        pss, clean, dirty = self._reader.read_stats(process.path, self._STATS)
+        columns = store.columns
+        columns["proc_mem_pss"].append(column_value(pss))
+        columns["proc_mem_uss"].append(
+            math.nan if clean is None or dirty is None else clean + dirty
+        )
+
+
+COLLECTORS: tuple[type[StatsCollector], ...] = (
+    ProcessStatsCollector,
+    ProcessTasksStatsCollector,
+    ProcessFdStatsCollector,
+    ProcessMemoryMapsStatsCollector,
+)
+
+# names of all stat groups, and of those collected by default
+STAT_GROUPS = tuple(chain(*(collector.groups for collector in COLLECTORS)))
+DEFAULT_STAT_GROUPS = ("stat", "status", "sched", "tasks")
+
+
+def create_collectors(
+    groups: Collection[str] = DEFAULT_STAT_GROUPS,
+    labels: Sequence[str] = (),
+    reader: ProcReader | None = None,
+) -> list[StatsCollector]:
+    """Return collectors for the specified stat groups.
+
+    Collectors that don't provide any of the groups are not created, so
+    their files are never read.
+
+    """
+    groups = set(groups)
+    return [
+        collector(labels=labels, reader=reader, groups=groups)
+        for collector in COLLECTORS
+        if groups.intersection(collector.groups)
+    ]
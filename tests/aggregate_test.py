@@ -0,0 +1,94 @@
+from array import array
+import math
+
+from prometheus_aioexporter import MetricConfig
+import pytest
+
+from process_stats_exporter.aggregate import (
+    Aggregator,
+    PROCESS_COUNT_METRIC,
+)
+
+METRIC_CONFIGS = [
+    MetricConfig("proc_time", "Time", "counter", {"labels": ["cmd"]}),
+    MetricConfig("proc_mem", "Memory", "gauge", {"labels": ["cmd"]}),
+]
+METRIC_NAMES = ["proc_time", "proc_mem"]
+
+
+@pytest.fixture
+def samples(make_store):
+    yield make_store(
+        METRIC_NAMES,
+        [
+            (10, ("foo",), {"proc_time": 3, "proc_mem": 100}, 1),
+            (20, ("bar",), {"proc_time": 5, "proc_mem": 200}, 2),
+            (30, ("foo",), {"proc_time": 4, "proc_mem": 300}, 3),
+        ],
+    )
+
+
+class TestAggregator:
+    def test_metric_configs(self):
+        """A metric is added for the number of processes."""
+        [config] = Aggregator(METRIC_CONFIGS).metric_configs()
+        assert config.name == PROCESS_COUNT_METRIC
+        assert config.type == "gauge"
+        assert config.config == {"labels": ["cmd"]}
+
+    def test_metric_configs_no_metrics(self):
+        """The process count metric has no labels if there's no metric."""
+        [config] = Aggregator([]).metric_configs()
+        assert config.config == {"labels": []}
+
+    def test_aggregate_sum(self, samples):
+        """Values are summed for samples with the same labels."""
+        store = Aggregator(METRIC_CONFIGS).aggregate(samples)
+        assert store.labels == [("foo",), ("bar",)]
+        assert store.pids == array("q", [10, 20])
+        assert store.starttimes == array("q", [1, 2])
+        assert store.columns == {
+            "proc_time": array("d", [7, 5]),
+            "proc_mem": array("d", [400, 200]),
+            PROCESS_COUNT_METRIC: array("d", [2, 1]),
+        }
+
+    def test_aggregate_max(self, samples):
+        """With max, counters are summed and the maximum gauge is used."""
+        store = Aggregator(METRIC_CONFIGS, function="max").aggregate(samples)
+        assert store.columns == {
+            "proc_time": array("d", [7, 5]),
+            "proc_mem": array("d", [300, 200]),
+            PROCESS_COUNT_METRIC: array("d", [2, 1]),
+        }
+
+    def test_aggregate_empty_values(self, make_store):
+        """Empty values are skipped."""
+        store = Aggregator(METRIC_CONFIGS).aggregate(
+            make_store(
+                METRIC_NAMES,
+                [
+                    (10, ("foo",), {"proc_time": None, "proc_mem": 1}),
+                    (20, ("foo",), {"proc_time": 3, "proc_mem": None}),
+                    (30, ("foo",), {"proc_time": 4, "proc_mem": 2}),
+                ],
+            )
+        )
+        assert store.columns == {
+            "proc_time": array("d", [7]),
+            "proc_mem": array("d", [3]),
+            PROCESS_COUNT_METRIC: array("d", [3]),
+        }
+
+    def test_aggregate_all_empty_values(self, make_store):
+        """Values empty for all processes in a group are empty."""
+        store = Aggregator(METRIC_CONFIGS).aggregate(
+            make_store(
+                METRIC_NAMES,
+                [
+                    (10, ("foo",), {"proc_time": None, "proc_mem": 1}),
+                    (20, ("foo",), {"proc_time": None, "proc_mem": 2}),
+                ],
+            )
+        )
+        assert math.isnan(store.columns["proc_time"][0])
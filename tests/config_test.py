@@ -0,0 +1,324 @@
+import os
+import re
+import sys
+from textwrap import dedent
+
+import pytest
+
+from process_stats_exporter.config import (
+    Config,
+    ConfigError,
+    ConfigFile,
+    load_config,
+    parse_config,
+)
+from process_stats_exporter.stats import DEFAULT_STAT_GROUPS
+
+
+@pytest.fixture
+def config_path(tmp_path):
+    path = tmp_path / "config.toml"
+    path.write_text("pids = [10]")
+    yield path
+
+
+class TestConfig:
+    def test_defaults(self):
+        """By default, no process is selected."""
+        config = Config()
+        assert not config.has_selectors
+        assert config.stat_groups == DEFAULT_STAT_GROUPS
+
+    @pytest.mark.parametrize(
+        "field,value",
+        [
+            ("pids", (10,)),
+            ("cmdline_regexps", (re.compile("foo"),)),
+            ("cgroups", ("system.slice",)),
+            ("pidfiles", ("/run/foo.pid",)),
+            ("units", ("foo",)),
+        ],
+    )
+    def test_has_selectors(self, field, value):
+        """Processes are selected if any selector is set."""
+        assert Config(**{field: value}).has_selectors
+
+    def test_describe_selectors(self):
+        """PIDs, pidfiles and units are described together."""
+        config = Config(
+            pids=(10, 20),
+            pidfiles=("/run/foo.pid",),
+            units=("foo", "bar"),
+            cgroups=("system.slice",),
+            cmdline_regexps=(re.compile("foo"),),
+        )
+        assert config.describe_selectors() == [
+            "PIDs [10, 20]",
+            "pidfiles [/run/foo.pid]",
+            "systemd units [foo, bar]",
+        ]
+
+    def test_describe_selectors_cgroups(self):
+        """Cgroups take precedence over regexps."""
+        config = Config(
+            cgroups=("system.slice", "user.slice"),
+            cmdline_regexps=(re.compile("foo"),),
+        )
+        assert config.describe_selectors() == [
+            "processes in cgroups [system.slice, user.slice]"
+        ]
+
+    def test_describe_selectors_regexps(self):
+        """Regexps are described if no other selector is set."""
+        config = Config(cmdline_regexps=(re.compile("foo"), re.compile("ba")))
+        assert config.describe_selectors() == [
+            "processes matching regexps [foo, ba]"
+        ]
+
+    def test_describe_selectors_none(self):
+        """Nothing is described if no selector is set."""
+        assert Config().describe_selectors() == []
+
+    def test_handler_options(self):
+        """Options for the metrics handler are returned."""
+        regexp = re.compile("foo")
+        config = Config(
+            pids=(10,),
+            cmdline_regexps=(regexp,),
+            units=("foo",),
+            labels={"env": "prod"},
+            stat_groups=("stat",),
+        )
+        assert config.handler_options() == {
+            "pids": [10],
+            "cmdline_regexps": [regexp],
+            "cgroups": [],
+            "pidfiles": [],
+            "units": ["foo"],
+            "descendants": False,
+            "labels": {"env": "prod"},
+            "stat_groups": ("stat",),
+        }
+
+
+class TestParseConfig:
+    def test_parse(self):
+        """Options are parsed into a config."""
+        config = parse_config(
+            {
+                "pids": [10, 20],
+                "cmdline-regexps": ["foo", "(?P<exe>bar)"],
+                "cgroups": ["system.slice/*"],
+                "pidfiles": ["/run/foo.pid"],
+                "systemd-units": ["foo"],
+                "include-descendants": True,
+                "labels": {"env": "prod"},
+                "stats": ["stat", "fd"],
+            }
+        )
+        assert config.pids == (10, 20)
+        assert [regexp.pattern for regexp in config.cmdline_regexps] == [
+            "foo",
+            "(?P<exe>bar)",
+        ]
+        assert config.cgroups == ("system.slice/*",)
+        assert config.pidfiles == ("/run/foo.pid",)
+        assert config.units == ("foo",)
+        assert config.descendants
+        assert config.labels == {"env": "prod"}
+        assert config.stat_groups == ("stat", "fd")
+
+    def test_not_mapping(self):
+        """The config must be a mapping."""
+        with pytest.raises(ConfigError) as error:
+            parse_config(["pids"])
+        assert str(error.value) == "config must be a mapping"
+
+    def test_unknown_options(self):
+        """Unknown options are reported."""
+        with pytest.raises(ConfigError) as error:
+            parse_config({"pids": [10], "foo": 1, "bar": 2})
+        assert str(error.value) == "unknown config options: bar, foo"
+
+    def test_no_selectors(self):
+        """Processes must be selected."""
+        with pytest.raises(ConfigError) as error:
+            parse_config({"labels": {"env": "prod"}})
+        assert str(error.value) == "no PID, cgroup or process names specified"
+
+    @pytest.mark.parametrize(
+        "options,message",
+        [
+            (
+                {"pids": "10"},
+                'invalid value for "pids": must be a list of int',
+            ),
+            (
+                {"pids": [True]},
+                'invalid value for "pids": must be a list of int',
+            ),
+            (
+                {"cgroups": ["a", 1]},
+                'invalid value for "cgroups": must be a list of str',
+            ),
+            (
+                {"cmdline-regexps": ["(?P<Foo>foo)"]},
+                'invalid value for "cmdline-regexps": '
+                "regexp group not valid as label: Foo",
+            ),
+            (
+                {"pids": [10], "include-descendants": "yes"},
+                'invalid value for "include-descendants": must be a boolean',
+            ),
+            (
+                {"pids": [10], "labels": ["env"]},
+                'invalid value for "labels": '
+                "must be a mapping of names to strings",
+            ),
+            (
+                {"pids": [10], "labels": {"env": 1}},
+                'invalid value for "labels": '
+                "must be a mapping of names to strings",
+            ),
+            (
+                {"pids": [10], "labels": {"a b": "c"}},
+                'invalid value for "labels": invalid label: a b',
+            ),
+            (
+                {"pids": [10], "stats": []},
+                'invalid value for "stats": no stat group specified',
+            ),
+            (
+                {"pids": [10], "stats": ["stat", "foo", "bar"]},
+                'invalid value for "stats": unknown stat groups: bar, foo',
+            ),
+        ],
+    )
+    def test_invalid(self, options, message):
+        """Invalid values are reported."""
+        with pytest.raises(ConfigError) as error:
+            parse_config(options)
+        assert str(error.value) == message
+
+
+class TestLoadConfig:
+    def test_toml(self, tmp_path):
+        """Config can be loaded from TOML files."""
+        path = tmp_path / "config.toml"
+        path.write_text(
+            dedent(
+                """\
+                cmdline-regexps = ["foo"]
+                [labels]
+                env = "prod"
+                """
+            )
+        )
+        config = load_config(path)
+        assert [regexp.pattern for regexp in config.cmdline_regexps] == ["foo"]
+        assert config.labels == {"env": "prod"}
+
+    @pytest.mark.parametrize("suffix", [".yaml", ".yml"])
+    def test_yaml(self, tmp_path, suffix):
+        """Config can be loaded from YAML files."""
+        pytest.importorskip("yaml")
+        path = tmp_path / f"config{suffix}"
+        path.write_text(
+            dedent(
+                """\
+                pids: [10]
+                labels:
+                  env: prod
+                """
+            )
+        )
+        config = load_config(path)
+        assert config.pids == (10,)
+        assert config.labels == {"env": "prod"}
+
+    def test_yaml_not_available(self, tmp_path, monkeypatch):
+        """An error is raised if YAML support is not available."""
+        monkeypatch.setitem(sys.modules, "yaml", None)
+        path = tmp_path / "config.yaml"
+        path.write_text("pids: [10]")
+        with pytest.raises(ConfigError) as error:
+            load_config(path)
+        assert str(error.value) == "PyYAML is required for YAML config files"
+
+    def test_invalid_toml(self, tmp_path):
+        """An error is raised for invalid TOML files."""
+        path = tmp_path / "config.toml"
+        path.write_text("pids = [")
+        with pytest.raises(ConfigError) as error:
+            load_config(path)
+        assert str(error.value).startswith("invalid TOML config: ")
+
+    def test_invalid_yaml(self, tmp_path):
+        """An error is raised for invalid YAML files."""
+        pytest.importorskip("yaml")
+        path = tmp_path / "config.yaml"
+        path.write_text("pids: [")
+        with pytest.raises(ConfigError) as error:
+            load_config(path)
+        assert str(error.value).startswith("invalid YAML config: ")
+
+    def test_unsupported_format(self, tmp_path):
+        """An error is raised for unsupported formats."""
+        path = tmp_path / "config.ini"
+        path.write_text("")
+        with pytest.raises(ConfigError) as error:
+            load_config(path)
+        assert str(error.value) == "unsupported config file format: config.ini"
+
+    def test_not_existing(self, tmp_path):
+        """An error is raised if the file can't be read."""
+        with pytest.raises(ConfigError) as error:
+            load_config(tmp_path / "config.toml")
+        assert str(error.value).startswith("can't read config file: ")
+
+
+class TestConfigFile:
+    def test_load(self, config_path):
+        """The config is loaded from the file."""
+        config_file = ConfigFile(config_path)
+        assert config_file.load().pids == (10,)
+
+    def test_changed(self, config_path):
+        """The file is changed until it's loaded."""
+        config_file = ConfigFile(config_path)
+        assert config_file.changed()
+        config_file.load()
+        assert not config_file.changed()
+
+    def test_changed_modified(self, config_path):
+        """The file is changed if it's modified after loading."""
+        config_file = ConfigFile(config_path)
+        config_file.load()
+        config_path.write_text("pids = [10, 20]")
+        assert config_file.changed()
+
+    def test_changed_replaced(self, config_path, tmp_path):
+        """The file is changed if it's replaced after loading."""
+        config_file = ConfigFile(config_path)
+        config_file.load()
+        new_path = tmp_path / "new.toml"
+        new_path.write_text("pids = [20]")
+        stat = config_path.stat()
+        os.utime(new_path, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+        new_path.rename(config_path)
+        assert config_file.changed()
+
+    def test_changed_removed(self, config_path):
+        """The file is changed if it's removed after loading."""
+        config_file = ConfigFile(config_path)
+        config_file.load()
+        config_path.unlink()
+        assert config_file.changed()
+
+    def test_invalid_not_changed(self, config_path):
+        """An invalid file is not changed after failing to load it."""
+        config_path.write_text("foo = 1")
+        config_file = ConfigFile(config_path)
+        with pytest.raises(ConfigError):
+            config_file.load()
+        assert not config_file.changed()
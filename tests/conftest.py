@@ -2,6 +2,8 @@ from pathlib import Path
 
 import pytest
 
+from process_stats_exporter.sample import SampleStore
+
 
 @pytest.fixture
 def proc_dir(tmpdir):
@@ -21,3 +23,22 @@ def make_process_dir(proc_dir):
         return pid_dir
 
     yield create
+
+
+@pytest.fixture
+def make_store():
+    """Return a function to create a SampleStore with values for processes.
+
+    Each process is a tuple with PID, label values, a dict with values for
+    metrics, and optionally the start time.
+
+    """
+
+    def create(metric_names, processes=()):
+        store = SampleStore(metric_names)
+        for pid, labels, values, *starttime in processes:
+            store.append(pid, values, *starttime)
+            store.labels.append(labels)
+        return store
+
+    yield create
@@ -0,0 +1,185 @@
+import errno
+import os
+import struct
+
+import pytest
+
+from process_stats_exporter.discovery import (
+    CN_IDX_PROC,
+    parse_events,
+    PROC_CN_MCAST_LISTEN,
+    PROC_EVENT_EXEC,
+    PROC_EVENT_EXIT,
+    PROC_EVENT_FORK,
+    ProcConnectorDiscovery,
+    ProcessChanges,
+    subscribe_message,
+)
+
+
+def event_message(event, *values):
+    """Return a proc connector message for an event."""
+    data = struct.pack("=IIQ", event, 0, 0) + struct.pack(
+        f"={len(values)}I", *values
+    )
+    cn_msg = struct.pack("=IIIIHH", CN_IDX_PROC, 1, 0, 0, len(data), 0)
+    length = 16 + len(cn_msg) + len(data)
+    return struct.pack("=IHHII", length, 3, 0, 0, 0) + cn_msg + data
+
+
+class FakeSocket:
+    def __init__(self, messages):
+        self.messages = list(messages)
+        self.closed = False
+
+    def setblocking(self, flag):
+        pass
+
+    def recv(self, size):
+        if not self.messages:
+            raise BlockingIOError()
+        message = self.messages.pop(0)
+        if isinstance(message, Exception):
+            raise message
+        return message
+
+    def bind(self, address):
+        raise PermissionError(errno.EPERM, "Operation not permitted")
+
+    def close(self):
+        self.closed = True
+
+
+class TestParseEvents:
+    def test_fork(self):
+        """For forks, the child PID is returned."""
+        data = event_message(PROC_EVENT_FORK, 1, 1, 10, 10)
+        assert list(parse_events(data)) == [(PROC_EVENT_FORK, 10)]
+
+    def test_exec_exit(self):
+        """Exec and exit events are returned."""
+        data = event_message(PROC_EVENT_EXEC, 10, 10) + event_message(
+            PROC_EVENT_EXIT, 10, 10, 0, 0
+        )
+        assert list(parse_events(data)) == [
+            (PROC_EVENT_EXEC, 10),
+            (PROC_EVENT_EXIT, 10),
+        ]
+
+    def test_threads_skipped(self):
+        """Events for threads are skipped."""
+        data = event_message(PROC_EVENT_FORK, 1, 1, 11, 10)
+        assert list(parse_events(data)) == []
+
+    def test_other_events_skipped(self):
+        """Other events are skipped."""
+        data = event_message(0x40, 10, 10, 0, 0)
+        assert list(parse_events(data)) == []
+
+    def test_truncated(self):
+        """Truncated messages are skipped."""
+        data = event_message(PROC_EVENT_EXEC, 10, 10)
+        assert list(parse_events(data[:-4])) == []
+
+    def test_truncated_header(self):
+        """Messages truncated in the event header are skipped."""
+        data = event_message(PROC_EVENT_EXEC, 10, 10)
+        assert list(parse_events(data[:40])) == []
+
+    def test_invalid_length(self):
+        """Parsing stops at messages with an invalid length."""
+        data = struct.pack("=IHHII", 0, 3, 0, 0, 0) + event_message(
+            PROC_EVENT_EXEC, 10, 10
+        )
+        assert list(parse_events(data)) == []
+
+
+class TestSubscribeMessage:
+    def test_message(self):
+        """The message subscribes to proc connector events."""
+        message = subscribe_message()
+        length, msg_type, _, _, pid = struct.unpack_from("=IHHII", message)
+        assert length == len(message)
+        assert msg_type == 3
+        assert pid == os.getpid()
+        assert struct.unpack_from("=I", message, 36) == (PROC_CN_MCAST_LISTEN,)
+
+
+class TestProcConnectorDiscovery:
+    def test_events(self, proc_dir, make_process_dir):
+        """Changes are reported from events."""
+        make_process_dir(10)
+        sock = FakeSocket([])
+        discovery = ProcConnectorDiscovery(proc_dir, sock=sock)
+        assert discovery.poll() == ProcessChanges({10}, set())
+        sock.messages = [
+            event_message(PROC_EVENT_FORK, 1, 1, 20, 20),
+            event_message(PROC_EVENT_FORK, 1, 1, 30, 30)
+            + event_message(PROC_EVENT_EXIT, 30, 30, 0, 0),
+            event_message(PROC_EVENT_EXEC, 10, 10),
+        ]
+        assert discovery.poll() == ProcessChanges({10, 20}, {30})
+        assert discovery.pids == {10, 20}
+
+    def test_exec_then_exit(self, proc_dir):
+        """Processes exiting after being started are reported as exited."""
+        sock = FakeSocket([])
+        discovery = ProcConnectorDiscovery(proc_dir, sock=sock)
+        discovery.poll()
+        sock.messages = [
+            event_message(PROC_EVENT_EXEC, 10, 10),
+            event_message(PROC_EVENT_EXIT, 10, 10, 0, 0),
+        ]
+        assert discovery.poll() == ProcessChanges(set(), {10})
+
+    def test_lost_events(self, proc_dir, make_process_dir):
+        """If events are lost, /proc is scanned again."""
+        make_process_dir(10)
+        sock = FakeSocket([])
+        discovery = ProcConnectorDiscovery(proc_dir, sock=sock)
+        discovery.poll()
+        (proc_dir / "10").rmdir()
+        make_process_dir(20)
+        sock.messages = [OSError(errno.ENOBUFS, "No buffer space")]
+        assert discovery.poll() == ProcessChanges({20}, {10})
+
+    def test_error(self, proc_dir):
+        """Other socket errors are raised."""
+        sock = FakeSocket([])
+        discovery = ProcConnectorDiscovery(proc_dir, sock=sock)
+        discovery.poll()
+        sock.messages = [OSError(errno.EBADF, "Bad file descriptor")]
+        with pytest.raises(OSError):
+            discovery.poll()
+
+    def test_close(self, proc_dir):
+        """The socket is closed."""
+        sock = FakeSocket([])
+        ProcConnectorDiscovery(proc_dir, sock=sock).close()
+        assert sock.closed
+
+    def test_not_permitted(self, monkeypatch, proc_dir):
+        """If the socket can't be set up, an error is raised."""
+        sock = FakeSocket([])
+        monkeypatch.setattr("socket.socket", lambda *args: sock)
+        with pytest.raises(PermissionError):
+            ProcConnectorDiscovery(proc_dir)
+        assert sock.closed
+
+    def test_subscribe(self, monkeypatch, proc_dir):
+        """The socket is bound, and subscribes to events."""
+        calls = []
+
+        class Socket(FakeSocket):
+            def bind(self, address):
+                calls.append(("bind", address))
+
+            def send(self, data):
+                calls.append(("send", data))
+
+        monkeypatch.setattr("socket.socket", lambda *args: Socket([]))
+        ProcConnectorDiscovery(proc_dir)
+        assert calls == [
+            ("bind", (os.getpid(), CN_IDX_PROC)),
+            ("send", subscribe_message()),
+        ]
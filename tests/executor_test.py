@@ -0,0 +1,393 @@
+import asyncio
+from concurrent.futures import (
+    ProcessPoolExecutor,
+    ThreadPoolExecutor,
+)
+import logging
+import os
+import threading
+
+from prometheus_aioexporter import MetricsRegistry
+import pytest
+
+from process_stats_exporter import executor as executor_module
+from process_stats_exporter.executor import (
+    create_executor,
+    MetricsUpdater,
+)
+from process_stats_exporter.instrument import ScrapeStats
+from process_stats_exporter.metrics import (
+    CollectResult,
+    ProcessMetricsHandler,
+)
+from process_stats_exporter.sample import SampleStore
+from process_stats_exporter.snapshot import SnapshotCollector
+
+SAMPLES = SampleStore(["proc_mem"])
+
+
+@pytest.fixture
+def handler():
+    yield ProcessMetricsHandler(logging.getLogger("test"), pids=[os.getpid()])
+
+
+class FakeHandler:
+    def __init__(self):
+        self.threads = []
+        self.applied = []
+        self.exporter_updates = []
+        self.running = 0
+        self.max_running = 0
+
+    def collect(self):
+        self.running += 1
+        self.max_running = max(self.running, self.max_running)
+        self.threads.append(threading.current_thread())
+        threading.Event().wait(0.01)
+        self.running -= 1
+        return CollectResult(SAMPLES, ScrapeStats())
+
+    def apply_samples(self, metrics, samples):
+        self.applied.append((metrics, samples))
+
+    def aggregate(self, samples):
+        return samples
+
+    def update_exporter_metrics(self, metrics, stats):
+        self.exporter_updates.append(stats)
+
+
+class TestCreateExecutor:
+    def test_thread(self, handler):
+        """A thread pool executor can be created."""
+        executor = create_executor("thread", handler, workers=2)
+        assert isinstance(executor, ThreadPoolExecutor)
+        assert executor._max_workers == 2
+        executor.shutdown()
+
+    def test_process(self, handler):
+        """A process pool executor can be created."""
+        executor = create_executor("process", handler, workers=2)
+        assert isinstance(executor, ProcessPoolExecutor)
+        assert executor._max_workers == 2
+        executor.shutdown()
+
+    def test_unknown(self, handler):
+        """An error is raised for unknown executor types."""
+        with pytest.raises(ValueError):
+            create_executor("unknown", handler)
+
+
+class TestMetricsUpdater:
+    def test_collect_in_thread(self):
+        """Samples are collected in the executor thread."""
+        handler = FakeHandler()
+        executor = ThreadPoolExecutor(max_workers=1)
+        updater = MetricsUpdater(handler, executor=executor)
+        result = asyncio.run(updater.collect())
+        assert result.samples is SAMPLES
+        assert handler.threads != [threading.current_thread()]
+        updater.shutdown()
+
+    def test_collect_in_process(self, handler):
+        """Samples are collected in a worker process."""
+        executor = create_executor("process", handler)
+        updater = MetricsUpdater(handler, executor=executor)
+        samples = asyncio.run(updater.collect()).samples
+        assert list(samples.pids) == [os.getpid()]
+        assert samples.labels == [(str(os.getpid()),)]
+        assert samples.columns["proc_mem_rss"][0] > 0
+        updater.shutdown()
+
+    def test_collect_single_flight(self):
+        """Overlapping collections share the running one."""
+        handler = FakeHandler()
+        executor = ThreadPoolExecutor(max_workers=4)
+        updater = MetricsUpdater(handler, executor=executor)
+
+        async def collect():
+            return await asyncio.gather(*(updater.collect() for _ in range(4)))
+
+        results = asyncio.run(collect())
+        assert len(handler.threads) == 1
+        assert all(result is results[0] for result in results)
+        updater.shutdown()
+
+    def test_collect_sequential(self):
+        """Sequential collections collect samples again."""
+        handler = FakeHandler()
+        updater = MetricsUpdater(handler)
+
+        async def collect():
+            await updater.collect()
+            await updater.collect()
+
+        asyncio.run(collect())
+        assert len(handler.threads) == 2
+
+    def test_collect_min_interval(self):
+        """Samples are reused within the minimum interval."""
+        handler = FakeHandler()
+        updater = MetricsUpdater(handler, min_interval=60.0)
+
+        async def collect():
+            return await updater.collect(), await updater.collect()
+
+        first, second = asyncio.run(collect())
+        assert len(handler.threads) == 1
+        assert first is second
+
+    def test_collect_error(self):
+        """Errors in collection are raised, and samples are not reused."""
+        handler = FakeHandler()
+        handler.collect = lambda: 1 / 0
+        updater = MetricsUpdater(handler, min_interval=60.0)
+        with pytest.raises(ZeroDivisionError):
+            asyncio.run(updater.collect())
+        handler.collect = FakeHandler().collect
+        assert asyncio.run(updater.collect()).samples is SAMPLES
+
+    def test_collect_cancelled_caller(self):
+        """If a caller is cancelled, the collection continues for others."""
+        handler = FakeHandler()
+        updater = MetricsUpdater(handler)
+
+        async def collect():
+            task1 = asyncio.create_task(updater.collect())
+            task2 = asyncio.create_task(updater.collect())
+            await asyncio.sleep(0)
+            task1.cancel()
+            return await task2
+
+        assert asyncio.run(collect()).samples is SAMPLES
+
+    def test_update_metrics(self):
+        """Collected samples are applied to metrics."""
+        handler = FakeHandler()
+        updater = MetricsUpdater(handler)
+        metrics = {"metric": object()}
+        asyncio.run(updater.update_metrics(metrics))
+        assert handler.applied == [(metrics, SAMPLES)]
+        assert handler.exporter_updates == []
+
+    def test_update_metrics_exporter_metrics(self):
+        """Exporter metrics are updated with collection stats."""
+        handler = FakeHandler()
+        updater = MetricsUpdater(handler, exporter_metrics={})
+        asyncio.run(updater.update_metrics({}))
+        [stats] = handler.exporter_updates
+        assert "update" in stats.durations
+
+    def test_update_metrics_shared_collection(self):
+        """Samples from a shared collection are applied only once."""
+        handler = FakeHandler()
+        updater = MetricsUpdater(handler, min_interval=60.0)
+        metrics = {"metric": object()}
+
+        async def update():
+            await asyncio.gather(
+                updater.update_metrics(metrics),
+                updater.update_metrics(metrics),
+            )
+            await updater.update_metrics(metrics)
+
+        asyncio.run(update())
+        assert len(handler.applied) == 1
+        assert len(handler.exporter_updates) == 0
+
+    def test_update_metrics_with_handler(self, handler):
+        """Metrics are updated with values from the handler."""
+        metrics = MetricsRegistry().create_metrics(
+            handler.get_metric_configs()
+        )
+        updater = MetricsUpdater(handler)
+        asyncio.run(updater.update_metrics(metrics))
+        [sample] = metrics["proc_mem_rss"].collect()[0].samples
+        assert sample.labels == {"pid": str(os.getpid())}
+        assert sample.value > 0
+
+    def test_update_snapshot(self):
+        """Collected samples are set in the snapshot collector."""
+        handler = FakeHandler()
+        collector = SnapshotCollector([])
+        updater = MetricsUpdater(handler, exporter_metrics={})
+        asyncio.run(updater.update_snapshot(collector))
+        assert collector.snapshot is not None
+        assert len(handler.exporter_updates) == 1
+
+    def test_update_snapshot_reused(self):
+        """The snapshot is not rebuilt from reused samples."""
+        handler = FakeHandler()
+        collector = SnapshotCollector([])
+        updater = MetricsUpdater(
+            handler, min_interval=60.0, exporter_metrics={}
+        )
+
+        async def update():
+            await updater.update_snapshot(collector)
+            snapshot = collector.snapshot
+            await updater.update_snapshot(collector)
+            return snapshot
+
+        assert asyncio.run(update()) is collector.snapshot
+        assert len(handler.exporter_updates) == 1
+
+    def test_update_snapshot_periodically(self):
+        """The snapshot is updated periodically."""
+        handler = FakeHandler()
+        collector = SnapshotCollector([])
+        updater = MetricsUpdater(handler)
+
+        async def run():
+            task = asyncio.create_task(
+                updater.update_snapshot_periodically(collector, 0.01)
+            )
+            await asyncio.sleep(0.1)
+            task.cancel()
+
+        asyncio.run(run())
+        assert len(handler.threads) > 1
+        assert collector.snapshot is not None
+
+    def test_update_snapshot_periodically_error(self, caplog):
+        """Errors in collection are logged."""
+        handler = FakeHandler()
+        handler.logger = logging.getLogger("test")
+        handler.collect = lambda: 1 / 0
+        collector = SnapshotCollector([])
+        updater = MetricsUpdater(handler)
+
+        async def run():
+            task = asyncio.create_task(
+                updater.update_snapshot_periodically(collector, 0.01)
+            )
+            await asyncio.sleep(0.05)
+            task.cancel()
+
+        asyncio.run(run())
+        assert "failed collecting stats" in caplog.messages
+        assert collector.snapshot is None
+
+    def test_reconfigure(self):
+        """The reconfigure function is called, and its result returned."""
+        updater = MetricsUpdater(FakeHandler())
+        assert asyncio.run(updater.reconfigure(lambda: True))
+
+    def test_reconfigure_waits_collection(self):
+        """Reconfiguring waits for the running collection."""
+        handler = FakeHandler()
+        executor = ThreadPoolExecutor(max_workers=1)
+        updater = MetricsUpdater(handler, executor=executor)
+        calls = []
+
+        async def run():
+            task = asyncio.create_task(updater.collect())
+            await asyncio.sleep(0)
+            await updater.reconfigure(lambda: calls.append(handler.running))
+            await task
+
+        asyncio.run(run())
+        assert calls == [0]
+        updater.shutdown()
+
+    def test_reconfigure_collection_error(self):
+        """Reconfiguring happens even if the running collection fails."""
+        handler = FakeHandler()
+        handler.collect = lambda: 1 / 0
+        updater = MetricsUpdater(handler)
+
+        async def run():
+            task = asyncio.create_task(updater.collect())
+            await asyncio.sleep(0)
+            result = await updater.reconfigure(lambda: True)
+            with pytest.raises(ZeroDivisionError):
+                await task
+            return result
+
+        assert asyncio.run(run())
+
+    def test_reconfigure_stale_samples(self):
+        """Samples collected before reconfiguring are not applied."""
+        handler = FakeHandler()
+        updater = MetricsUpdater(handler, min_interval=60.0)
+        collector = SnapshotCollector([])
+
+        async def run():
+            result = await updater.collect()
+            await updater.reconfigure(lambda: None)
+            # a caller that got the result before reconfiguring
+            updater._last_result = result
+            updater._last_time = asyncio.get_running_loop().time()
+            await updater.update_metrics({})
+            await updater.update_snapshot(collector)
+            updater._last_result = None
+            await updater.update_metrics({})
+
+        asyncio.run(run())
+        assert len(handler.threads) == 2
+        assert len(handler.applied) == 1
+        assert collector.snapshot is None
+
+    def test_reconfigure_process_workers(self, handler):
+        """Handlers in process workers are reconfigured, keeping the pool."""
+        executor = create_executor("process", handler)
+        updater = MetricsUpdater(handler, executor=executor)
+
+        async def run():
+            await updater.collect()
+            await updater.reconfigure(
+                lambda: handler.reconfigure(
+                    pids=[os.getpid()], labels={"env": "prod"}
+                )
+            )
+            return await updater.collect()
+
+        samples = asyncio.run(run()).samples
+        assert updater._executor is executor
+        assert updater._worker_generation == 1
+        assert samples.labels == [("prod", str(os.getpid()))]
+        updater.shutdown()
+
+    def test_reconfigure_thread_no_worker_options(self):
+        """Options for workers are only kept for process executors."""
+        updater = MetricsUpdater(
+            FakeHandler(), executor=ThreadPoolExecutor(max_workers=1)
+        )
+        asyncio.run(updater.reconfigure(lambda: None))
+        assert updater._worker_options is None
+        assert updater._worker_generation == 0
+        updater.shutdown()
+
+    def test_shutdown_no_executor(self):
+        """Shutdown is a no-op if no executor is set."""
+        MetricsUpdater(FakeHandler()).shutdown()
+
+
+class TestWorkerCollect:
+    def test_collect(self, handler, monkeypatch):
+        """Samples are collected with the worker handler."""
+        monkeypatch.setattr(executor_module, "_worker_handler", None)
+        executor_module._init_worker(handler.worker_options())
+        samples = executor_module._worker_collect().samples
+        assert list(samples.pids) == [os.getpid()]
+
+    def test_collect_reconfigure(self, handler, monkeypatch):
+        """The worker handler is reconfigured once for each generation."""
+        monkeypatch.setattr(executor_module, "_worker_handler", None)
+        executor_module._init_worker(handler.worker_options())
+        worker_handler = executor_module._worker_handler
+        cache = worker_handler._process_cache
+        calls = []
+        reconfigure = worker_handler.reconfigure
+
+        def track_reconfigure(**options):
+            calls.append(options)
+            return reconfigure(**options)
+
+        monkeypatch.setattr(worker_handler, "reconfigure", track_reconfigure)
+        options = dict(handler.reconfigure_options(), labels={"env": "prod"})
+        executor_module._worker_collect(1, options)
+        samples = executor_module._worker_collect(1, options).samples
+        assert calls == [options]
+        assert samples.labels == [("prod", str(os.getpid()))]
+        assert worker_handler._process_cache is cache
@@ -0,0 +1,326 @@
+import asyncio
+import gzip
+
+from aiohttp.test_utils import (
+    TestClient,
+    TestServer,
+)
+from prometheus_aioexporter import (
+    MetricConfig,
+    MetricsRegistry,
+)
+from prometheus_client import (
+    CollectorRegistry,
+    Counter,
+    Gauge,
+    generate_latest,
+    Histogram,
+)
+from prometheus_client.exposition import CONTENT_TYPE_LATEST
+import pytest
+
+from process_stats_exporter import exposition
+from process_stats_exporter.exposition import (
+    label_string,
+    metric_series,
+    MetricsExporter,
+    Series,
+    TextRenderer,
+)
+from process_stats_exporter.snapshot import SnapshotCollector
+
+
+@pytest.fixture
+def registry():
+    registry = CollectorRegistry()
+    counter = Counter(
+        "proc_time",
+        "Time\nwith \\ newline",
+        ["cmd", "pid"],
+        registry=registry,
+    )
+    counter.labels("foo", "10").inc(1.5)
+    counter.labels('b"a\\r\n', "20").inc(12345678)
+    gauge = Gauge("proc_mem", "Memory", ["pid"], registry=registry)
+    gauge.labels("10").set(100)
+    gauge.labels("20").set(float("inf"))
+    Gauge("proc_empty", "Empty", ["pid"], registry=registry)
+    Gauge("proc_unlabeled", "Unlabeled", registry=registry).set(3)
+    Histogram("proc_duration", "Duration", registry=registry).observe(0.2)
+    yield registry
+
+
+class TestTextRenderer:
+    def test_render(self, registry):
+        """Output is the same as for the generic renderer."""
+        assert TextRenderer().render(registry) == generate_latest(registry)
+
+    def test_render_cached_labels(self, registry):
+        """Output is the same when label strings are cached."""
+        renderer = TextRenderer()
+        renderer.render(registry)
+        registry._names_to_collectors["proc_mem"].labels("30").set(1)
+        assert renderer.render(registry) == generate_latest(registry)
+
+    def test_render_evict_labels(self, registry):
+        """Label strings are only kept for labels in the last render."""
+        renderer = TextRenderer()
+        gauge = registry._names_to_collectors["proc_mem"]
+        renderer.render(registry)
+        gauge.remove("20")
+        renderer.render(registry)
+        assert (("pid",), ("20",)) not in renderer._label_strings
+        assert renderer._label_strings[(("pid",), ("10",))] == '{pid="10"}'
+
+    def test_render_no_created(self, monkeypatch, registry):
+        """Creation time for counters is not rendered if disabled."""
+        monkeypatch.setattr(exposition.client_metrics, "_use_created", False)
+        output = TextRenderer().render(registry)
+        assert b"_created" not in output
+        assert output == generate_latest(registry)
+
+    def test_render_snapshot(self, registry, make_store):
+        """Snapshot collectors are rendered from series."""
+        collector = SnapshotCollector(
+            [
+                MetricConfig(
+                    "proc_cpu", "CPU", "counter", {"labels": ["pid"]}
+                ),
+                MetricConfig("proc_rss", "RSS", "gauge", {"labels": ["pid"]}),
+            ],
+            clock=lambda: 1000.0,
+        )
+        collector.update(
+            make_store(
+                ["proc_cpu", "proc_rss"],
+                [
+                    (10, ("10",), {"proc_cpu": 1, "proc_rss": 2}),
+                    (20, ("20",), {"proc_cpu": 3, "proc_rss": None}),
+                ],
+            )
+        )
+        registry.register(collector)
+        assert TextRenderer().render(registry) == generate_latest(registry)
+
+    def test_render_target_info(self, registry):
+        """The generic renderer is used if target info is set."""
+        registry.set_target_info({"env": "prod"})
+        assert TextRenderer().render(registry) == generate_latest(registry)
+
+    def test_render_registry_attrs_missing(self, monkeypatch, registry):
+        """The generic renderer is used if registry attributes are missing."""
+        monkeypatch.setattr(
+            exposition, "_REGISTRY_ATTRS", ("_lock", "_missing")
+        )
+        renderer = TextRenderer()
+        assert renderer.render(registry) == generate_latest(registry)
+        assert renderer._label_strings == {}
+
+    def test_render_metric_attrs_missing(self, monkeypatch, registry):
+        """Metrics are rendered generically if their attributes are missing."""
+        monkeypatch.setattr(exposition, "_METRIC_ATTRS", ("_missing",))
+        renderer = TextRenderer()
+        assert renderer.render(registry) == generate_latest(registry)
+        assert renderer._label_strings == {}
+
+
+class TestMetricSeries:
+    def test_series(self, registry):
+        """A series is returned with values from metric children."""
+        series = metric_series(registry._names_to_collectors["proc_mem"])
+        assert series.name == "proc_mem"
+        assert series.type == "gauge"
+        assert series.label_names == ("pid",)
+        assert list(series.values) == [
+            (("10",), 100.0, None),
+            (("20",), float("inf"), None),
+        ]
+
+    def test_metric_attrs_missing(self, monkeypatch, registry):
+        """No series is returned if metric attributes are missing."""
+        monkeypatch.setattr(exposition, "_METRIC_ATTRS", ("_missing",))
+        assert metric_series(registry._names_to_collectors["proc_mem"]) is None
+
+    def test_child_attrs_missing(self, monkeypatch, registry):
+        """No series is returned if attributes of children are missing."""
+        monkeypatch.setattr(exposition, "_CHILD_ATTRS", ("_missing",))
+        assert metric_series(registry._names_to_collectors["proc_mem"]) is None
+
+    def test_counter_child_attrs_missing(self, monkeypatch, registry):
+        """No series is returned if attributes of counters are missing."""
+        monkeypatch.setattr(
+            exposition, "_COUNTER_CHILD_ATTRS", ("_value", "_missing")
+        )
+        counter = registry._names_to_collectors["proc_time"]
+        assert metric_series(counter) is None
+
+    def test_no_children(self, monkeypatch, registry):
+        """Children attributes are not checked if there are no children."""
+        monkeypatch.setattr(exposition, "_CHILD_ATTRS", ("_missing",))
+        gauge = registry._names_to_collectors["proc_empty"]
+        assert list(metric_series(gauge).values) == []
+
+    def test_use_created_missing(self, monkeypatch, registry):
+        """No series is returned if the creation time flag is missing."""
+        monkeypatch.delattr(exposition.client_metrics, "_use_created")
+        assert metric_series(registry._names_to_collectors["proc_mem"]) is None
+
+
+class TestLabelString:
+    def test_sorted(self):
+        """Labels are sorted by name."""
+        assert label_string(["b", "a"], ["1", "2"]) == '{a="2",b="1"}'
+
+    def test_escape(self):
+        """Label values are escaped."""
+        assert label_string(["a"], ['"\\\n']) == r'{a="\"\\\n"}'
+
+    def test_empty(self):
+        """The label string is empty without labels."""
+        assert label_string([], []) == ""
+
+
+class FakeCollector:
+    def __init__(self):
+        self.calls = 0
+
+    def describe(self):
+        return []
+
+    def series(self):
+        self.calls += 1
+        return [Series("foo", "Foo", "gauge", (), [((), 1.0, None)])]
+
+
+@pytest.fixture
+def metrics_registry():
+    registry = MetricsRegistry()
+    registry.create_metrics(
+        [MetricConfig("proc_mem", "Memory", "gauge", {"labels": ["pid"]})]
+    )
+    registry.get_metric("proc_mem", {"pid": "10"}).set(100)
+    yield registry
+
+
+def get_response(exporter, headers=None):
+    """Return body and headers for a metrics request."""
+
+    async def request():
+        async with TestClient(TestServer(exporter.app)) as client:
+            response = await client.get(
+                "/metrics", headers=headers, auto_decompress=False
+            )
+            return await response.read(), response.headers
+
+    return asyncio.run(request())
+
+
+class TestMetricsExporter:
+    def test_metrics(self, metrics_registry):
+        """Metrics are returned in the text format."""
+        exporter = MetricsExporter(
+            "test", "", ["localhost"], 8000, metrics_registry
+        )
+        body, headers = get_response(exporter)
+        assert body == metrics_registry.generate_metrics()
+        assert headers["Content-Type"] == CONTENT_TYPE_LATEST
+        assert "Content-Encoding" not in headers
+
+    def test_metrics_update_handler(self, metrics_registry):
+        """Metrics are updated before being rendered."""
+        exporter = MetricsExporter(
+            "test", "", ["localhost"], 8000, metrics_registry
+        )
+
+        async def update(metrics):
+            metrics["proc_mem"].labels("10").set(200)
+
+        exporter.set_metric_update_handler(update)
+        body, _ = get_response(exporter)
+        assert b'proc_mem{pid="10"} 200.0\n' in body
+
+    def test_metrics_gzip(self, metrics_registry):
+        """Responses are compressed if enabled and accepted."""
+        exporter = MetricsExporter(
+            "test", "", ["localhost"], 8000, metrics_registry, compress=True
+        )
+        body, headers = get_response(
+            exporter, headers={"Accept-Encoding": "gzip, deflate"}
+        )
+        assert headers["Content-Encoding"] == "gzip"
+        assert gzip.decompress(body) == metrics_registry.generate_metrics()
+
+    def test_metrics_gzip_not_accepted(self, metrics_registry):
+        """Responses are not compressed if not accepted."""
+        exporter = MetricsExporter(
+            "test", "", ["localhost"], 8000, metrics_registry, compress=True
+        )
+        body, headers = get_response(
+            exporter, headers={"Accept-Encoding": "identity"}
+        )
+        assert "Content-Encoding" not in headers
+        assert body == metrics_registry.generate_metrics()
+
+    def test_metrics_gzip_disabled(self, metrics_registry):
+        """Responses are not compressed if not enabled."""
+        exporter = MetricsExporter(
+            "test", "", ["localhost"], 8000, metrics_registry
+        )
+        _, headers = get_response(
+            exporter, headers={"Accept-Encoding": "gzip"}
+        )
+        assert "Content-Encoding" not in headers
+
+    def test_metrics_openmetrics(self, metrics_registry):
+        """OpenMetrics format is returned if enabled and requested."""
+        exporter = MetricsExporter(
+            "test",
+            "",
+            ["localhost"],
+            8000,
+            metrics_registry,
+            openmetrics=True,
+        )
+        body, headers = get_response(
+            exporter, headers={"Accept": "application/openmetrics-text"}
+        )
+        assert headers["Content-Type"].startswith(
+            "application/openmetrics-text;"
+        )
+        assert body.endswith(b"# EOF\n")
+
+    def test_metrics_openmetrics_not_requested(self, metrics_registry):
+        """The text format is returned if OpenMetrics is not requested."""
+        exporter = MetricsExporter(
+            "test",
+            "",
+            ["localhost"],
+            8000,
+            metrics_registry,
+            openmetrics=True,
+        )
+        body, headers = get_response(exporter, headers={"Accept": "*/*"})
+        assert headers["Content-Type"] == CONTENT_TYPE_LATEST
+        assert body == metrics_registry.generate_metrics()
+
+    def test_metrics_openmetrics_disabled(self, metrics_registry):
+        """The text format is returned if OpenMetrics is not enabled."""
+        exporter = MetricsExporter(
+            "test", "", ["localhost"], 8000, metrics_registry
+        )
+        body, headers = get_response(
+            exporter, headers={"Accept": "application/openmetrics-text"}
+        )
+        assert headers["Content-Type"] == CONTENT_TYPE_LATEST
+        assert body == metrics_registry.generate_metrics()
+
+    def test_metrics_series_collector(self, metrics_registry):
+        """Series from collectors providing them are rendered."""
+        collector = FakeCollector()
+        metrics_registry.register_additional_collector(collector)
+        exporter = MetricsExporter(
+            "test", "", ["localhost"], 8000, metrics_registry
+        )
+        body, _ = get_response(exporter)
+        assert body.endswith(b"# HELP foo Foo\n# TYPE foo gauge\nfoo 1.0\n")
+        assert collector.calls == 1
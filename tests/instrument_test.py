@@ -0,0 +1,71 @@
+from prometheus_aioexporter import MetricsRegistry
+
+from process_stats_exporter.instrument import (
+    exporter_metric_configs,
+    ScrapeStats,
+    update_exporter_metrics,
+)
+
+
+class TestScrapeStats:
+    def test_counters(self):
+        """Counters are initially zero."""
+        stats = ScrapeStats()
+        assert stats.pids_scanned == 0
+        assert stats.pids_matched == 0
+        assert stats.pids_vanished == 0
+        assert stats.tasks_read == 0
+        assert stats.files_opened == 0
+        assert stats.durations == {}
+
+    def test_phase(self):
+        """Time spent in phases is tracked and summed."""
+        stats = ScrapeStats()
+        with stats.phase("scan"):
+            pass
+        first = stats.durations["scan"]
+        with stats.phase("scan"):
+            pass
+        assert stats.durations["scan"] > first
+
+
+class TestExporterMetricConfigs:
+    def test_configs(self):
+        """MetricConfigs are returned for exporter metrics."""
+        assert [
+            (config.name, config.type) for config in exporter_metric_configs()
+        ] == [
+            ("process_stats_exporter_scrape_duration_seconds", "histogram"),
+            ("process_stats_exporter_pids_scanned", "counter"),
+            ("process_stats_exporter_pids_matched", "counter"),
+            ("process_stats_exporter_pids_vanished", "counter"),
+            ("process_stats_exporter_tasks_read", "counter"),
+            ("process_stats_exporter_proc_files_opened", "counter"),
+        ]
+
+
+class TestUpdateExporterMetrics:
+    def test_update(self):
+        """Metrics are updated with scrape stats."""
+        metrics = MetricsRegistry().create_metrics(exporter_metric_configs())
+        stats = ScrapeStats()
+        stats.pids_scanned = 100
+        stats.pids_matched = 10
+        stats.files_opened = 30
+        stats.durations = {"scan": 0.2, "collect": 0.3}
+        update_exporter_metrics(metrics, stats)
+        update_exporter_metrics(metrics, stats)
+        assert (
+            metrics["process_stats_exporter_pids_scanned"]._value.get() == 200
+        )
+        assert (
+            metrics["process_stats_exporter_proc_files_opened"]._value.get()
+            == 60
+        )
+        histogram = metrics["process_stats_exporter_scrape_duration_seconds"]
+        samples = {
+            sample.labels["phase"]: sample.value
+            for sample in histogram.collect()[0].samples
+            if sample.name.endswith("_sum")
+        }
+        assert samples == {"scan": 0.4, "collect": 0.6}
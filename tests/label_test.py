@@ -4,8 +4,10 @@ from lxstats.process import Process
 import pytest
 
 from process_stats_exporter.label import (
+    CgroupLabeler,
     CmdlineLabeler,
     PidLabeler,
+    StaticLabeler,
 )
 
 
@@ -20,6 +22,19 @@ class TestPidLabeler:
         assert PidLabeler()(process) == {"pid": "10"}
 
 
+class TestCgroupLabeler:
+    def test_labels(self):
+        """CgroupLabeler returns the "cgroup" label."""
+        assert CgroupLabeler("foo").labels() == {"cgroup"}
+
+    def test_call(self):
+        """The labeler returns a label with the cgroup."""
+        process = Process(10, "/proc/10")
+        assert CgroupLabeler("system.slice/foo.service")(process) == {
+            "cgroup": "system.slice/foo.service"
+        }
+
+
 class TestCmdlineLabeler:
     @pytest.mark.parametrize(
         "regex,labels",
@@ -60,3 +75,31 @@ class TestCmdlineLabeler:
         process.collect_stats()
         labeler = CmdlineLabeler(re.compile("(?P<prefix>.*)/exec"))
         assert labeler(process) == {"prefix": "/path/to"}
+
+    def test_match(self):
+        """Labels are returned for a matching command line."""
+        labeler = CmdlineLabeler(re.compile("(?P<prefix>.*)/exec"))
+        assert labeler.match("/path/to/exec", "exec") == {"prefix": "/path/to"}
+
+    def test_match_no_groups(self):
+        """If the regexp has no groups, the process name is used."""
+        labeler = CmdlineLabeler(re.compile("exec"))
+        assert labeler.match("/path/to/exec", "exec") == {"cmd": "exec"}
+
+    def test_match_no_match(self):
+        """If the command line doesn't match, None is returned."""
+        labeler = CmdlineLabeler(re.compile("exec"))
+        assert labeler.match("/bin/sh", "sh") is None
+
+
+class TestStaticLabeler:
+    def test_labels(self):
+        """StaticLabeler returns names of the labels it's created with."""
+        labeler = StaticLabeler({"foo": "bar", "baz": "bza"})
+        assert labeler.labels() == {"foo", "baz"}
+
+    def test_call(self):
+        """The labeler returns the labels it's created with."""
+        process = Process(10, "/proc/10")
+        labeler = StaticLabeler({"foo": "bar"})
+        assert labeler(process) == {"foo": "bar"}
@@ -1,15 +1,25 @@
+from array import array
 import logging
+import os
+import pickle
 import re
 
-from lxstats.process import Process
 from prometheus_aioexporter import MetricsRegistry
+from prometheus_client import (
+    CollectorRegistry,
+    generate_latest,
+)
 import pytest
 
+from process_stats_exporter.exposition import TextRenderer
+from process_stats_exporter.instrument import ScrapeStats
 from process_stats_exporter.label import (
     CmdlineLabeler,
     PidLabeler,
 )
 from process_stats_exporter.metrics import ProcessMetricsHandler
+from process_stats_exporter.procfs import ProcfsProcess
+from process_stats_exporter.snapshot import SnapshotCollector
 
 
 @pytest.fixture
@@ -35,6 +45,19 @@ def get_samples(metric):
     )
 
 
+def count_labels_calls(monkeypatch, metric):
+    """Return a list tracking label values for children lookups."""
+    calls = []
+    labels = metric.labels
+
+    def track_labels(*label_values):
+        calls.append(label_values)
+        return labels(*label_values)
+
+    monkeypatch.setattr(metric, "labels", track_labels)
+    return calls
+
+
 class TestProcessMetricsHandler:
     def test_get_metric_configs(self, handler):
         """MetricConfigs are returned for process metrics."""
@@ -59,6 +82,61 @@ class TestProcessMetricsHandler:
         for metric in handler.get_metric_configs():
             assert metric.config["labels"] == ["pid"]
 
+    def test_get_metric_configs_with_cgroups(self, labelers_processes):
+        """If cgroups are specified, metrics include a "cgroup" label."""
+        handler = ProcessMetricsHandler(
+            logging.getLogger("test"),
+            cgroups=["system.slice/*"],
+            get_process_iterator=lambda **kwargs: labelers_processes,
+        )
+        for metric in handler.get_metric_configs():
+            assert metric.config["labels"] == ["cgroup"]
+
+    def test_get_metric_configs_with_pidfiles_units(self, labelers_processes):
+        """Metrics include labels for pidfiles and units."""
+        handler = ProcessMetricsHandler(
+            logging.getLogger("test"),
+            pidfiles=["/run/foo.pid"],
+            units=["foo"],
+            get_process_iterator=lambda **kwargs: labelers_processes,
+        )
+        for metric in handler.get_metric_configs():
+            assert metric.config["labels"] == ["pidfile", "unit"]
+
+    def test_get_metric_configs_stat_groups(self, labelers_processes):
+        """Only metrics for the specified stat groups are returned."""
+        handler = ProcessMetricsHandler(
+            logging.getLogger("test"),
+            pids=["10"],
+            get_process_iterator=lambda **kwargs: labelers_processes,
+            stat_groups=["status", "tasks"],
+        )
+        assert sorted(
+            config.name for config in handler.get_metric_configs()
+        ) == [
+            "proc_mem_rss_max",
+            "proc_tasks_count",
+            "proc_tasks_state_running",
+            "proc_tasks_state_sleeping",
+            "proc_tasks_state_uninterruptible_sleep",
+        ]
+
+    def test_collect_no_counters(self, make_process_dir, labelers_processes):
+        """Without counters, the stat file is not read for start time."""
+        process_dir = make_process_dir(10)
+        (process_dir / "stat").write_text(" ".join(str(i) for i in range(45)))
+        labelers_processes.append(
+            (PidLabeler(), ProcfsProcess(10, process_dir))
+        )
+        handler = ProcessMetricsHandler(
+            logging.getLogger("test"),
+            pids=["10"],
+            get_process_iterator=lambda **kwargs: labelers_processes,
+            stat_groups=["tasks"],
+        )
+        samples = handler.collect().samples
+        assert samples.starttime(0) is None
+
     def test_update_metrics(self, make_process_dir, labelers_processes):
         """Metrics are updated with values from procesess."""
         process_10_dir = make_process_dir(10)
@@ -77,11 +155,11 @@ class TestProcessMetricsHandler:
             [
                 (
                     CmdlineLabeler(re.compile("exec.*")),
-                    Process(10, process_10_dir),
+                    ProcfsProcess(10, process_10_dir),
                 ),
                 (
                     CmdlineLabeler(re.compile("exec.*")),
-                    Process(20, process_20_dir),
+                    ProcfsProcess(20, process_20_dir),
                 ),
             ]
         )
@@ -102,6 +180,79 @@ class TestProcessMetricsHandler:
             (54.0, {"cmd": "exec2"}),
         ]
 
+    def test_update_metrics_different_labels(
+        self, make_process_dir, labelers_processes
+    ):
+        """Labels not set for a process have an empty value."""
+        process_10_dir = make_process_dir(10)
+        (process_10_dir / "cmdline").write_text("exec1")
+        (process_10_dir / "stat").write_text(
+            " ".join(str(i) for i in range(45))
+        )
+        (process_10_dir / "task").mkdir()
+        process_20_dir = make_process_dir(20)
+        (process_20_dir / "cmdline").write_text("run2")
+        (process_20_dir / "stat").write_text(
+            " ".join(str(i) for i in range(45, 90))
+        )
+        (process_20_dir / "task").mkdir()
+        regexps = [re.compile("(?P<exe>exec.*)"), re.compile("(?P<run>run.*)")]
+        labelers_processes.extend(
+            [
+                (
+                    CmdlineLabeler(regexps[0]),
+                    ProcfsProcess(10, process_10_dir),
+                ),
+                (
+                    CmdlineLabeler(regexps[1]),
+                    ProcfsProcess(20, process_20_dir),
+                ),
+            ]
+        )
+        handler = ProcessMetricsHandler(
+            logging.getLogger("test"),
+            cmdline_regexps=regexps,
+            get_process_iterator=lambda **kwargs: labelers_processes,
+        )
+        metrics = MetricsRegistry().create_metrics(
+            handler.get_metric_configs()
+        )
+        handler.update_metrics(metrics)
+        metric = metrics["proc_min_fault"]
+        assert get_samples(metric) == [
+            (9.0, {"exe": "exec1", "run": ""}),
+            (54.0, {"exe": "", "run": "run2"}),
+        ]
+
+    def test_collect_unmatched_group(
+        self, make_process_dir, labelers_processes
+    ):
+        """Regexp groups not taking part in the match have an empty value."""
+        process_dir = make_process_dir(10)
+        (process_dir / "cmdline").write_text("sleep 30")
+        (process_dir / "stat").write_text(" ".join(str(i) for i in range(45)))
+        (process_dir / "task").mkdir()
+        regexp = re.compile("(?P<arg>zzz)?sleep 30")
+        labelers_processes.append(
+            (CmdlineLabeler(regexp), ProcfsProcess(10, process_dir))
+        )
+        handler = ProcessMetricsHandler(
+            logging.getLogger("test"),
+            cmdline_regexps=[regexp],
+            get_process_iterator=lambda **kwargs: labelers_processes,
+        )
+        samples = handler.collect().samples
+        assert samples.labels == [("",)]
+        collector = SnapshotCollector(
+            handler.get_metric_configs(), clock=lambda: 1000.0
+        )
+        collector.update(samples)
+        registry = CollectorRegistry()
+        registry.register(collector)
+        output = TextRenderer().render(registry)
+        assert output == generate_latest(registry)
+        assert b'proc_min_fault_total{arg=""} 9.0\n' in output
+
     def test_update_metrics_with_pids(
         self, make_process_dir, labelers_processes
     ):
@@ -110,8 +261,8 @@ class TestProcessMetricsHandler:
         process_20_dir = make_process_dir(20)
         labelers_processes.extend(
             [
-                (PidLabeler(), Process(10, process_10_dir)),
-                (PidLabeler(), Process(20, process_20_dir)),
+                (PidLabeler(), ProcfsProcess(10, process_10_dir)),
+                (PidLabeler(), ProcfsProcess(20, process_20_dir)),
             ]
         )
         handler = ProcessMetricsHandler(
@@ -139,6 +290,521 @@ class TestProcessMetricsHandler:
         assert labels1["pid"] == "10"
         assert labels2["pid"] == "20"
 
+    def test_apply_samples_caches_children(
+        self, monkeypatch, handler, make_store
+    ):
+        """Metric children are looked up once for each set of labels."""
+        metrics = MetricsRegistry().create_metrics(
+            handler.get_metric_configs()
+        )
+        metric = metrics["proc_min_fault"]
+        calls = count_labels_calls(monkeypatch, metric)
+        values = dict.fromkeys(metrics, 1)
+        samples = [
+            (10, ("10",), values),
+            (11, ("10",), values),
+        ]
+        handler.apply_samples(metrics, make_store(metrics, samples))
+        handler.apply_samples(metrics, make_store(metrics, samples))
+        assert calls == [("10",)]
+        assert get_samples(metric) == [(2.0, {"pid": "10"})]
+
+    def test_apply_samples_drops_unseen_children(
+        self, monkeypatch, handler, make_store
+    ):
+        """Cached children are dropped for labels not in the last samples."""
+        metrics = MetricsRegistry().create_metrics(
+            handler.get_metric_configs()
+        )
+        calls = count_labels_calls(monkeypatch, metrics["proc_mem_rss"])
+        values = dict.fromkeys(metrics, 1)
+        handler.apply_samples(
+            metrics, make_store(metrics, [(10, ("10",), values)])
+        )
+        handler.apply_samples(
+            metrics, make_store(metrics, [(20, ("20",), values)])
+        )
+        handler.apply_samples(
+            metrics, make_store(metrics, [(10, ("10",), values)])
+        )
+        assert calls == [("10",), ("20",), ("10",)]
+
+    def test_apply_samples_evict(self, handler, make_store):
+        """Metrics for label values not in samples are removed."""
+        metrics = MetricsRegistry().create_metrics(
+            handler.get_metric_configs()
+        )
+        values = dict.fromkeys(metrics, 1)
+        handler.apply_samples(
+            metrics,
+            make_store(
+                metrics,
+                [
+                    (10, ("10",), values),
+                    (20, ("20",), values),
+                ],
+            ),
+        )
+        handler.apply_samples(
+            metrics, make_store(metrics, [(10, ("10",), values)])
+        )
+        assert get_samples(metrics["proc_min_fault"]) == [(1.0, {"pid": "10"})]
+
+    def test_apply_samples_evict_grace(self, labelers_processes, make_store):
+        """Metrics are removed after the grace number of updates."""
+        handler = ProcessMetricsHandler(
+            logging.getLogger("test"),
+            pids=["10", "20"],
+            get_process_iterator=lambda **kwargs: labelers_processes,
+            evict_grace=2,
+        )
+        metrics = MetricsRegistry().create_metrics(
+            handler.get_metric_configs()
+        )
+        values = dict.fromkeys(metrics, 1)
+        handler.apply_samples(
+            metrics, make_store(metrics, [(10, ("10",), values)])
+        )
+        handler.apply_samples(metrics, make_store(metrics))
+        handler.apply_samples(metrics, make_store(metrics))
+        assert get_samples(metrics["proc_min_fault"]) == [(1.0, {"pid": "10"})]
+        handler.apply_samples(metrics, make_store(metrics))
+        assert get_samples(metrics["proc_min_fault"]) == []
+
+    def test_apply_samples_evict_grace_reset(
+        self, labelers_processes, make_store
+    ):
+        """The grace count is reset when label values are found again."""
+        handler = ProcessMetricsHandler(
+            logging.getLogger("test"),
+            pids=["10", "20"],
+            get_process_iterator=lambda **kwargs: labelers_processes,
+            evict_grace=1,
+        )
+        metrics = MetricsRegistry().create_metrics(
+            handler.get_metric_configs()
+        )
+        sample = (10, ("10",), dict.fromkeys(metrics, 1))
+        handler.apply_samples(metrics, make_store(metrics, [sample]))
+        handler.apply_samples(metrics, make_store(metrics))
+        handler.apply_samples(metrics, make_store(metrics, [sample]))
+        handler.apply_samples(metrics, make_store(metrics))
+        assert get_samples(metrics["proc_min_fault"]) == [(1.0, {"pid": "10"})]
+
+    def test_reconfigure_unchanged_metrics(self, handler):
+        """If label names and stats don't change, metrics are kept."""
+        collectors = handler._collectors
+        assert not handler.reconfigure(pids=["30"], labels={})
+        assert handler._collectors is collectors
+        assert handler._pids == ["30"]
+
+    def test_reconfigure_changed_metrics(self, handler):
+        """If label names or stats change, collectors are created again."""
+        assert handler.reconfigure(pids=["10"], labels={"env": "prod"})
+        for metric in handler.get_metric_configs():
+            assert metric.config["labels"] == ["env", "pid"]
+        assert handler.reconfigure(
+            pids=["10"], labels={"env": "prod"}, stat_groups=["status"]
+        )
+        assert [config.name for config in handler.get_metric_configs()] == [
+            "proc_mem_rss_max"
+        ]
+        assert handler._counter_names == ["proc_mem_rss_max"]
+
+    def test_reconfigure_label_values(self, labelers_processes):
+        """Static label values are updated."""
+        handler = ProcessMetricsHandler(
+            logging.getLogger("test"),
+            pids=["10"],
+            labels={"env": "prod"},
+            get_process_iterator=lambda **kwargs: labelers_processes,
+        )
+        assert not handler.reconfigure(pids=["10"], labels={"env": "dev"})
+        assert handler._base_labels == {"env": "dev", "pid": ""}
+
+    def test_reconfigure_keep_series(self, handler, make_store):
+        """Series for unchanged selectors are kept."""
+        metrics = MetricsRegistry().create_metrics(
+            handler.get_metric_configs()
+        )
+        values = dict.fromkeys(metrics, 1)
+        handler.apply_samples(
+            metrics,
+            make_store(
+                metrics,
+                [
+                    (10, ("10",), values),
+                    (20, ("20",), values),
+                ],
+            ),
+        )
+        handler.reconfigure(pids=["10"])
+        handler.apply_samples(
+            metrics, make_store(metrics, [(10, ("10",), values)])
+        )
+        assert get_samples(metrics["proc_min_fault"]) == [(1.0, {"pid": "10"})]
+
+    def test_apply_samples_counters_delta(self, handler, make_store):
+        """Counters are incremented by the difference from the last value."""
+        metrics = MetricsRegistry().create_metrics(
+            handler.get_metric_configs()
+        )
+        for value in (10, 15, 30):
+            handler.apply_samples(
+                metrics,
+                make_store(
+                    metrics, [(10, ("10",), dict.fromkeys(metrics, value), 1)]
+                ),
+            )
+        assert get_samples(metrics["proc_min_fault"]) == [
+            (30.0, {"pid": "10"})
+        ]
+        assert metrics["proc_mem_rss"].labels("10")._value.get() == 30
+
+    def test_apply_samples_counters_restarted_process(
+        self, handler, make_store
+    ):
+        """Values for a process with a different start time are added."""
+        metrics = MetricsRegistry().create_metrics(
+            handler.get_metric_configs()
+        )
+        handler.apply_samples(
+            metrics,
+            make_store(
+                metrics, [(10, ("10",), dict.fromkeys(metrics, 10), 1)]
+            ),
+        )
+        handler.apply_samples(
+            metrics,
+            make_store(
+                metrics, [(10, ("10",), dict.fromkeys(metrics, 15), 2)]
+            ),
+        )
+        assert get_samples(metrics["proc_min_fault"]) == [
+            (25.0, {"pid": "10"})
+        ]
+
+    def test_apply_samples_counters_decreased(self, handler, make_store):
+        """If a counter value decreases, it's added as a new value."""
+        metrics = MetricsRegistry().create_metrics(
+            handler.get_metric_configs()
+        )
+        for value in (10, 4):
+            handler.apply_samples(
+                metrics,
+                make_store(
+                    metrics, [(10, ("10",), dict.fromkeys(metrics, value), 1)]
+                ),
+            )
+        assert get_samples(metrics["proc_min_fault"]) == [
+            (14.0, {"pid": "10"})
+        ]
+
+    def test_apply_samples_counters_empty_value(self, handler, make_store):
+        """Counters are not changed for empty values."""
+        metrics = MetricsRegistry().create_metrics(
+            handler.get_metric_configs()
+        )
+        for value in (None, 10, None, 15):
+            handler.apply_samples(
+                metrics,
+                make_store(
+                    metrics, [(10, ("10",), dict.fromkeys(metrics, value), 1)]
+                ),
+            )
+        assert get_samples(metrics["proc_min_fault"]) == [
+            (15.0, {"pid": "10"})
+        ]
+
+    def test_apply_samples_counters_missed_update(
+        self, labelers_processes, make_store
+    ):
+        """Last values are kept for processes missing in some updates."""
+        handler = ProcessMetricsHandler(
+            logging.getLogger("test"),
+            pids=["10"],
+            get_process_iterator=lambda **kwargs: labelers_processes,
+            evict_grace=3,
+        )
+        metrics = MetricsRegistry().create_metrics(
+            handler.get_metric_configs()
+        )
+        for values in ([100], [], [110]):
+            handler.apply_samples(
+                metrics,
+                make_store(
+                    metrics,
+                    [
+                        (10, ("10",), dict.fromkeys(metrics, value), 1)
+                        for value in values
+                    ],
+                ),
+            )
+        assert get_samples(metrics["proc_min_fault"]) == [
+            (110.0, {"pid": "10"})
+        ]
+
+    def test_apply_samples_counters_missed_evicted(
+        self, labelers_processes, make_store
+    ):
+        """Last values are dropped after the grace number of updates."""
+        handler = ProcessMetricsHandler(
+            logging.getLogger("test"),
+            pids=["10"],
+            get_process_iterator=lambda **kwargs: labelers_processes,
+            evict_grace=1,
+        )
+        metrics = MetricsRegistry().create_metrics(
+            handler.get_metric_configs()
+        )
+        for values in ([100], [], [], [110]):
+            handler.apply_samples(
+                metrics,
+                make_store(
+                    metrics,
+                    [
+                        (10, ("10",), dict.fromkeys(metrics, value), 1)
+                        for value in values
+                    ],
+                ),
+            )
+        assert get_samples(metrics["proc_min_fault"]) == [
+            (110.0, {"pid": "10"})
+        ]
+        assert handler._counters_missed == {}
+
+    def test_discovery_events(self, monkeypatch, labelers_processes):
+        """With events discovery, the proc connector is used."""
+        calls = []
+
+        def get_process_iterator(**kwargs):
+            calls.append(kwargs["discovery"])
+            return labelers_processes
+
+        handler = ProcessMetricsHandler(
+            logging.getLogger("test"),
+            cmdline_regexps=[re.compile("foo")],
+            get_process_iterator=get_process_iterator,
+            discovery="events",
+        )
+        monkeypatch.setattr(
+            "process_stats_exporter.metrics.ProcConnectorDiscovery",
+            lambda: "connector",
+        )
+        handler.collect()
+        handler.collect()
+        assert calls == ["connector", "connector"]
+
+    def test_discovery_events_fallback(
+        self, caplog, monkeypatch, labelers_processes
+    ):
+        """If events are not available, /proc is scanned."""
+        calls = []
+
+        def get_process_iterator(**kwargs):
+            calls.append(kwargs["discovery"])
+            return labelers_processes
+
+        handler = ProcessMetricsHandler(
+            logging.getLogger("test"),
+            cmdline_regexps=[re.compile("foo")],
+            get_process_iterator=get_process_iterator,
+            discovery="events",
+        )
+
+        def connector_discovery():
+            raise PermissionError("not permitted")
+
+        monkeypatch.setattr(
+            "process_stats_exporter.metrics.ProcConnectorDiscovery",
+            connector_discovery,
+        )
+        handler.collect()
+        handler.collect()
+        assert calls == [None, None]
+        assert caplog.messages == [
+            "process events not available (not permitted), "
+            "scanning /proc instead"
+        ]
+
+    def test_aggregate_disabled(self, handler, make_store):
+        """Samples are returned unchanged if aggregation is not enabled."""
+        samples = make_store([])
+        assert handler.aggregate(samples) is samples
+
+    def test_aggregate(self, labelers_processes, make_store):
+        """Samples are aggregated by labels if aggregation is enabled."""
+        handler = ProcessMetricsHandler(
+            logging.getLogger("test"),
+            cmdline_regexps=[re.compile("foo")],
+            get_process_iterator=lambda **kwargs: labelers_processes,
+            aggregate="sum",
+        )
+        samples = make_store(
+            handler._value_names,
+            [
+                (pid, ("foo",), dict.fromkeys(handler._value_names, 1))
+                for pid in (10, 20)
+            ],
+        )
+        store = handler.aggregate(samples)
+        assert store.labels == [("foo",)]
+        assert store.columns["proc_mem_rss"] == array("d", [2])
+        assert store.columns["proc_count"] == array("d", [2])
+
+    def test_aggregate_descendants(self, labelers_processes, make_store):
+        """With descendants, samples are summed by default."""
+        handler = ProcessMetricsHandler(
+            logging.getLogger("test"),
+            pids=["10"],
+            descendants=True,
+            get_process_iterator=lambda **kwargs: labelers_processes,
+        )
+        assert "proc_count" in handler._metric_names
+        samples = make_store(
+            handler._value_names,
+            [
+                (pid, ("10",), dict.fromkeys(handler._value_names, 1))
+                for pid in (10, 20)
+            ],
+        )
+        store = handler.aggregate(samples)
+        assert store.labels == [("10",)]
+        assert store.columns["proc_mem_rss"] == array("d", [2])
+        assert store.columns["proc_count"] == array("d", [2])
+
+    def test_aggregate_descendants_function(self, labelers_processes):
+        """With descendants, the aggregation function is used if set."""
+        handler = ProcessMetricsHandler(
+            logging.getLogger("test"),
+            pids=["10"],
+            descendants=True,
+            aggregate="max",
+            get_process_iterator=lambda **kwargs: labelers_processes,
+        )
+        assert handler._aggregate_function == "max"
+
+    def test_reconfigure_descendants(self, handler):
+        """Metric configs change if descendants are included or not."""
+        assert handler._aggregator is None
+        assert handler.reconfigure(pids=["10", "20"], descendants=True)
+        assert handler._aggregator is not None
+        assert "proc_count" in handler._metric_names
+        assert not handler.reconfigure(pids=["10"], descendants=True)
+        assert handler.reconfigure(pids=["10"])
+        assert handler._aggregator is None
+
+    def test_apply_samples_aggregate(self, labelers_processes, make_store):
+        """With aggregation, metrics are reported for each set of labels."""
+        handler = ProcessMetricsHandler(
+            logging.getLogger("test"),
+            cmdline_regexps=[re.compile("foo")],
+            get_process_iterator=lambda **kwargs: labelers_processes,
+            aggregate="max",
+        )
+        metrics = MetricsRegistry().create_metrics(
+            handler.get_metric_configs()
+        )
+        for values in ((10, 20), (15, 30)):
+            handler.apply_samples(
+                metrics,
+                make_store(
+                    metrics,
+                    [
+                        (
+                            pid,
+                            ("foo",),
+                            dict.fromkeys(handler._metric_names, value),
+                            1,
+                        )
+                        for pid, value in zip((10, 20), values)
+                    ],
+                ),
+            )
+        assert get_samples(metrics["proc_min_fault"]) == [
+            (45.0, {"cmd": "foo"})
+        ]
+        assert metrics["proc_mem_rss"].labels("foo")._value.get() == 30
+        assert metrics["proc_count"].labels("foo")._value.get() == 2
+
+    def test_apply_samples_different_metrics(self, handler, make_store):
+        """Cached children are dropped if metrics change."""
+        configs = handler.get_metric_configs()
+        sample = (10, ("10",), {c.name: 1 for c in configs})
+        metrics1 = MetricsRegistry().create_metrics(configs)
+        handler.apply_samples(metrics1, make_store(metrics1, [sample]))
+        metrics2 = MetricsRegistry().create_metrics(configs)
+        handler.apply_samples(metrics2, make_store(metrics2, [sample]))
+        assert get_samples(metrics1["proc_min_fault"]) == [
+            (1.0, {"pid": "10"})
+        ]
+        assert get_samples(metrics2["proc_min_fault"]) == [
+            (1.0, {"pid": "10"})
+        ]
+
+    def test_get_exporter_metric_configs(self, handler):
+        """MetricConfigs are returned for metrics about the exporter."""
+        assert all(
+            config.name.startswith("process_stats_exporter_")
+            for config in handler.get_exporter_metric_configs()
+        )
+
+    def test_collect_stats(self, make_process_dir, labelers_processes):
+        """Stats are collected along with samples."""
+        process_10_dir = make_process_dir(10)
+        (process_10_dir / "stat").write_text(
+            " ".join(str(i) for i in range(45))
+        )
+        (process_10_dir / "task" / "10").mkdir(parents=True)
+        (process_10_dir / "task" / "10" / "stat").write_text("10 (cmd) R")
+        labelers_processes.extend(
+            [
+                (PidLabeler(), ProcfsProcess(10, process_10_dir)),
+                (PidLabeler(), ProcfsProcess(20, make_process_dir(20))),
+            ]
+        )
+        handler = ProcessMetricsHandler(
+            logging.getLogger("test"),
+            pids=["10", "20"],
+            get_process_iterator=lambda **kwargs: labelers_processes,
+        )
+        result = handler.collect()
+        assert list(result.samples.pids) == [10, 20]
+        assert result.stats.pids_matched == 2
+        assert result.stats.pids_vanished == 1
+        assert result.stats.tasks_read == 1
+        assert result.stats.files_opened == 2
+        assert set(result.stats.durations) == {"scan", "collect", "label"}
+
+    def test_update_metrics_ignore_exporter_metrics(
+        self, make_process_dir, labelers_processes, handler
+    ):
+        """Only process metrics are updated with samples."""
+        process_dir = make_process_dir(10)
+        (process_dir / "stat").write_text(" ".join(str(i) for i in range(45)))
+        (process_dir / "task").mkdir()
+        labelers_processes.append(
+            (PidLabeler(), ProcfsProcess(10, process_dir))
+        )
+        registry = MetricsRegistry()
+        metrics = registry.create_metrics(handler.get_metric_configs())
+        metrics.update(
+            registry.create_metrics(handler.get_exporter_metric_configs())
+        )
+        handler.update_metrics(metrics)
+        assert get_samples(metrics["proc_min_fault"]) == [(9.0, {"pid": "10"})]
+
+    def test_update_exporter_metrics(self, handler):
+        """Metrics about the exporter are updated from stats."""
+        metrics = MetricsRegistry().create_metrics(
+            handler.get_exporter_metric_configs()
+        )
+        stats = ScrapeStats()
+        stats.pids_scanned = 10
+        handler.update_exporter_metrics(metrics, stats)
+        metric = metrics["process_stats_exporter_pids_scanned"]
+        assert metric._value.get() == 10
+
     def test_log_empty_values(
         self, caplog, make_process_dir, handler, labelers_processes
     ):
@@ -147,7 +813,9 @@ class TestProcessMetricsHandler:
 
         process_dir = make_process_dir(10)
         (process_dir / "task").mkdir()
-        labelers_processes.extend([(PidLabeler(), Process(10, process_dir))])
+        labelers_processes.extend(
+            [(PidLabeler(), ProcfsProcess(10, process_dir))]
+        )
         metrics = MetricsRegistry().create_metrics(
             handler.get_metric_configs()
         )
@@ -156,3 +824,91 @@ class TestProcessMetricsHandler:
             'empty value for metric "proc_time_system" on PID 10'
             in caplog.messages
         )
+
+    def test_collect_workers(self, make_process_dir, labelers_processes):
+        """Stats can be read in worker processes."""
+        process_dir = make_process_dir(10)
+        (process_dir / "stat").write_text(" ".join(str(i) for i in range(45)))
+        (process_dir / "task" / "10").mkdir(parents=True)
+        (process_dir / "task" / "10" / "stat").write_text("10 (cmd) R")
+        labelers_processes.append(
+            (PidLabeler(), ProcfsProcess(10, process_dir))
+        )
+        handler = ProcessMetricsHandler(
+            logging.getLogger("test"),
+            pids=["10"],
+            get_process_iterator=lambda **kwargs: labelers_processes,
+            collect_workers=2,
+        )
+        try:
+            result = handler.collect()
+        finally:
+            handler.shutdown()
+        samples = result.samples
+        assert list(samples.pids) == [10]
+        assert samples.starttime(0) == 21
+        assert samples.columns["proc_min_fault"] == array("d", [9])
+        assert samples.columns["proc_tasks_count"] == array("d", [1])
+        assert result.stats.tasks_read == 1
+        assert result.stats.files_opened == 2
+
+    def test_reconfigure_options(self):
+        """Current reconfigure options are returned."""
+        regexp = re.compile("foo")
+        handler = ProcessMetricsHandler(
+            logging.getLogger("test"),
+            cmdline_regexps=[regexp],
+            labels={"env": "prod"},
+            stat_groups=["fd"],
+        )
+        assert handler.reconfigure_options() == {
+            "pids": [],
+            "cmdline_regexps": [regexp],
+            "labels": {"env": "prod"},
+            "cgroups": [],
+            "pidfiles": [],
+            "units": [],
+            "descendants": False,
+            "stat_groups": ("fd",),
+        }
+
+    def test_worker_options(self):
+        """Worker options can be pickled after metrics are updated."""
+        handler = ProcessMetricsHandler(
+            logging.getLogger("test"), pids=[os.getpid()], evict_grace=2
+        )
+        handler.update_metrics(
+            MetricsRegistry().create_metrics(handler.get_metric_configs())
+        )
+        options = pickle.loads(pickle.dumps(handler.worker_options()))
+        worker_handler = ProcessMetricsHandler(**options)
+        assert worker_handler.reconfigure_options() == (
+            handler.reconfigure_options()
+        )
+        assert worker_handler._evict_grace == 2
+        samples = worker_handler.collect().samples
+        assert list(samples.pids) == [os.getpid()]
+
+    def test_shutdown(self, monkeypatch, labelers_processes):
+        """Discovery is closed on shutdown."""
+        closed = []
+
+        class FakeDiscovery:
+            def close(self):
+                closed.append(True)
+
+        discovery = FakeDiscovery()
+        monkeypatch.setattr(
+            "process_stats_exporter.metrics.ProcConnectorDiscovery",
+            lambda: discovery,
+        )
+        handler = ProcessMetricsHandler(
+            logging.getLogger("test"),
+            cmdline_regexps=[re.compile("foo")],
+            get_process_iterator=lambda **kwargs: labelers_processes,
+            discovery="events",
+        )
+        handler.collect()
+        handler.shutdown()
+        assert closed == [True]
+        assert handler._discovery is None
@@ -0,0 +1,125 @@
+import re
+
+import pytest
+
+from process_stats_exporter.prefilter import (
+    get_prefilter,
+    literals_regexp,
+    RegexpPrefilter,
+    required_literals,
+)
+
+
+class TestRequiredLiterals:
+    @pytest.mark.parametrize(
+        "pattern,literals",
+        [
+            ("foo", {"foo"}),
+            (r"foo\.bar", {"foo.bar"}),
+            (r"^/usr/bin/(?P<exe>python3?)\b", {"/usr/bin/python"}),
+            (r"ab\d+longer", {"longer"}),
+            ("(foo|bar)baz", {"baz"}),
+            ("(foo|bar)", {"foo", "bar"}),
+            ("(?:nginx|apache): (master|worker)", {"master", "worker"}),
+            ("(abc)+d", {"abc"}),
+            ("x(?i:abc)yz", {"yz"}),
+        ],
+    )
+    def test_literals(self, pattern, literals):
+        """Literals required to match regexps are returned."""
+        assert required_literals(re.compile(pattern)) == literals
+
+    @pytest.mark.parametrize(
+        "pattern",
+        [".*", r"\d+", "(abc)*", "foo|.*", "(?i)foo", "[ab]"],
+    )
+    def test_no_literals(self, pattern):
+        """If no literal is required, None is returned."""
+        assert required_literals(re.compile(pattern)) is None
+
+    def test_bytes(self):
+        """Literals are not extracted from bytes regexps."""
+        assert required_literals(re.compile(b"foo")) is None
+
+
+class TestLiteralsRegexp:
+    def test_regexp(self):
+        """Literals are arranged in a trie."""
+        assert (
+            literals_regexp(["foo", "foobar", "fob", "bar"])
+            == "(?:bar|fo(?:b|o(?:bar)?))"
+        )
+
+    def test_longest(self):
+        """The longest literal at a position is matched."""
+        regexp = re.compile(literals_regexp(["foo", "foobar", "a.b"]))
+        assert regexp.match("foobarbaz").group() == "foobar"
+        assert regexp.match("a.b").group() == "a.b"
+        assert regexp.match("axb") is None
+
+
+class TestRegexpPrefilter:
+    def test_candidates(self):
+        """Indexes of regexps with literals found are returned."""
+        prefilter = RegexpPrefilter(
+            [re.compile("foo"), re.compile("bar"), re.compile("baz")]
+        )
+        assert prefilter.candidates("foo baz") == [0, 2]
+
+    def test_candidates_none(self):
+        """If no literal is found, no index is returned."""
+        prefilter = RegexpPrefilter([re.compile("foo"), re.compile("bar")])
+        assert prefilter.candidates("baz") == []
+
+    def test_candidates_always(self):
+        """Regexps not requiring literals are always candidates."""
+        prefilter = RegexpPrefilter([re.compile("foo"), re.compile(r"\d")])
+        assert prefilter.candidates("foo") == [0, 1]
+        assert prefilter.candidates("bar") == [1]
+
+    def test_candidates_no_literals(self):
+        """If no regexp requires literals, all are candidates."""
+        prefilter = RegexpPrefilter([re.compile(".*"), re.compile(r"\d")])
+        assert prefilter.candidates("foo") == [0, 1]
+
+    def test_candidates_prefix(self):
+        """Regexps for literals that are prefixes of others are returned."""
+        prefilter = RegexpPrefilter(
+            [re.compile("foobar"), re.compile("foo"), re.compile("oob")]
+        )
+        assert prefilter.candidates("foobar") == [0, 1, 2]
+        assert prefilter.candidates("foob") == [1, 2]
+
+    def test_candidates_match(self):
+        """All regexps that match a string are candidates."""
+        regexps = [
+            re.compile(pattern)
+            for pattern in (
+                r"^/usr/bin/(?P<exe>python3?)\b",
+                r"(?P<exe>nginx|apache2): (master|worker)",
+                r"--id (?P<id>\d+)",
+                r"java .*-jar (?P<jar>\S+)",
+            )
+        ]
+        prefilter = RegexpPrefilter(regexps)
+        for text in (
+            "/usr/bin/python3 app.py --id 10",
+            "nginx: worker process",
+            "apache2: master",
+            "java -Xmx1g -jar app.jar",
+            "/usr/bin/python",
+            "bash",
+        ):
+            candidates = prefilter.candidates(text)
+            assert all(
+                idx in candidates
+                for idx, regexp in enumerate(regexps)
+                if regexp.search(text)
+            )
+
+
+class TestGetPrefilter:
+    def test_cached(self):
+        """Prefilters are reused for the same regexps."""
+        regexps = (re.compile("foo"), re.compile("bar"))
+        assert get_prefilter(regexps) is get_prefilter(regexps)
@@ -1,10 +1,30 @@
 import re
+import shutil
 
+import pytest
+
+from process_stats_exporter.discovery import (
+    ProcessChanges,
+    ProcessDiscovery,
+)
+from process_stats_exporter.instrument import ScrapeStats
 from process_stats_exporter.label import (
     CmdlineLabeler,
     PidLabeler,
+    StaticLabeler,
+)
+from process_stats_exporter.process import (
+    build_children_index,
+    CachedProcess,
+    get_process_iterator,
+    ProcessCache,
+    read_cgroup_pids,
+    read_cmd,
+    read_comm_starttime,
+    read_pidfile,
+    read_ppid,
+    SelectorCache,
 )
-from process_stats_exporter.process import get_process_iterator
 
 
 class TestGetProcessIterator:
@@ -37,6 +57,17 @@ class TestGetProcessIterator:
             assert isinstance(labeler, CmdlineLabeler)
         assert sorted(process.pid for process in processes) == [10, 30]
 
+    def test_process_iterator_cmdline_regexps_literals(
+        self, proc_dir, make_process_dir
+    ):
+        """Processes containing literals for regexps are fully matched."""
+        (make_process_dir(10) / "cmdline").write_text("foo\x00--id\x001\x00")
+        (make_process_dir(20) / "cmdline").write_text("foo\x00--id\x00x\x00")
+        iterator = get_process_iterator(
+            proc=proc_dir, cmdline_regexps=[re.compile(r"foo --id \d")]
+        )
+        assert [process.pid for _, process in iterator] == [10]
+
     def test_process_iterator_cmdline_regexps_matches_args(
         self, proc_dir, make_process_dir
     ):
@@ -49,6 +80,756 @@ class TestGetProcessIterator:
         _, processes = zip(*iterator)
         assert [process.pid for process in processes] == [10]
 
+    def test_process_iterator_cmdline_regexps_vanished(
+        self, proc_dir, make_process_dir
+    ):
+        """Processes that disappear during the scan are skipped."""
+        make_process_dir(10)
+        iterator = get_process_iterator(
+            proc=proc_dir, cmdline_regexps=[re.compile(".*")]
+        )
+        assert list(iterator) == []
+
+    def test_process_iterator_pids_not_existing(self, proc_dir):
+        """Processes that don't exist are skipped and counted as vanished."""
+        stats = ScrapeStats()
+        iterator = get_process_iterator(proc=proc_dir, pids=[10], stats=stats)
+        assert list(iterator) == []
+        assert stats.pids_scanned == 1
+        assert stats.pids_vanished == 1
+
+    def test_process_iterator_cmdline_regexps_stats(
+        self, proc_dir, make_process_dir
+    ):
+        """Scanned processes and opened files are counted."""
+        (make_process_dir(10) / "cmdline").write_text("foo\x00")
+        process_dir = make_process_dir(20)
+        (process_dir / "cmdline").write_text("")
+        (process_dir / "comm").write_text("bar")
+        make_process_dir(30)
+        stats = ScrapeStats()
+        iterator = get_process_iterator(
+            proc=proc_dir, cmdline_regexps=[re.compile("foo")], stats=stats
+        )
+        assert len(list(iterator)) == 1
+        assert stats.pids_scanned == 3
+        assert stats.pids_vanished == 1
+        assert stats.files_opened == 3
+
     def test_process_iterator_empty(self):
         """If no args are specified, an empty iterator is returned."""
         assert list(get_process_iterator()) == []
+
+    def test_process_iterator_cmdline_regexps_grouped(
+        self, proc_dir, make_process_dir
+    ):
+        """Processes are returned for each matching regexp, in order."""
+        (make_process_dir(10) / "cmdline").write_text("foo\x00bar\x00")
+        (make_process_dir(20) / "cmdline").write_text("bar\x00")
+        regexps = [re.compile("bar"), re.compile("foo")]
+        iterator = get_process_iterator(proc=proc_dir, cmdline_regexps=regexps)
+        result = [
+            (labeler._regexp.pattern, process.pid)
+            for labeler, process in iterator
+        ]
+        assert sorted(result[:2]) == [("bar", 10), ("bar", 20)]
+        assert result[2:] == [("foo", 10)]
+
+    def test_process_iterator_cmdline_regexps_kernel_task(
+        self, proc_dir, make_process_dir
+    ):
+        """Processes without cmdline are matched on the bracketed name."""
+        process_dir = make_process_dir(10)
+        (process_dir / "cmdline").write_text("")
+        (process_dir / "comm").write_text("kthreadd\n")
+        iterator = get_process_iterator(
+            proc=proc_dir, cmdline_regexps=[re.compile(r"^\[kthread")]
+        )
+        _, processes = zip(*iterator)
+        assert [process.pid for process in processes] == [10]
+
+
+@pytest.fixture
+def cgroup_root(tmp_path):
+    """A cgroup filesystem root."""
+    path = tmp_path / "cgroup"
+    path.mkdir()
+    yield path
+
+
+def make_cgroup(cgroup_root, cgroup, pids):
+    """Create a cgroup with processes."""
+    path = cgroup_root / cgroup
+    path.mkdir(parents=True)
+    (path / "cgroup.procs").write_text("".join(f"{pid}\n" for pid in pids))
+    return path
+
+
+class TestGetProcessIteratorCgroups:
+    def test_cgroups(self, proc_dir, cgroup_root):
+        """Processes in cgroups are returned, labeled with the cgroup."""
+        make_cgroup(cgroup_root, "system.slice/foo.service", [10, 20])
+        make_cgroup(cgroup_root, "system.slice/bar.service", [30])
+        stats = ScrapeStats()
+        iterator = get_process_iterator(
+            proc=proc_dir,
+            cgroups=["system.slice/foo.service", "/system.slice/bar.service"],
+            cgroup_root=str(cgroup_root),
+            stats=stats,
+        )
+        result = [
+            (labeler(process), process.pid) for labeler, process in iterator
+        ]
+        assert result == [
+            ({"cgroup": "system.slice/foo.service"}, 10),
+            ({"cgroup": "system.slice/foo.service"}, 20),
+            ({"cgroup": "system.slice/bar.service"}, 30),
+        ]
+        assert stats.pids_scanned == 3
+        assert stats.files_opened == 2
+
+    def test_glob(self, proc_dir, cgroup_root):
+        """Cgroups can be matched with glob patterns, each only once."""
+        make_cgroup(cgroup_root, "system.slice/foo.service", [10])
+        make_cgroup(cgroup_root, "system.slice/bar.service", [20])
+        make_cgroup(cgroup_root, "user.slice/baz.service", [30])
+        iterator = get_process_iterator(
+            proc=proc_dir,
+            cgroups=["system.slice/*.service", "system.slice/foo.*"],
+            cgroup_root=str(cgroup_root),
+        )
+        assert [process.pid for _, process in iterator] == [20, 10]
+
+    def test_no_procs(self, proc_dir, cgroup_root):
+        """Paths without a cgroup.procs file are skipped."""
+        (cgroup_root / "foo").mkdir()
+        iterator = get_process_iterator(
+            proc=proc_dir, cgroups=["foo"], cgroup_root=str(cgroup_root)
+        )
+        assert list(iterator) == []
+
+
+class TestGetProcessIteratorSelectors:
+    def test_pidfiles(self, tmp_path, proc_dir, make_process_dir):
+        """Processes are returned for PIDs in pidfiles."""
+        make_process_dir(10)
+        pidfile = tmp_path / "foo.pid"
+        pidfile.write_text("10\n")
+        [(labeler, process)] = get_process_iterator(
+            proc=proc_dir, pidfiles=[str(pidfile)]
+        )
+        assert process.pid == 10
+        assert labeler(process) == {"pidfile": str(pidfile)}
+
+    def test_pidfiles_no_process(self, tmp_path, proc_dir):
+        """Processes that don't exist or can't be read are skipped."""
+        pidfile = tmp_path / "foo.pid"
+        pidfile.write_text("10\n")
+        stats = ScrapeStats()
+        iterator = get_process_iterator(
+            proc=proc_dir,
+            pidfiles=[str(pidfile), str(tmp_path / "bar.pid")],
+            stats=stats,
+        )
+        assert list(iterator) == []
+        assert stats.pids_scanned == 2
+        assert stats.pids_vanished == 2
+
+    def test_units(self, proc_dir, cgroup_root):
+        """Processes are returned for systemd units."""
+        make_cgroup(cgroup_root, "system.slice/foo.service", [10, 20])
+        make_cgroup(cgroup_root, "systemd/system.slice/bar.socket", [30])
+        iterator = get_process_iterator(
+            proc=proc_dir,
+            units=["foo", "bar.socket", "baz"],
+            cgroup_root=str(cgroup_root),
+        )
+        result = [
+            (labeler(process), process.pid) for labeler, process in iterator
+        ]
+        assert result == [
+            ({"unit": "foo.service"}, 10),
+            ({"unit": "foo.service"}, 20),
+            ({"unit": "bar.socket"}, 30),
+        ]
+
+    def test_combined(self, tmp_path, proc_dir, make_process_dir):
+        """PIDs and pidfiles can be combined, cgroups are ignored."""
+        make_process_dir(10)
+        make_process_dir(20)
+        pidfile = tmp_path / "foo.pid"
+        pidfile.write_text("20")
+        iterator = get_process_iterator(
+            proc=proc_dir,
+            pids=["10"],
+            pidfiles=[str(pidfile)],
+            cgroups=["foo"],
+            selector_cache=SelectorCache(),
+        )
+        assert [process.pid for _, process in iterator] == [10, 20]
+
+
+def make_process_tree(make_process_dir, parents):
+    """Create processes with the specified parent PIDs."""
+    for pid, ppid in parents.items():
+        write_stat(make_process_dir(pid), f"cmd{pid}", 100, ppid=ppid)
+
+
+class TestGetProcessIteratorDescendants:
+    def test_descendants(self, proc_dir, make_process_dir):
+        """Descendants are returned with labels for the ancestor."""
+        make_process_tree(
+            make_process_dir, {1: 0, 10: 1, 11: 10, 12: 11, 20: 1}
+        )
+        iterator = get_process_iterator(
+            proc=proc_dir, pids=["10"], descendants=True
+        )
+        result = [
+            (labeler(process), process.pid) for labeler, process in iterator
+        ]
+        assert result == [
+            ({"pid": "10"}, 10),
+            ({"pid": "10"}, 11),
+            ({"pid": "10"}, 12),
+        ]
+
+    def test_selected_descendants(self, proc_dir, make_process_dir):
+        """Selected descendants are returned with their own labels."""
+        make_process_tree(make_process_dir, {10: 1, 11: 10, 12: 11, 13: 12})
+        stats = ScrapeStats()
+        iterator = get_process_iterator(
+            proc=proc_dir, pids=["10", "12"], descendants=True, stats=stats
+        )
+        result = [
+            (labeler(process), process.pid) for labeler, process in iterator
+        ]
+        assert result == [
+            ({"pid": "10"}, 10),
+            ({"pid": "10"}, 11),
+            ({"pid": "12"}, 12),
+            ({"pid": "12"}, 13),
+        ]
+        # stat files are read once for each process
+        assert stats.files_opened == 4
+
+    def test_no_descendants(self, proc_dir, make_process_dir):
+        """Processes without children are returned."""
+        make_process_tree(make_process_dir, {10: 1, 11: 10})
+        iterator = get_process_iterator(
+            proc=proc_dir, pids=["11"], descendants=True
+        )
+        assert [process.pid for _, process in iterator] == [11]
+
+
+class TestBuildChildrenIndex:
+    def test_index(self, proc_dir, make_process_dir):
+        """Child PIDs are returned by parent PID."""
+        make_process_tree(make_process_dir, {1: 0, 10: 1, 11: 10, 20: 1})
+        make_process_dir(30)
+        index = build_children_index(proc_dir)
+        assert {ppid: sorted(pids) for ppid, pids in index.items()} == {
+            0: [1],
+            1: [10, 20],
+            10: [11],
+        }
+
+
+class TestReadPpid:
+    def test_read(self, make_process_dir):
+        """The parent PID is read from the stat file."""
+        process_dir = make_process_dir(10)
+        write_stat(process_dir, "foo) (bar", 100, ppid=5)
+        assert read_ppid(process_dir) == 5
+
+    def test_invalid(self, make_process_dir):
+        """If the stat file is not valid, None is returned."""
+        process_dir = make_process_dir(10)
+        (process_dir / "stat").write_text("10 (foo)")
+        assert read_ppid(process_dir) is None
+
+    def test_not_existing(self, proc_dir):
+        """If the process doesn't exist, None is returned."""
+        assert read_ppid(proc_dir / "10") is None
+
+
+class TestSelectorCache:
+    def test_pidfile_cached(self, tmp_path):
+        """Pidfiles are not read again if they don't change."""
+        pidfile = tmp_path / "foo.pid"
+        pidfile.write_text("10")
+        cache = SelectorCache()
+        stats = ScrapeStats()
+        assert cache.pidfile_pid(str(pidfile), stats=stats) == 10
+        assert cache.pidfile_pid(str(pidfile), stats=stats) == 10
+        assert stats.files_opened == 1
+
+    def test_pidfile_changed(self, tmp_path):
+        """Pidfiles are read again if replaced."""
+        pidfile = tmp_path / "foo.pid"
+        pidfile.write_text("10")
+        cache = SelectorCache()
+        cache.pidfile_pid(str(pidfile))
+        new_pidfile = tmp_path / "new.pid"
+        new_pidfile.write_text("20")
+        new_pidfile.rename(pidfile)
+        assert cache.pidfile_pid(str(pidfile)) == 20
+
+    def test_pidfile_removed(self, tmp_path):
+        """None is returned if the pidfile is removed."""
+        pidfile = tmp_path / "foo.pid"
+        pidfile.write_text("10")
+        cache = SelectorCache()
+        cache.pidfile_pid(str(pidfile))
+        pidfile.unlink()
+        assert cache.pidfile_pid(str(pidfile)) is None
+
+    def test_unit_cached(self, cgroup_root):
+        """The cgroup for units is looked up only once."""
+        make_cgroup(cgroup_root, "systemd/system.slice/foo.service", [10])
+        cache = SelectorCache()
+        stats = ScrapeStats()
+        assert cache.unit_pids(cgroup_root, "foo.service", stats) == [10]
+        assert cache.unit_pids(cgroup_root, "foo.service", stats) == [10]
+        assert stats.files_opened == 2
+
+    def test_unit_moved(self, cgroup_root):
+        """The cgroup for units is looked up again if not found."""
+        path = make_cgroup(cgroup_root, "system.slice/foo.service", [10])
+        cache = SelectorCache()
+        cache.unit_pids(cgroup_root, "foo.service")
+        shutil.rmtree(path)
+        make_cgroup(cgroup_root, "systemd/system.slice/foo.service", [20])
+        assert cache.unit_pids(cgroup_root, "foo.service") == [20]
+
+    def test_unit_not_found(self, cgroup_root):
+        """If the cgroup for a unit is not found, None is returned."""
+        assert SelectorCache().unit_pids(cgroup_root, "foo.service") is None
+
+
+class TestReadPidfile:
+    def test_read(self, tmp_path):
+        """The PID is read from the pidfile."""
+        pidfile = tmp_path / "foo.pid"
+        pidfile.write_text("  10\n")
+        assert read_pidfile(pidfile) == 10
+
+    @pytest.mark.parametrize("content", ["", "foo"])
+    def test_invalid(self, tmp_path, content):
+        """If the pidfile doesn't contain a PID, None is returned."""
+        pidfile = tmp_path / "foo.pid"
+        pidfile.write_text(content)
+        assert read_pidfile(pidfile) is None
+
+    def test_not_existing(self, tmp_path):
+        """If the pidfile doesn't exist, None is returned."""
+        assert read_pidfile(tmp_path / "foo.pid") is None
+
+
+class TestReadCgroupPids:
+    def test_read(self, cgroup_root):
+        """PIDs are read from the cgroup.procs file."""
+        path = make_cgroup(cgroup_root, "foo", [10, 20])
+        assert read_cgroup_pids(path) == [10, 20]
+
+    def test_empty(self, cgroup_root):
+        """An empty list is returned for cgroups with no process."""
+        path = make_cgroup(cgroup_root, "foo", [])
+        assert read_cgroup_pids(path) == []
+
+    def test_not_existing(self, cgroup_root):
+        """If the cgroup doesn't exist, None is returned."""
+        assert read_cgroup_pids(cgroup_root / "foo") is None
+
+
+class TestReadCmd:
+    def test_cmdline(self, make_process_dir):
+        """The command line is returned with arguments space-separated."""
+        process_dir = make_process_dir(10)
+        (process_dir / "cmdline").write_text("foo\x00bar baz\x00")
+        assert read_cmd(process_dir) == "foo bar baz"
+
+    def test_kernel_task(self, make_process_dir):
+        """For kernel tasks, the name in brackets is returned."""
+        process_dir = make_process_dir(10)
+        (process_dir / "cmdline").write_text("")
+        (process_dir / "comm").write_text("kworker\n")
+        assert read_cmd(process_dir) == "[kworker]"
+
+    def test_no_comm(self, make_process_dir):
+        """If no name is available, an empty string is returned."""
+        process_dir = make_process_dir(10)
+        (process_dir / "cmdline").write_text("")
+        assert read_cmd(process_dir) == ""
+
+    def test_not_existing(self, proc_dir):
+        """If the process doesn't exist, None is returned."""
+        assert read_cmd(proc_dir / "10") is None
+
+
+def write_stat(process_dir, comm, starttime, ppid=0):
+    """Write a /proc/<pid>/stat file for a process."""
+    fields = ["S", str(ppid)] + ["0"] * 17 + [str(starttime)] + ["0"] * 24
+    (process_dir / "stat").write_text(
+        f"{process_dir.name} ({comm}) {' '.join(fields)}"
+    )
+
+
+class TestGetProcessIteratorCached:
+    def test_labels(self, proc_dir, make_process_dir):
+        """Matching processes are returned with their labels."""
+        process_dir = make_process_dir(10)
+        (process_dir / "cmdline").write_text("foo\x00bar\x00")
+        write_stat(process_dir, "foo", 100)
+        other_dir = make_process_dir(20)
+        (other_dir / "cmdline").write_text("baz\x00")
+        write_stat(other_dir, "baz", 100)
+        iterator = get_process_iterator(
+            proc=proc_dir,
+            cmdline_regexps=[re.compile("foo"), re.compile("(b.r)")],
+            cache=ProcessCache(),
+        )
+        result = [
+            (labeler(process), process.pid) for labeler, process in iterator
+        ]
+        assert result == [({"cmd": "foo"}, 10), ({"match_1": "bar"}, 10)]
+
+    def test_cached(self, proc_dir, make_process_dir):
+        """Command lines are not read again for cached processes."""
+        process_dir = make_process_dir(10)
+        (process_dir / "cmdline").write_text("foo\x00")
+        write_stat(process_dir, "foo", 100)
+        cache = ProcessCache()
+        regexps = [re.compile("(?P<name>foo|bar)")]
+        list(
+            get_process_iterator(
+                proc_dir, cmdline_regexps=regexps, cache=cache
+            )
+        )
+        (process_dir / "cmdline").write_text("bar\x00")
+        [(labeler, process)] = get_process_iterator(
+            proc_dir, cmdline_regexps=regexps, cache=cache
+        )
+        assert labeler(process) == {"name": "foo"}
+
+    def test_reused_pid(self, proc_dir, make_process_dir):
+        """If a PID is reused, the process command line is read again."""
+        process_dir = make_process_dir(10)
+        (process_dir / "cmdline").write_text("foo\x00")
+        write_stat(process_dir, "foo", 100)
+        cache = ProcessCache()
+        regexps = [re.compile("(?P<name>foo|bar)")]
+        list(
+            get_process_iterator(
+                proc_dir, cmdline_regexps=regexps, cache=cache
+            )
+        )
+        (process_dir / "cmdline").write_text("bar\x00")
+        write_stat(process_dir, "bar", 200)
+        [(labeler, process)] = get_process_iterator(
+            proc_dir, cmdline_regexps=regexps, cache=cache
+        )
+        assert labeler(process) == {"name": "bar"}
+
+    def test_evict(self, proc_dir, make_process_dir):
+        """Entries for processes that are gone are removed from the cache."""
+        for pid in (10, 20):
+            process_dir = make_process_dir(pid)
+            (process_dir / "cmdline").write_text("foo\x00")
+            write_stat(process_dir, "foo", 100)
+        cache = ProcessCache()
+        regexps = [re.compile("foo")]
+        list(
+            get_process_iterator(
+                proc_dir, cmdline_regexps=regexps, cache=cache
+            )
+        )
+        assert len(cache) == 2
+        shutil.rmtree(proc_dir / "20")
+        list(
+            get_process_iterator(
+                proc_dir, cmdline_regexps=regexps, cache=cache
+            )
+        )
+        assert len(cache) == 1
+
+    def test_not_matching_cached(self, proc_dir, make_process_dir):
+        """Processes not matching any regexp are cached too."""
+        process_dir = make_process_dir(10)
+        (process_dir / "cmdline").write_text("foo\x00")
+        write_stat(process_dir, "foo", 100)
+        cache = ProcessCache()
+        regexps = [re.compile("bar")]
+        assert (
+            list(
+                get_process_iterator(
+                    proc_dir, cmdline_regexps=regexps, cache=cache
+                )
+            )
+            == []
+        )
+        assert cache.get(10, 100) == CachedProcess(
+            starttime=100, cmd="foo", labelers=(None,), comm="foo"
+        )
+
+    def test_vanished_process(self, proc_dir, make_process_dir):
+        """Processes that disappear during the scan are skipped."""
+        process_dir = make_process_dir(10)
+        write_stat(process_dir, "foo", 100)
+        make_process_dir(20)
+        stats = ScrapeStats()
+        assert (
+            list(
+                get_process_iterator(
+                    proc_dir,
+                    cmdline_regexps=[re.compile("foo")],
+                    cache=ProcessCache(),
+                    stats=stats,
+                )
+            )
+            == []
+        )
+        assert stats.pids_scanned == 2
+        assert stats.pids_vanished == 2
+        assert stats.files_opened == 1
+
+
+class FakeDiscovery(ProcessDiscovery):
+    def __init__(self, proc):
+        super().__init__(proc)
+        self.changes = ProcessChanges(set(), set())
+
+    def _poll(self):
+        return self.changes
+
+
+def make_matching_process(make_process_dir, pid, cmd, starttime=100):
+    process_dir = make_process_dir(pid)
+    (process_dir / "cmdline").write_text(f"{cmd}\x00")
+    write_stat(process_dir, cmd, starttime)
+    return process_dir
+
+
+class TestGetProcessIteratorDiscovery:
+    def test_first_scan(self, proc_dir, make_process_dir):
+        """All processes are matched at first scan."""
+        make_matching_process(make_process_dir, 10, "foo")
+        make_matching_process(make_process_dir, 20, "bar")
+        iterator = get_process_iterator(
+            proc_dir,
+            cmdline_regexps=[re.compile("foo")],
+            cache=ProcessCache(),
+            discovery=FakeDiscovery(proc_dir),
+        )
+        [(labeler, process)] = iterator
+        assert process.pid == 10
+        assert labeler(process) == {"cmd": "foo"}
+
+    def test_only_started(self, proc_dir, make_process_dir):
+        """Only started processes and cached matching ones are read."""
+        for pid in (10, 20):
+            make_matching_process(make_process_dir, pid, "foo")
+        make_matching_process(make_process_dir, 30, "bar")
+        cache = ProcessCache()
+        discovery = FakeDiscovery(proc_dir)
+        regexps = [re.compile("foo")]
+        list(
+            get_process_iterator(
+                proc_dir,
+                cmdline_regexps=regexps,
+                cache=cache,
+                discovery=discovery,
+            )
+        )
+        make_matching_process(make_process_dir, 40, "foo")
+        discovery.changes = ProcessChanges(started={40}, exited=set())
+        stats = ScrapeStats()
+        processes = get_process_iterator(
+            proc_dir,
+            cmdline_regexps=regexps,
+            cache=cache,
+            discovery=discovery,
+            stats=stats,
+        )
+        assert [process.pid for _, process in processes] == [10, 20, 40]
+        assert stats.pids_scanned == 3
+        # stat files for all, and command line only for the new process
+        assert stats.files_opened == 4
+
+    def test_exited(self, proc_dir, make_process_dir):
+        """Exited processes are removed from the cache."""
+        for pid in (10, 20):
+            make_matching_process(make_process_dir, pid, "foo")
+        cache = ProcessCache()
+        discovery = FakeDiscovery(proc_dir)
+        regexps = [re.compile("foo")]
+        list(
+            get_process_iterator(
+                proc_dir,
+                cmdline_regexps=regexps,
+                cache=cache,
+                discovery=discovery,
+            )
+        )
+        shutil.rmtree(proc_dir / "20")
+        discovery.changes = ProcessChanges(started=set(), exited={20})
+        processes = get_process_iterator(
+            proc_dir,
+            cmdline_regexps=regexps,
+            cache=cache,
+            discovery=discovery,
+        )
+        assert [process.pid for _, process in processes] == [10]
+        assert len(cache) == 1
+
+    def test_started_again(self, proc_dir, make_process_dir):
+        """Processes reported as started are matched again."""
+        process_dir = make_matching_process(make_process_dir, 10, "foo")
+        cache = ProcessCache()
+        discovery = FakeDiscovery(proc_dir)
+        regexps = [re.compile("(?P<name>foo|bar)")]
+        list(
+            get_process_iterator(
+                proc_dir,
+                cmdline_regexps=regexps,
+                cache=cache,
+                discovery=discovery,
+            )
+        )
+        (process_dir / "cmdline").write_text("bar\x00")
+        discovery.changes = ProcessChanges(started={10}, exited=set())
+        [(labeler, process)] = get_process_iterator(
+            proc_dir,
+            cmdline_regexps=regexps,
+            cache=cache,
+            discovery=discovery,
+        )
+        assert labeler(process) == {"name": "bar"}
+
+    def test_reused_pid(self, proc_dir, make_process_dir):
+        """Cached matching processes are matched again if PID is reused."""
+        process_dir = make_matching_process(make_process_dir, 10, "foo")
+        cache = ProcessCache()
+        discovery = FakeDiscovery(proc_dir)
+        regexps = [re.compile("foo")]
+        list(
+            get_process_iterator(
+                proc_dir,
+                cmdline_regexps=regexps,
+                cache=cache,
+                discovery=discovery,
+            )
+        )
+        (process_dir / "cmdline").write_text("bar\x00")
+        write_stat(process_dir, "bar", 200)
+        processes = get_process_iterator(
+            proc_dir,
+            cmdline_regexps=regexps,
+            cache=cache,
+            discovery=discovery,
+        )
+        assert list(processes) == []
+
+    def test_changed_regexps(self, proc_dir, make_process_dir):
+        """All known processes are matched again if regexps change."""
+        for pid, cmd in ((10, "foo"), (20, "bar")):
+            make_matching_process(make_process_dir, pid, cmd)
+        cache = ProcessCache()
+        discovery = FakeDiscovery(proc_dir)
+        list(
+            get_process_iterator(
+                proc_dir,
+                cmdline_regexps=[re.compile("foo")],
+                cache=cache,
+                discovery=discovery,
+            )
+        )
+        processes = get_process_iterator(
+            proc_dir,
+            cmdline_regexps=[re.compile("bar")],
+            cache=cache,
+            discovery=discovery,
+        )
+        assert [process.pid for _, process in processes] == [20]
+
+    def test_vanished_process(self, proc_dir, make_process_dir):
+        """Processes that disappear during the scan are skipped."""
+        process_dir = make_process_dir(10)
+        write_stat(process_dir, "foo", 100)
+        make_process_dir(20)
+        stats = ScrapeStats()
+        processes = get_process_iterator(
+            proc_dir,
+            cmdline_regexps=[re.compile("foo")],
+            cache=ProcessCache(),
+            discovery=FakeDiscovery(proc_dir),
+            stats=stats,
+        )
+        assert list(processes) == []
+        assert stats.pids_vanished == 2
+
+
+class TestProcessCache:
+    def test_get_not_cached(self):
+        """If a process is not cached, None is returned."""
+        assert ProcessCache().get(10, 100) is None
+
+    def test_get_different_starttime(self):
+        """Entries are not returned if the process start time differs."""
+        cache = ProcessCache()
+        cache.add(10, CachedProcess(starttime=100, cmd="foo", labelers=()))
+        assert cache.get(10, 200) is None
+
+    def test_bind_changed_regexps(self):
+        """The cache is cleared if regexps change."""
+        cache = ProcessCache()
+        assert cache.bind([re.compile("foo")])
+        cache.add(10, CachedProcess(starttime=100, cmd="foo", labelers=()))
+        assert not cache.bind([re.compile("foo")])
+        assert len(cache) == 1
+        assert cache.bind([re.compile("bar")])
+        assert len(cache) == 0
+
+    def test_bind_kept_regexps(self):
+        """Matches for regexps that are kept are reused."""
+        cache = ProcessCache()
+        cache.bind([re.compile("foo"), re.compile("bar")])
+        labeler = StaticLabeler({"cmd": "foo"})
+        cache.add(
+            10,
+            CachedProcess(100, "foo bar", labelers=(labeler, None), comm="f"),
+        )
+        cache.add(
+            20, CachedProcess(100, "baz", labelers=(None, None), comm="baz")
+        )
+        assert not cache.bind([re.compile("baz"), re.compile("foo")])
+        entry = cache.get(10, 100)
+        assert entry.labelers == (None, labeler)
+        [baz_labeler, foo_labeler] = cache.get(20, 100).labelers
+        assert baz_labeler(None) == {"cmd": "baz"}
+        assert foo_labeler is None
+
+    def test_matching_pids(self):
+        """PIDs of processes matching any regexp are returned."""
+        cache = ProcessCache()
+        labeler = StaticLabeler({"cmd": "foo"})
+        cache.add(10, CachedProcess(100, "foo", labelers=(None, labeler)))
+        cache.add(20, CachedProcess(100, "bar", labelers=(None, None)))
+        assert cache.matching_pids() == {10}
+
+
+class TestReadCommStarttime:
+    def test_read(self, make_process_dir):
+        """The process name and start time are returned."""
+        process_dir = make_process_dir(10)
+        write_stat(process_dir, "foo (bar) baz", 1234)
+        assert read_comm_starttime(process_dir) == ("foo (bar) baz", 1234)
+
+    def test_not_existing(self, proc_dir):
+        """If the process doesn't exist, None is returned."""
+        assert read_comm_starttime(proc_dir / "10") is None
+
+    def test_invalid(self, make_process_dir):
+        """If the file content is invalid, None is returned."""
+        process_dir = make_process_dir(10)
+        (process_dir / "stat").write_text("10 (foo) S 1 2")
+        assert read_comm_starttime(process_dir) is None
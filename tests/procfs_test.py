@@ -0,0 +1,259 @@
+from textwrap import dedent
+
+import pytest
+
+from process_stats_exporter.procfs import (
+    iter_pids,
+    ProcfsProcess,
+    ProcReader,
+    STAT_FIELDS,
+    TaskStates,
+)
+
+
+@pytest.fixture
+def reader():
+    yield ProcReader(buffer_size=16)
+
+
+@pytest.fixture
+def process_path(make_process_dir):
+    yield make_process_dir(10)
+
+
+class TestProcfsProcess:
+    def test_path(self, process_path):
+        """The path of the process directory is set."""
+        process = ProcfsProcess(10, process_path)
+        assert process.pid == 10
+        assert process.path == str(process_path)
+
+
+class TestProcReader:
+    def test_read(self, reader, process_path):
+        """The content of a file is returned."""
+        (process_path / "file").write_text("some content")
+        assert reader.read(process_path / "file") == b"some content"
+
+    def test_read_count_files(self, reader, process_path):
+        """Opened files are counted."""
+        (process_path / "file").write_text("some content")
+        reader.read(process_path / "file")
+        reader.read(process_path / "file")
+        reader.read(process_path / "other")
+        assert reader.files_opened == 2
+
+    def test_read_larger_than_buffer(self, reader, process_path):
+        """Files larger than the buffer are read entirely."""
+        content = "".join(str(i) for i in range(100))
+        (process_path / "file").write_text(content)
+        assert reader.read(process_path / "file") == content.encode()
+
+    def test_read_reuse_buffer(self, reader, process_path):
+        """Reading a shorter file returns only its content."""
+        (process_path / "long").write_text("a long content")
+        (process_path / "short").write_text("short")
+        reader.read(process_path / "long")
+        assert reader.read(process_path / "short") == b"short"
+
+    def test_read_not_existing(self, reader, process_path):
+        """If the file doesn't exist, None is returned."""
+        assert reader.read(process_path / "file") is None
+
+    def test_read_error(self, reader, process_path):
+        """If the file can't be read, None is returned."""
+        assert reader.read(process_path) is None
+
+    def test_read_stat(self, reader, process_path):
+        """Fields are read from stat files."""
+        fields = " ".join(str(i) for i in range(3, 45))
+        (process_path / "stat").write_text(f"10 (some (cmd)) R {fields}")
+        assert reader.read_stat(
+            process_path / "stat", ["state", "minflt", "utime", "starttime"]
+        ) == {"state": "R", "minflt": 9, "utime": 13, "starttime": 21}
+
+    def test_read_stat_no_parens(self, reader, process_path):
+        """Fields are read if the name is not in parenthesis."""
+        (process_path / "stat").write_text(" ".join(str(i) for i in range(45)))
+        assert reader.read_stat(process_path / "stat", ["utime", "rss"]) == {
+            "utime": 13,
+            "rss": 23,
+        }
+
+    def test_read_stat_missing_fields(self, reader, process_path):
+        """Fields not in the file are None."""
+        (process_path / "stat").write_text("10 (cmd) S 1")
+        assert reader.read_stat(process_path / "stat", ["ppid", "utime"]) == {
+            "ppid": 1,
+            "utime": None,
+        }
+
+    def test_read_stat_not_existing(self, reader, process_path):
+        """If the file doesn't exist, None is returned."""
+        assert reader.read_stat(process_path / "stat", ["utime"]) is None
+
+    def test_read_status(self, reader, process_path):
+        """Values are read from status files, converted to bytes."""
+        (process_path / "status").write_text(
+            dedent(
+                """\
+                Name:\tcmd
+                VmHWM:\t    100 kB
+                VmRSS:\t     50 kB
+                Threads:\t2
+                """
+            )
+        )
+        assert reader.read_status(
+            process_path / "status", ["VmHWM", "VmRSS", "Threads", "VmPeak"]
+        ) == {"VmHWM": 102400, "VmRSS": 51200, "Threads": None, "VmPeak": None}
+
+    def test_read_status_not_existing(self, reader, process_path):
+        """If the file doesn't exist, None is returned."""
+        assert reader.read_status(process_path / "status", ["VmHWM"]) is None
+
+    def test_read_sched(self, reader, process_path):
+        """Values are read from sched files."""
+        (process_path / "sched").write_text(
+            dedent(
+                """\
+                cmd (10, #threads: 1)
+                -------------------------------------------------------
+                se.sum_exec_runtime                          :   12.345
+                se.nr_migrations                             :   3
+                nr_switches                                  :   30
+                nr_voluntary_switches                        :   20
+                nr_involuntary_switches                      :   10
+                """
+            )
+        )
+        assert reader.read_sched(
+            process_path / "sched",
+            [
+                "se.sum_exec_runtime",
+                "nr_switches",
+                "nr_involuntary_switches",
+                "nr_migrations",
+            ],
+        ) == {
+            "se.sum_exec_runtime": 12.345,
+            "nr_switches": 30,
+            "nr_involuntary_switches": 10,
+            "nr_migrations": None,
+        }
+
+    def test_read_sched_not_existing(self, reader, process_path):
+        """If the file doesn't exist, None is returned."""
+        assert (
+            reader.read_sched(process_path / "sched", ["nr_switches"]) is None
+        )
+
+    def test_read_io(self, reader, process_path):
+        """Values are read from io files."""
+        (process_path / "io").write_text(
+            dedent(
+                """\
+                rchar: 100
+                wchar: 200
+                read_bytes: 300
+                write_bytes: 400
+                cancelled_write_bytes: 0
+                """
+            )
+        )
+        assert reader.read_io(
+            process_path / "io", ["read_bytes", "write_bytes", "syscr"]
+        ) == {"read_bytes": 300, "write_bytes": 400, "syscr": None}
+
+    def test_read_io_not_existing(self, reader, process_path):
+        """If the file doesn't exist, None is returned."""
+        assert reader.read_io(process_path / "io", ["read_bytes"]) is None
+
+    def test_read_stats(self, reader, process_path):
+        """Stats are read from their files."""
+        (process_path / "stat").write_text(" ".join(str(i) for i in range(45)))
+        (process_path / "status").write_text("VmHWM: 100 kB")
+        assert reader.read_stats(
+            process_path,
+            ["stat.utime", "status.VmHWM", "stat.stime", "sched.nr_switches"],
+        ) == [13, 102400, 14, None]
+
+
+class TestCountFds:
+    def test_count(self, reader, process_path):
+        """File descriptors are counted."""
+        (process_path / "fd").mkdir()
+        for fd in range(5):
+            (process_path / "fd" / str(fd)).symlink_to("/not/existing")
+        assert reader.count_fds(process_path) == 5
+        assert reader.files_opened == 1
+
+    def test_no_fd_dir(self, reader, process_path):
+        """If the fd directory doesn't exist, None is returned."""
+        assert reader.count_fds(process_path) is None
+        assert reader.files_opened == 0
+
+
+class TestStatFields:
+    def test_fields(self):
+        """Field indexes start from the process state."""
+        assert STAT_FIELDS["state"] == 0
+        assert STAT_FIELDS["utime"] == 11
+        assert STAT_FIELDS["starttime"] == 19
+        assert STAT_FIELDS["cguest_time"] == 41
+
+
+class TestReadTaskStates:
+    def make_task(self, process_path, tid, content):
+        task_dir = process_path / "task" / str(tid)
+        task_dir.mkdir(parents=True)
+        if content is not None:
+            (task_dir / "stat").write_text(content)
+
+    def test_states(self, reader, process_path):
+        """Tasks are counted by state."""
+        self.make_task(process_path, 10, "10 (cmd) S 1 2 3")
+        self.make_task(process_path, 11, "11 (some) (cmd)) R 1 2 3")
+        self.make_task(process_path, 12, "12 (cmd) S 1 2 3")
+        self.make_task(process_path, 13, "13 (cmd) Z 1 2 3")
+        self.make_task(process_path, 14, "14 (cmd) t 1 2 3")
+        assert reader.read_task_states(process_path) == TaskStates(
+            total=5,
+            states={"R": 1, "S": 2, "D": 0, "Z": 1, "T": 0, "I": 0, "t": 1},
+        )
+        assert reader.tasks_read == 5
+        assert reader.files_opened == 5
+
+    def test_no_parens(self, reader, process_path):
+        """The state is found if the name is not in parenthesis."""
+        self.make_task(process_path, 10, "1 2 D")
+        states = reader.read_task_states(process_path)
+        assert states.states["D"] == 1
+
+    def test_unreadable_state(self, reader, process_path):
+        """Tasks whose state can't be read are only in the total count."""
+        self.make_task(process_path, 10, "10 (cmd) S 1 2 3")
+        self.make_task(process_path, 11, None)
+        self.make_task(process_path, 12, "12")
+        (process_path / "task" / "13").mkdir()
+        (process_path / "task" / "13" / "stat").mkdir()
+        states = reader.read_task_states(process_path)
+        assert states.total == 4
+        assert sum(states.states.values()) == 1
+
+    def test_no_tasks_dir(self, reader, process_path):
+        """If the tasks directory doesn't exist, None is returned."""
+        assert reader.read_task_states(process_path) is None
+
+
+class TestIterPids:
+    def test_pids(self, proc_dir, make_process_dir):
+        """PIDs for process directories are returned."""
+        make_process_dir(10)
+        make_process_dir(20)
+        (proc_dir / "self").mkdir()
+        assert sorted(iter_pids(proc_dir)) == [10, 20]
+
+    def test_not_existing(self, proc_dir):
+        """If the directory doesn't exist, no PID is returned."""
+        assert list(iter_pids(proc_dir / "not-here")) == []
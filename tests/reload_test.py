@@ -0,0 +1,256 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import logging
+import os
+
+from prometheus_aioexporter import MetricsRegistry
+import pytest
+
+from process_stats_exporter.config import ConfigFile
+from process_stats_exporter.executor import MetricsUpdater
+from process_stats_exporter.metrics import ProcessMetricsHandler
+from process_stats_exporter.reload import (
+    ConfigReloader,
+    log_config,
+)
+from process_stats_exporter.snapshot import SnapshotCollector
+
+
+@pytest.fixture
+def config_path(tmp_path):
+    path = tmp_path / "config.toml"
+    path.write_text(f"pids = [{os.getpid()}]\n")
+    yield path
+
+
+@pytest.fixture
+def config_file(config_path):
+    config_file = ConfigFile(config_path)
+    yield config_file
+
+
+@pytest.fixture
+def handler(config_file):
+    yield ProcessMetricsHandler(
+        logging.getLogger("test"), **config_file.load().handler_options()
+    )
+
+
+@pytest.fixture
+def updater(handler):
+    updater = MetricsUpdater(handler, executor=ThreadPoolExecutor())
+    yield updater
+    updater.shutdown()
+
+
+@pytest.fixture
+def registry():
+    yield MetricsRegistry()
+
+
+@pytest.fixture
+def make_reloader(config_file, handler, updater, registry):
+    def make(**kwargs):
+        return ConfigReloader(
+            config_file,
+            handler,
+            updater,
+            registry,
+            logging.getLogger("test"),
+            **kwargs,
+        )
+
+    yield make
+
+
+def metric_labels(metrics):
+    return {name: metric._labelnames for name, metric in metrics.items()}
+
+
+class TestLogConfig:
+    def test_log(self, caplog, config_file):
+        """Selected processes are logged."""
+        caplog.set_level(logging.INFO)
+        log_config(logging.getLogger("test"), config_file.load())
+        assert f"tracking stats for PIDs [{os.getpid()}]" in caplog.messages
+
+
+class TestConfigReloader:
+    def test_reload_invalid(self, caplog, config_path, make_reloader):
+        """If the config is not valid, the current one is kept."""
+        reloader = make_reloader()
+        config_path.write_text("pids = 10\n")
+        asyncio.run(reloader.reload())
+        [message] = caplog.messages
+        assert message.startswith("not reloading config:")
+
+    def test_reload_unchanged_metrics(
+        self, caplog, handler, registry, make_reloader
+    ):
+        """Metrics are kept if labels and stats didn't change."""
+        caplog.set_level(logging.INFO)
+        metrics = registry.create_metrics(handler.get_metric_configs())
+        reloader = make_reloader(metrics=metrics)
+        asyncio.run(reloader.reload())
+        assert reloader.metrics is metrics
+        assert caplog.messages[0].startswith("reloading config from ")
+        assert "metric labels or stats changed" not in caplog.text
+
+    def test_reload_selectors(self, config_path, handler, make_reloader):
+        """Changed selectors are applied to the handler."""
+        reloader = make_reloader()
+        config_path.write_text("pids = [1]\n")
+        asyncio.run(reloader.reload())
+        assert handler._pids == [1]
+
+    def test_reload_recreate_metrics(
+        self, caplog, config_path, handler, registry, make_reloader
+    ):
+        """Metrics are unregistered and created again if labels change."""
+        caplog.set_level(logging.INFO)
+        metrics = registry.create_metrics(handler.get_metric_configs())
+        reloader = make_reloader(metrics=metrics)
+        config_path.write_text(
+            f'pids = [{os.getpid()}]\nlabels = {{env = "prod"}}\n'
+        )
+        asyncio.run(reloader.reload())
+        assert "metric labels or stats changed, recreating metrics" in (
+            caplog.messages
+        )
+        assert reloader.metrics.keys() == metrics.keys()
+        assert all(
+            "env" in labels
+            for labels in metric_labels(reloader.metrics).values()
+        )
+        assert registry.get_metrics() == reloader.metrics
+        collectors = registry.registry._collector_to_names
+        assert not any(metric in collectors for metric in metrics.values())
+        assert all(
+            metric in collectors for metric in reloader.metrics.values()
+        )
+
+    def test_reload_recreate_metrics_stats(
+        self, config_path, handler, registry, make_reloader
+    ):
+        """Metrics are created again if stats change."""
+        metrics = registry.create_metrics(handler.get_metric_configs())
+        reloader = make_reloader(metrics=metrics)
+        config_path.write_text(f'pids = [{os.getpid()}]\nstats = ["fd"]\n')
+        asyncio.run(reloader.reload())
+        assert reloader.metrics.keys() == {
+            config.name for config in handler.get_metric_configs()
+        }
+        assert reloader.metrics.keys() != metrics.keys()
+
+    def test_reload_snapshot(self, config_path, handler, make_reloader):
+        """With snapshots, metric configs are updated in the collector."""
+        collector = SnapshotCollector(handler.get_metric_configs())
+        reloader = make_reloader(snapshot_collector=collector)
+        config_path.write_text(
+            f'pids = [{os.getpid()}]\nlabels = {{env = "prod"}}\n'
+        )
+        asyncio.run(reloader.reload())
+        assert reloader.metrics == {}
+        assert all(
+            "env" in config.config["labels"]
+            for config in collector._metric_configs
+        )
+
+    def test_schedule_reload(self, caplog, make_reloader):
+        """A reload is not scheduled while one is running."""
+        caplog.set_level(logging.INFO)
+        reloader = make_reloader()
+
+        async def reload():
+            reloader.schedule_reload()
+            task = reloader._reload_task
+            reloader.schedule_reload()
+            assert reloader._reload_task is task
+            await task
+            reloader.schedule_reload()
+            assert reloader._reload_task is not task
+            await reloader._reload_task
+
+        asyncio.run(reload())
+        reloads = [
+            message
+            for message in caplog.messages
+            if message.startswith("reloading config from ")
+        ]
+        assert len(reloads) == 2
+
+    def test_watch(self, config_path, config_file, handler, make_reloader):
+        """The config is reloaded when the file changes."""
+        config_file.load()
+        reloader = make_reloader(check_interval=0.01)
+
+        async def watch():
+            reloader.start()
+            await asyncio.sleep(0.05)
+            assert handler._pids == [os.getpid()]
+            config_path.write_text("pids = [1, 2]\n")
+            await asyncio.sleep(0.05)
+            reloader.stop()
+
+        asyncio.run(watch())
+        assert handler._pids == [1, 2]
+
+    def test_watch_reload_running(
+        self, monkeypatch, config_path, config_file, updater, make_reloader
+    ):
+        """Reloads for file changes don't run along with other ones."""
+        config_file.load()
+        reloader = make_reloader(check_interval=0.01)
+        running = []
+        max_running = []
+        reconfigure = updater.reconfigure
+
+        async def slow_reconfigure(func):
+            running.append(True)
+            max_running.append(len(running))
+            await asyncio.sleep(0.05)
+            running.pop()
+            return await reconfigure(func)
+
+        monkeypatch.setattr(updater, "reconfigure", slow_reconfigure)
+
+        async def watch():
+            reloader.schedule_reload()
+            reloader.start()
+            await asyncio.sleep(0.01)
+            config_path.write_text("pids = [1, 2]\n")
+            await asyncio.sleep(0.15)
+            reloader.stop()
+
+        asyncio.run(watch())
+        assert max_running == [1, 1]
+
+    def test_start_no_interval(self, make_reloader):
+        """The file is not watched without a check interval."""
+        reloader = make_reloader()
+
+        async def start():
+            reloader.start()
+            assert reloader._watch_task is None
+            reloader.stop()
+
+        asyncio.run(start())
+
+    def test_stop(self, make_reloader):
+        """Stopping cancels watching and running reloads."""
+        reloader = make_reloader(check_interval=10)
+
+        async def stop():
+            reloader.start()
+            reloader.schedule_reload()
+            watch_task, reload_task = (
+                reloader._watch_task,
+                reloader._reload_task,
+            )
+            reloader.stop()
+            await asyncio.sleep(0)
+            return watch_task, reload_task
+
+        watch_task, reload_task = asyncio.run(stop())
+        assert watch_task.cancelled()
+        assert reload_task.cancelled()
@@ -0,0 +1,87 @@
+from array import array
+import math
+
+from process_stats_exporter.sample import (
+    column_value,
+    SampleStore,
+)
+
+
+class TestSampleStore:
+    def test_append(self):
+        """Values for a process are added to columns."""
+        store = SampleStore(["foo", "bar"])
+        store.append(10, {"foo": 1, "bar": None}, 100)
+        store.append(20, {"foo": 2, "bar": 3})
+        assert len(store) == 2
+        assert store.pids == array("q", [10, 20])
+        assert store.columns["foo"] == array("d", [1, 2])
+        assert math.isnan(store.columns["bar"][0])
+        assert store.columns["bar"][1] == 3
+        assert store.starttime(0) == 100
+        assert store.starttime(1) is None
+
+    def test_add_process(self):
+        """A process is added without values, appended then to columns."""
+        store = SampleStore(["foo"])
+        store.add_process(10, 100)
+        store.add_process(20)
+        assert store.pids == array("q", [10, 20])
+        assert store.starttime(0) == 100
+        assert store.starttime(1) is None
+        assert store.columns["foo"] == array("d")
+
+    def test_set_starttime(self):
+        """The start time is set for the last added process."""
+        store = SampleStore(["foo"])
+        store.add_process(10, 100)
+        store.add_process(20)
+        store.set_starttime(200)
+        assert store.starttimes == array("q", [100, 200])
+        store.set_starttime(None)
+        assert store.starttime(1) is None
+
+    def test_extend(self):
+        """Processes and values are added from another store."""
+        store = SampleStore(["foo", "bar"])
+        store.append(10, {"foo": 1, "bar": 2}, 100)
+        other = SampleStore(["foo", "bar"])
+        other.append(20, {"foo": 3, "bar": None})
+        other.labels.append(("a",))
+        store.extend(other)
+        assert store.pids == array("q", [10, 20])
+        assert store.starttime(0) == 100
+        assert store.starttime(1) is None
+        assert store.columns["foo"] == array("d", [1, 3])
+        assert math.isnan(store.columns["bar"][1])
+        assert store.labels == []
+
+    def test_is_empty(self):
+        """A process is empty if all its values are empty."""
+        store = SampleStore(["foo", "bar"])
+        store.append(10, {"foo": 1, "bar": None})
+        store.append(20, {"foo": None, "bar": None})
+        assert not store.is_empty(0)
+        assert store.is_empty(1)
+
+    def test_replace_columns(self):
+        """A store with replaced columns shares other data."""
+        store = SampleStore(["foo", "bar"])
+        store.append(10, {"foo": 1, "bar": 2})
+        store.labels.append(("a",))
+        new_store = store.replace_columns({"foo": array("d", [5])})
+        assert new_store.columns["foo"] == array("d", [5])
+        assert new_store.columns["bar"] is store.columns["bar"]
+        assert new_store.pids is store.pids
+        assert new_store.labels is store.labels
+        assert store.columns["foo"] == array("d", [1])
+
+
+class TestColumnValue:
+    def test_value(self):
+        """Values are returned as is."""
+        assert column_value(3) == 3
+
+    def test_empty(self):
+        """Empty values are NaN."""
+        assert math.isnan(column_value(None))
@@ -0,0 +1,105 @@
+from array import array
+import math
+
+import pytest
+
+from process_stats_exporter.procfs import ProcfsProcess
+from process_stats_exporter.sample import SampleStore
+from process_stats_exporter.shard import (
+    read_shard,
+    ShardedStatsReader,
+)
+from process_stats_exporter.stats import ProcessStatsCollector
+
+
+@pytest.fixture
+def make_stat_process(make_process_dir):
+    """Return a function to create a process with a stat file."""
+
+    def create(pid):
+        process_dir = make_process_dir(pid)
+        (process_dir / "stat").write_text(
+            " ".join(str(pid + i) for i in range(45))
+        )
+        return ProcfsProcess(pid, process_dir)
+
+    yield create
+
+
+@pytest.fixture
+def reader():
+    reader = ShardedStatsReader(2)
+    yield reader
+    reader.shutdown()
+
+
+def make_store():
+    """Return a store for metrics from the stat group."""
+    return SampleStore(
+        config.name
+        for config in ProcessStatsCollector(groups=["stat"]).metrics()
+    )
+
+
+class TestShardedStatsReader:
+    def test_read(self, make_stat_process, reader):
+        """Values are added to the store for processes in order."""
+        processes = [make_stat_process(pid) for pid in range(100, 1100, 100)]
+        store = make_store()
+        reader.read(("stat",), processes, store)
+        assert store.pids == array("q", range(100, 1100, 100))
+        assert store.starttimes == array(
+            "q", [pid + 21 for pid in range(100, 1100, 100)]
+        )
+        assert store.columns["proc_min_fault"] == array(
+            "d", [pid + 9 for pid in range(100, 1100, 100)]
+        )
+        assert reader.files_opened == 10
+        assert reader.tasks_read == 0
+
+    def test_read_no_starttime(self, make_stat_process, reader):
+        """Start time is not read without stats from the stat file."""
+        store = SampleStore(["proc_fd_count"])
+        reader.read(("fd",), [make_stat_process(10)], store)
+        assert store.starttime(0) is None
+        assert math.isnan(store.columns["proc_fd_count"][0])
+        assert reader.files_opened == 0
+
+    def test_read_empty(self, reader):
+        """No worker pool is created if there are no processes."""
+        store = make_store()
+        reader.read(("stat",), [], store)
+        assert len(store) == 0
+        assert reader._executor is None
+
+    def test_shutdown(self, make_stat_process, reader):
+        """The worker pool is shut down."""
+        reader.read(("stat",), [make_stat_process(10)], make_store())
+        reader.shutdown()
+        assert reader._executor is None
+
+
+class TestReadShard:
+    def test_read(self, make_process_dir):
+        """Values for a shard are returned in a store."""
+        process_dir = make_process_dir(10)
+        (process_dir / "stat").write_text(" ".join(str(i) for i in range(45)))
+        (process_dir / "task" / "10").mkdir(parents=True)
+        (process_dir / "task" / "10" / "stat").write_text("10 (cmd) R")
+        result = read_shard(("stat", "tasks"), [(10, str(process_dir))])
+        store = result.samples
+        assert store.pids == array("q", [10])
+        assert store.starttimes == array("q", [21])
+        assert store.columns["proc_min_fault"] == array("d", [9])
+        assert store.columns["proc_tasks_count"] == array("d", [1])
+        assert store.columns["proc_tasks_state_running"] == array("d", [1])
+        assert result.files_opened == 2
+        assert result.tasks_read == 1
+
+    def test_read_missing(self, make_process_dir):
+        """Empty values are stored as NaN."""
+        process_dir = make_process_dir(10)
+        store = read_shard(("stat",), [(10, str(process_dir))]).samples
+        assert store.starttime(0) is None
+        assert len(store.columns) == 5
+        assert all(math.isnan(column[0]) for column in store.columns.values())
@@ -0,0 +1,169 @@
+from prometheus_aioexporter import MetricConfig
+from prometheus_client import (
+    CollectorRegistry,
+    generate_latest,
+)
+import pytest
+
+from process_stats_exporter.snapshot import (
+    build_families,
+    Snapshot,
+    SnapshotCollector,
+)
+
+METRIC_CONFIGS = [
+    MetricConfig("proc_time", "Time", "counter", {"labels": ["pid"]}),
+    MetricConfig("proc_mem", "Memory", "gauge", {"labels": ["pid"]}),
+]
+METRIC_NAMES = ["proc_time", "proc_mem"]
+
+
+class FakeClock:
+    def __init__(self):
+        self.time = 1000.0
+
+    def __call__(self):
+        return self.time
+
+
+@pytest.fixture
+def clock():
+    yield FakeClock()
+
+
+@pytest.fixture
+def collector(clock):
+    yield SnapshotCollector(METRIC_CONFIGS, clock=clock)
+
+
+def get_samples(families):
+    return [
+        (sample.name, sample.labels, sample.value)
+        for family in families
+        for sample in family.samples
+    ]
+
+
+class TestBuildFamilies:
+    def test_families(self, make_store):
+        """Metric families are built with values from samples."""
+        families = build_families(
+            METRIC_CONFIGS,
+            make_store(
+                METRIC_NAMES,
+                [
+                    (10, ("10",), {"proc_time": 3, "proc_mem": 100}),
+                    (20, ("20",), {"proc_time": 5, "proc_mem": 200}),
+                ],
+            ),
+        )
+        assert [(family.name, family.type) for family in families] == [
+            ("proc_time", "counter"),
+            ("proc_mem", "gauge"),
+        ]
+        assert get_samples(families) == [
+            ("proc_time_total", {"pid": "10"}, 3),
+            ("proc_time_total", {"pid": "20"}, 5),
+            ("proc_mem", {"pid": "10"}, 100),
+            ("proc_mem", {"pid": "20"}, 200),
+        ]
+
+    def test_same_labels(self, make_store):
+        """Counters are summed for samples with the same labels."""
+        families = build_families(
+            METRIC_CONFIGS,
+            make_store(
+                METRIC_NAMES,
+                [
+                    (10, ("x",), {"proc_time": 3, "proc_mem": 100}),
+                    (20, ("x",), {"proc_time": 5, "proc_mem": 200}),
+                ],
+            ),
+        )
+        assert get_samples(families) == [
+            ("proc_time_total", {"pid": "x"}, 8),
+            ("proc_mem", {"pid": "x"}, 200),
+        ]
+
+    def test_skip_empty_values(self, make_store):
+        """Empty values are skipped."""
+        families = build_families(
+            METRIC_CONFIGS,
+            make_store(
+                METRIC_NAMES,
+                [
+                    (10, ("10",), {"proc_time": None, "proc_mem": 100}),
+                ],
+            ),
+        )
+        assert get_samples(families) == [("proc_mem", {"pid": "10"}, 100)]
+
+
+class TestSnapshotCollector:
+    def test_no_snapshot(self, collector):
+        """If no snapshot has been taken, no metrics are returned."""
+        assert collector.snapshot is None
+        assert list(collector.collect()) == []
+
+    def test_update(self, collector, make_store):
+        """A snapshot is built from samples."""
+        collector.update(
+            make_store(
+                METRIC_NAMES, [(10, ("10",), {"proc_time": 3, "proc_mem": 1})]
+            )
+        )
+        snapshot = collector.snapshot
+        assert isinstance(snapshot, Snapshot)
+        assert snapshot.timestamp == 1000.0
+        assert get_samples(snapshot.families) == [
+            ("proc_time_total", {"pid": "10"}, 3),
+            ("proc_mem", {"pid": "10"}, 1),
+        ]
+
+    def test_set_metric_configs(self, collector, make_store):
+        """Metric configs are replaced for the next update."""
+        collector.set_metric_configs(METRIC_CONFIGS[1:])
+        collector.update(
+            make_store(
+                METRIC_NAMES, [(10, ("10",), {"proc_time": 3, "proc_mem": 1})]
+            )
+        )
+        assert get_samples(collector.snapshot.families) == [
+            ("proc_mem", {"pid": "10"}, 1),
+        ]
+
+    def test_collect(self, collector, clock, make_store):
+        """Metrics from the snapshot are returned, along with its age."""
+        collector.update(
+            make_store(
+                METRIC_NAMES, [(10, ("10",), {"proc_time": 3, "proc_mem": 1})]
+            )
+        )
+        clock.time += 5.0
+        assert get_samples(collector.collect()) == [
+            ("proc_time_total", {"pid": "10"}, 3),
+            ("proc_mem", {"pid": "10"}, 1),
+            ("process_stats_exporter_snapshot_age_seconds", {}, 5.0),
+        ]
+
+    def test_describe(self, collector):
+        """Metrics are described without samples."""
+        assert [family.name for family in collector.describe()] == [
+            "proc_time",
+            "proc_mem",
+            "process_stats_exporter_snapshot_age_seconds",
+        ]
+        assert get_samples(collector.describe()) == []
+
+    def test_register(self, collector, make_store):
+        """The collector can be registered and its metrics exposed."""
+        registry = CollectorRegistry(auto_describe=True)
+        registry.register(collector)
+        collector.update(
+            make_store(
+                METRIC_NAMES, [(10, ("10",), {"proc_time": 3, "proc_mem": 1})]
+            )
+        )
+        output = generate_latest(registry).decode()
+        assert 'proc_mem{pid="10"} 1.0' in output
+        assert 'proc_time_total{pid="10"} 3.0' in output
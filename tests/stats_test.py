@@ -1,15 +1,35 @@
+import math
 from textwrap import dedent
 
-from lxstats.process import Process
 import pytest
 
+from process_stats_exporter.procfs import (
+    ProcfsProcess,
+    ProcReader,
+)
+from process_stats_exporter.sample import SampleStore
 from process_stats_exporter.stats import (
+    create_collectors,
+    ProcessFdStatsCollector,
+    ProcessMemoryMapsStatsCollector,
     ProcessStatsCollector,
     ProcessTasksStatsCollector,
+    STAT_GROUPS,
     StatsCollector,
 )
 
 
+def collect(collector, process):
+    """Return values collected for a process, by metric name."""
+    store = SampleStore(config.name for config in collector.metrics())
+    store.add_process(process.pid)
+    collector.collect(process, store)
+    return {
+        name: None if math.isnan(column[0]) else column[0]
+        for name, column in store.columns.items()
+    }
+
+
 class TestStatsCollector:
     def test_labels_empty(self):
         """By default, no label is applied."""
@@ -29,7 +49,24 @@ class TestStatsCollector:
     def test_collect(self):
         """The collect() method must be implemented by subclasses."""
         with pytest.raises(NotImplementedError):
-            StatsCollector().collect(None)
+            StatsCollector().collect(None, SampleStore(()))
+
+    def test_enabled_groups(self):
+        """Only groups provided by the collector are enabled."""
+        collector = ProcessStatsCollector(groups=["stat", "sched", "tasks"])
+        assert collector.enabled_groups == {"stat", "sched"}
+
+    def test_enabled_groups_default(self):
+        """By default, all groups are enabled."""
+        collector = ProcessStatsCollector()
+        assert collector.enabled_groups == {
+            "stat",
+            "status",
+            "sched",
+            "threads",
+            "cpu",
+            "io",
+        }
 
 
 class TestProcessStatsCollector:
@@ -45,6 +82,10 @@ class TestProcessStatsCollector:
             "proc_min_fault",
             "proc_ctx_involuntary",
             "proc_ctx_voluntary",
+            "proc_threads",
+            "proc_cpu",
+            "proc_io_read_bytes",
+            "proc_io_write_bytes",
         ]
 
     def test_collect(self, make_process_dir):
@@ -60,8 +101,18 @@ class TestProcessStatsCollector:
                 """
             )
         )
-        process = Process(10, process_dir)
-        assert ProcessStatsCollector().collect(process) == {
+        (process_dir / "io").write_text(
+            dedent(
+                """\
+                rchar: 100
+                wchar: 200
+                read_bytes: 300
+                write_bytes: 400
+                """
+            )
+        )
+        process = ProcfsProcess(10, process_dir)
+        assert collect(ProcessStatsCollector(), process) == {
             "proc_time_user": 13,
             "proc_time_system": 14,
             "proc_mem_rss": 23,
@@ -70,7 +121,66 @@ class TestProcessStatsCollector:
             "proc_min_fault": 9,
             "proc_ctx_involuntary": 1000,
             "proc_ctx_voluntary": 2000,
+            "proc_threads": 19,
+            "proc_cpu": 38,
+            "proc_io_read_bytes": 300,
+            "proc_io_write_bytes": 400,
+        }
+
+    def test_collect_missing(self, make_process_dir):
+        """If files can't be read, values are empty."""
+        process = ProcfsProcess(10, make_process_dir(10))
+        collector = ProcessStatsCollector(groups=["threads", "io"])
+        assert collect(collector, process) == {
+            "proc_threads": None,
+            "proc_io_read_bytes": None,
+            "proc_io_write_bytes": None,
+        }
+
+    def test_metrics_groups(self):
+        """Only metrics for enabled groups are returned."""
+        metrics = ProcessStatsCollector(groups=["status", "sched"]).metrics()
+        assert [metric.name for metric in metrics] == [
+            "proc_mem_rss_max",
+            "proc_ctx_involuntary",
+            "proc_ctx_voluntary",
+        ]
+
+    def test_collect_groups(self, make_process_dir):
+        """Files for groups that are not enabled are not read."""
+        process_dir = make_process_dir(10)
+        (process_dir / "stat").write_text(" ".join(str(i) for i in range(45)))
+        process = ProcfsProcess(10, process_dir)
+        reader = ProcReader()
+        collector = ProcessStatsCollector(reader=reader, groups=["stat"])
+        assert collect(collector, process) == {
+            "proc_time_user": 13,
+            "proc_time_system": 14,
+            "proc_mem_rss": 23,
+            "proc_maj_fault": 11,
+            "proc_min_fault": 9,
         }
+        assert reader.files_opened == 1
+
+    def test_collect_starttime(self, make_process_dir):
+        """The start time is set in the store, read along with stats."""
+        process_dir = make_process_dir(10)
+        (process_dir / "stat").write_text(" ".join(str(i) for i in range(45)))
+        reader = ProcReader()
+        collector = ProcessStatsCollector(reader=reader, groups=["stat"])
+        store = SampleStore(config.name for config in collector.metrics())
+        store.add_process(10)
+        collector.collect(ProcfsProcess(10, process_dir), store)
+        assert store.starttime(0) == 21
+        assert reader.files_opened == 1
+
+    def test_collect_starttime_missing(self, make_process_dir):
+        """The start time is not set if it can't be read."""
+        collector = ProcessStatsCollector(groups=["status"])
+        store = SampleStore(config.name for config in collector.metrics())
+        store.add_process(10)
+        collector.collect(ProcfsProcess(10, make_process_dir(10)), store)
+        assert store.starttime(0) is None
 
 
 class TestProcessTasksStatsCollector:
@@ -93,10 +203,116 @@ class TestProcessTasksStatsCollector:
         (process_dir / "task/456/stat").write_text("1 2 R")
         (process_dir / "task/789").mkdir(parents=True)
         (process_dir / "task/789/stat").write_text("1 2 R")
-        process = Process(10, process_dir)
-        assert ProcessTasksStatsCollector().collect(process), {
+        process = ProcfsProcess(10, process_dir)
+        assert collect(ProcessTasksStatsCollector(), process), {
             "proc_tasks_count": 3,
             "proc_tasks_state_running": 2,
             "proc_tasks_state_sleeping": 0,
             "proc_tasks_state_uninterruptible_sleep": 1,
         }
+
+    def test_collect_no_tasks(self, make_process_dir):
+        """If tasks can't be read, values are empty."""
+        process = ProcfsProcess(10, make_process_dir(10))
+        assert collect(ProcessTasksStatsCollector(), process) == {
+            "proc_tasks_count": None,
+            "proc_tasks_state_running": None,
+            "proc_tasks_state_sleeping": None,
+            "proc_tasks_state_uninterruptible_sleep": None,
+        }
+
+
+class TestProcessFdStatsCollector:
+    def test_metrics(self):
+        """The list of process metrics is returned."""
+        metrics = ProcessFdStatsCollector().metrics()
+        assert [metric.name for metric in metrics] == ["proc_fd_count"]
+
+    def test_collect(self, make_process_dir):
+        """Open file descriptors for a process are counted."""
+        process_dir = make_process_dir(10)
+        (process_dir / "fd").mkdir()
+        for fd in range(3):
+            (process_dir / "fd" / str(fd)).symlink_to("/dev/null")
+        process = ProcfsProcess(10, process_dir)
+        assert collect(ProcessFdStatsCollector(), process) == {
+            "proc_fd_count": 3
+        }
+
+    def test_collect_no_fds(self, make_process_dir):
+        """If file descriptors can't be read, the value is empty."""
+        process = ProcfsProcess(10, make_process_dir(10))
+        assert collect(ProcessFdStatsCollector(), process) == {
+            "proc_fd_count": None
+        }
+
+
+class TestProcessMemoryMapsStatsCollector:
+    def test_metrics(self):
+        """The list of process metrics is returned."""
+        metrics = ProcessMemoryMapsStatsCollector().metrics()
+        assert [metric.name for metric in metrics] == [
+            "proc_mem_pss",
+            "proc_mem_uss",
+        ]
+
+    def test_collect(self, make_process_dir):
+        """PSS and USS for a process are collected."""
+        process_dir = make_process_dir(10)
+        (process_dir / "smaps_rollup").write_text(
+            dedent(
+                """\
+                00400000-7ffe8c3fe000 ---p 00000000 00:00 0 [rollup]
+                Rss:                 400 kB
+                Pss:                 300 kB
+                Shared_Clean:        100 kB
+                Private_Clean:        50 kB
+                Private_Dirty:       150 kB
+                """
+            )
+        )
+        process = ProcfsProcess(10, process_dir)
+        assert collect(ProcessMemoryMapsStatsCollector(), process) == {
+            "proc_mem_pss": 307200,
+            "proc_mem_uss": 204800,
+        }
+
+    def test_collect_missing(self, make_process_dir):
+        """If the file can't be read, values are empty."""
+        process = ProcfsProcess(10, make_process_dir(10))
+        assert collect(ProcessMemoryMapsStatsCollector(), process) == {
+            "proc_mem_pss": None,
+            "proc_mem_uss": None,
+        }
+
+
+class TestCreateCollectors:
+    def test_all_groups(self):
+        """By default, collectors for all groups are returned."""
+        collectors = create_collectors(labels=["pid"])
+        assert [type(collector) for collector in collectors] == [
+            ProcessStatsCollector,
+            ProcessTasksStatsCollector,
+        ]
+        assert all(collector.labels == ["pid"] for collector in collectors)
+
+    def test_opt_in_groups(self):
+        """Collectors for opt-in groups are created if requested."""
+        collectors = create_collectors(STAT_GROUPS)
+        assert [type(collector) for collector in collectors] == [
+            ProcessStatsCollector,
+            ProcessTasksStatsCollector,
+            ProcessFdStatsCollector,
+            ProcessMemoryMapsStatsCollector,
+        ]
+
+    def test_groups(self):
+        """Collectors not providing any of the groups are not created."""
+        [collector] = create_collectors(["tasks"])
+        assert isinstance(collector, ProcessTasksStatsCollector)
+
+    def test_reader(self):
+        """The reader is shared by collectors."""
+        reader = ProcReader()
+        collectors = create_collectors(reader=reader)
+        assert all(collector._reader is reader for collector in collectors)